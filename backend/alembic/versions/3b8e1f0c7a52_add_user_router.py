@@ -0,0 +1,29 @@
+"""Add router assignment to users
+
+Revision ID: 3b8e1f0c7a52
+Revises: f99c672f269e
+Create Date: 2026-10-17 09:12:41.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b8e1f0c7a52'
+down_revision: Union[str, Sequence[str], None] = 'f99c672f269e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Existing users stay NULL, which means the default (first) router
+    op.add_column('users', sa.Column('router', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('users', 'router')
@@ -0,0 +1,55 @@
+"""Add usage samples and rollups
+
+Revision ID: 5e0a7b3c9d21
+Revises: c41f9a2d6e08
+Create Date: 2026-10-17 15:22:17.940352
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e0a7b3c9d21'
+down_revision: Union[str, Sequence[str], None] = 'c41f9a2d6e08'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'usage_samples',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=False),
+        sa.Column('bytes_in', sa.BigInteger(), nullable=False),
+        sa.Column('bytes_out', sa.BigInteger(), nullable=False),
+        sa.Column('uptime_seconds', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_usage_samples_user_time', 'usage_samples', ['user_id', 'timestamp'], unique=False)
+    op.create_table(
+        'usage_rollups',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('period', sa.String(), nullable=False),
+        sa.Column('bucket', sa.DateTime(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('plan_type', sa.String(), nullable=False),
+        sa.Column('bytes_in', sa.BigInteger(), nullable=False),
+        sa.Column('bytes_out', sa.BigInteger(), nullable=False),
+        sa.Column('uptime_seconds', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('period', 'user_id', 'bucket', name='uq_usage_rollups_period_user_bucket'),
+    )
+    op.create_index('ix_usage_rollups_plan_period_bucket', 'usage_rollups', ['plan_type', 'period', 'bucket'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_usage_rollups_plan_period_bucket', table_name='usage_rollups')
+    op.drop_table('usage_rollups')
+    op.drop_index('ix_usage_samples_user_time', table_name='usage_samples')
+    op.drop_table('usage_samples')
@@ -0,0 +1,42 @@
+"""Add desired/router state to users for the reconciler
+
+Revision ID: 7d2c4a9e5b13
+Revises: 3b8e1f0c7a52
+Create Date: 2026-10-17 11:40:08.204117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d2c4a9e5b13'
+down_revision: Union[str, Sequence[str], None] = '3b8e1f0c7a52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('users', sa.Column('desired_state', sa.String(), server_default='enabled', nullable=False))
+    op.add_column('users', sa.Column('router_state', sa.String(), nullable=True))
+    op.add_column('users', sa.Column('reconcile_error', sa.String(), nullable=True))
+    op.create_index(op.f('ix_users_desired_state'), 'users', ['desired_state'], unique=False)
+
+    # Existing users were provisioned synchronously, so the router already
+    # matches is_active; the reconciler's first full diff corrects any drift
+    op.execute(
+        "UPDATE users SET "
+        "desired_state = CASE WHEN is_active THEN 'enabled' ELSE 'disabled' END, "
+        "router_state = CASE WHEN is_active THEN 'enabled' ELSE 'disabled' END"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_users_desired_state'), table_name='users')
+    op.drop_column('users', 'reconcile_error')
+    op.drop_column('users', 'router_state')
+    op.drop_column('users', 'desired_state')
@@ -0,0 +1,56 @@
+"""Add indexes for the hot query paths
+
+Revision ID: 9a4d2f6b1c37
+Revises: 5e0a7b3c9d21
+Create Date: 2026-10-17 18:05:41.512093
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9a4d2f6b1c37'
+down_revision: Union[str, Sequence[str], None] = '5e0a7b3c9d21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (name, table, columns, partial index predicate per dialect)
+INDEXES = [
+    # Expiry sweep: active users past their expiry
+    ('ix_users_active_expiry', 'users', ['expiry'],
+     {'postgresql_where': sa.text('is_active = true'), 'sqlite_where': sa.text('is_active = 1')}),
+    # /expired
+    ('ix_users_expiry', 'users', ['expiry'], {}),
+    # /stats counts live/active/expired users from the index alone
+    ('ix_users_state_active_expiry', 'users', ['desired_state', 'is_active', 'expiry'], {}),
+    # Reconciler: users whose router state differs from the desired state
+    ('ix_users_reconcile_pending', 'users', ['id'],
+     {'postgresql_where': sa.text('router_state IS NULL OR router_state != desired_state'),
+      'sqlite_where': sa.text('router_state IS NULL OR router_state != desired_state')}),
+    ('ix_payments_user_id', 'payments', ['user_id'], {}),
+    ('ix_payment_transactions_user_id', 'payment_transactions', ['user_id'], {}),
+    ('ix_payment_transactions_created_at', 'payment_transactions', ['created_at'], {}),
+    ('ix_payment_transactions_status_created', 'payment_transactions', ['status', 'created_at'], {}),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY keeps the tables writable while PostgreSQL builds the
+    # indexes; it cannot run inside the migration transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True, **where)
+        # Covered by ix_users_state_active_expiry
+        op.drop_index('ix_users_desired_state', table_name='users', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index('ix_users_desired_state', 'users', ['desired_state'], unique=False, postgresql_concurrently=True)
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
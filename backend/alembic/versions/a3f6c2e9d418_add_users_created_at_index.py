@@ -0,0 +1,31 @@
+"""Add an index on users.created_at for /users
+
+Revision ID: a3f6c2e9d418
+Revises: b6f3d9a1c845
+Create Date: 2026-10-18 10:42:17.305126
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3f6c2e9d418'
+down_revision: Union[str, Sequence[str], None] = 'b6f3d9a1c845'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # /users pages newest first by created_at
+    with op.get_context().autocommit_block():
+        op.create_index('ix_users_created_at', 'users', ['created_at'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_users_created_at', table_name='users', postgresql_concurrently=True)
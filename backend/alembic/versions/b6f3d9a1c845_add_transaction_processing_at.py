@@ -0,0 +1,28 @@
+"""Add payment_transactions.processing_at
+
+Revision ID: b6f3d9a1c845
+Revises: e8c1a4f7b290
+Create Date: 2026-10-17 23:58:13.640271
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b6f3d9a1c845'
+down_revision: Union[str, Sequence[str], None] = 'e8c1a4f7b290'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('payment_transactions', sa.Column('processing_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('payment_transactions', 'processing_at')
@@ -0,0 +1,36 @@
+"""Add sync_state for incremental user sync
+
+Revision ID: c41f9a2d6e08
+Revises: 7d2c4a9e5b13
+Create Date: 2026-10-17 13:05:52.771930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41f9a2d6e08'
+down_revision: Union[str, Sequence[str], None] = '7d2c4a9e5b13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'sync_state',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('cursor', sa.Integer(), nullable=True),
+        sa.Column('last_run_at', sa.DateTime(), nullable=True),
+        sa.Column('last_pass_completed_at', sa.DateTime(), nullable=True),
+        sa.Column('last_report', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('name'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('sync_state')
@@ -0,0 +1,138 @@
+"""Structured, month-partitioned logs and log rollups
+
+Revision ID: d5b8e2f4a016
+Revises: 9a4d2f6b1c37
+Create Date: 2026-10-17 21:12:08.334716
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5b8e2f4a016'
+down_revision: Union[str, Sequence[str], None] = '9a4d2f6b1c37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Monthly partitions created past the current month (log_retention keeps this up)
+PARTITIONS_AHEAD = 2
+
+INDEXES = [
+    ('ix_logs_id', ['id'], {}),
+    ('ix_logs_timestamp', ['timestamp'], {}),
+    ('ix_logs_user_time', ['user_id', 'timestamp'], {}),
+    ('ix_logs_tx_ref_time', ['tx_ref', 'timestamp'],
+     {'postgresql_where': sa.text('tx_ref IS NOT NULL'), 'sqlite_where': sa.text('tx_ref IS NOT NULL')}),
+    ('ix_logs_type_time', ['event_type', 'timestamp'], {}),
+]
+
+
+def month_start(value, offset=0):
+    index = value.year * 12 + value.month - 1 + offset
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'log_rollups',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.DateTime(), nullable=False),
+        sa.Column('event_type', sa.String(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('day', 'event_type', name='uq_log_rollups_day_type'),
+    )
+
+    if op.get_bind().dialect.name != 'postgresql':
+        op.execute("UPDATE logs SET timestamp = CURRENT_TIMESTAMP WHERE timestamp IS NULL")
+        with op.batch_alter_table('logs') as batch_op:
+            batch_op.alter_column('timestamp', existing_type=sa.DateTime(), nullable=False)
+            batch_op.add_column(sa.Column('event_type', sa.String(), nullable=True))
+            batch_op.add_column(sa.Column('user_id', sa.Integer(), nullable=True))
+            batch_op.add_column(sa.Column('tx_ref', sa.String(), nullable=True))
+            batch_op.add_column(sa.Column('payload', sa.JSON(), nullable=True))
+        for name, columns, where in INDEXES[1:]:
+            op.create_index(name, 'logs', columns, unique=False, **where)
+        return
+
+    # PostgreSQL: rebuild logs as a table partitioned by month. The primary
+    # key of a partitioned table must include the partition key.
+    op.execute("ALTER TABLE logs RENAME TO logs_unpartitioned")
+    op.execute("ALTER TABLE logs_unpartitioned RENAME CONSTRAINT logs_pkey TO logs_unpartitioned_pkey")
+    op.execute("ALTER INDEX ix_logs_id RENAME TO ix_logs_unpartitioned_id")
+    op.execute("ALTER SEQUENCE logs_id_seq OWNED BY NONE")
+    op.execute(
+        """
+        CREATE TABLE logs (
+            id INTEGER NOT NULL DEFAULT nextval('logs_id_seq'),
+            event VARCHAR NOT NULL,
+            timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            event_type VARCHAR,
+            user_id INTEGER,
+            tx_ref VARCHAR,
+            payload JSON,
+            CONSTRAINT logs_pkey PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+        """
+    )
+    op.execute("ALTER SEQUENCE logs_id_seq OWNED BY logs.id")
+    op.execute("CREATE TABLE logs_default PARTITION OF logs DEFAULT")
+
+    now = datetime.utcnow()
+    first = op.get_bind().execute(sa.text("SELECT min(timestamp) FROM logs_unpartitioned")).scalar()
+    month = month_start(min(first or now, now))
+    while month <= month_start(now, PARTITIONS_AHEAD):
+        op.execute(
+            f"CREATE TABLE logs_{month:%Y_%m} PARTITION OF logs "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{month_start(month, 1):%Y-%m-%d}')"
+        )
+        month = month_start(month, 1)
+
+    op.execute(
+        "INSERT INTO logs (id, event, timestamp) "
+        "SELECT id, event, COALESCE(timestamp, now() AT TIME ZONE 'utc') FROM logs_unpartitioned"
+    )
+    op.execute("DROP TABLE logs_unpartitioned")
+    for name, columns, where in INDEXES:
+        op.create_index(name, 'logs', columns, unique=False, **where)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name != 'postgresql':
+        for name, _, _ in reversed(INDEXES[1:]):
+            op.drop_index(name, table_name='logs')
+        with op.batch_alter_table('logs') as batch_op:
+            batch_op.drop_column('payload')
+            batch_op.drop_column('tx_ref')
+            batch_op.drop_column('user_id')
+            batch_op.drop_column('event_type')
+            batch_op.alter_column('timestamp', existing_type=sa.DateTime(), nullable=True)
+    else:
+        # Back to one plain table; the structured columns are lost
+        op.execute("ALTER TABLE logs RENAME TO logs_partitioned")
+        op.execute("ALTER TABLE logs_partitioned RENAME CONSTRAINT logs_pkey TO logs_partitioned_pkey")
+        for name, _, _ in INDEXES:
+            op.execute(f"ALTER INDEX {name} RENAME TO {name.replace('ix_logs', 'ix_logs_partitioned')}")
+        op.execute("ALTER SEQUENCE logs_id_seq OWNED BY NONE")
+        op.execute(
+            """
+            CREATE TABLE logs (
+                id INTEGER NOT NULL DEFAULT nextval('logs_id_seq'),
+                event VARCHAR NOT NULL,
+                timestamp TIMESTAMP WITHOUT TIME ZONE,
+                CONSTRAINT logs_pkey PRIMARY KEY (id)
+            )
+            """
+        )
+        op.execute("ALTER SEQUENCE logs_id_seq OWNED BY logs.id")
+        op.execute("INSERT INTO logs (id, event, timestamp) SELECT id, event, timestamp FROM logs_partitioned")
+        op.execute("DROP TABLE logs_partitioned")  # drops every partition with it
+        op.create_index('ix_logs_id', 'logs', ['id'], unique=False)
+
+    op.drop_table('log_rollups')
@@ -0,0 +1,52 @@
+"""Add webhook job queue
+
+Revision ID: e8c1a4f7b290
+Revises: d5b8e2f4a016
+Create Date: 2026-10-17 23:40:52.118407
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8c1a4f7b290'
+down_revision: Union[str, Sequence[str], None] = 'd5b8e2f4a016'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'webhook_jobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('source', sa.String(), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('tx_ref', sa.String(), nullable=True),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('run_at', sa.DateTime(), nullable=False),
+        sa.Column('locked_at', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('result', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('completed_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(
+        'ix_webhook_jobs_due', 'webhook_jobs', ['run_at'], unique=False,
+        postgresql_where=sa.text("status = 'pending'"), sqlite_where=sa.text("status = 'pending'"),
+    )
+    op.create_index('ix_webhook_jobs_status_created', 'webhook_jobs', ['status', 'created_at'], unique=False)
+    op.create_index('ix_webhook_jobs_tx_ref', 'webhook_jobs', ['tx_ref'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_webhook_jobs_tx_ref', table_name='webhook_jobs')
+    op.drop_index('ix_webhook_jobs_status_created', table_name='webhook_jobs')
+    op.drop_index('ix_webhook_jobs_due', table_name='webhook_jobs')
+    op.drop_table('webhook_jobs')
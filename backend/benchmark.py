@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the backend's hot functions, with regression tracking.
+
+Each benchmark is timed in rounds (loops per round are calibrated so a round
+takes at least --min-time seconds); the best round gives the per-call time.
+Results are compared with a baseline file and the run fails (exit code 1)
+when any benchmark is more than --threshold slower than its baseline.
+
+    python benchmark.py --save            # record a baseline on this machine
+    python benchmark.py                   # compare against it
+    python benchmark.py --only db. --rows 20000
+
+The database benchmarks run against a fresh SQLite file seeded with --rows
+users unless --database-url is given. Baselines are only comparable on the
+machine (and database) they were recorded on.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import struct
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BACKEND_DIR, "benchmark_baseline.json")
+
+BENCHMARKS = {}  # name -> setup(context) returning the callable to time
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+# ==================== BENCHMARKS ====================
+
+
+@benchmark("calculate_expiry")
+def bench_calculate_expiry(ctx):
+    calculate_expiry = ctx["main"].calculate_expiry
+    return lambda: calculate_expiry("monthly_1000")
+
+
+@benchmark("payment.generate_username")
+def bench_generate_username(ctx):
+    return ctx["payment_service"].generate_username
+
+
+@benchmark("payment.generate_password")
+def bench_generate_password(ctx):
+    return ctx["payment_service"].generate_password
+
+
+@benchmark("payment.get_plan_price")
+def bench_get_plan_price(ctx):
+    get_plan_price = ctx["payment_service"].get_plan_price
+    return lambda: get_plan_price("monthly_1000", 2)
+
+
+@benchmark("whatsapp.format_phone_number")
+def bench_format_phone_number(ctx):
+    format_phone_number = ctx["whatsapp_service"].format_phone_number
+    return lambda: format_phone_number("+255 781-588-379")
+
+
+@benchmark("discovery.parse_mndp_packet")
+def bench_parse_mndp_packet(ctx):
+    from discover_mikrotik import MikroTikDiscovery
+
+    discovery = MikroTikDiscovery()
+    packet = mndp_packet()
+    addr = ("192.168.88.1", 5678)
+    return lambda: discovery._parse_mndp_packet(packet, addr)
+
+
+@benchmark("db.list_users")
+def bench_list_users(ctx):
+    return endpoint_call(ctx, ctx["main"].list_users)
+
+
+@benchmark("stats")
+def bench_stats(ctx):
+    loop = ctx["loop"]
+    get_stats = ctx["main"].get_stats
+    return lambda: loop.run_until_complete(get_stats())
+
+
+@benchmark("db.stats_refresh")
+def bench_stats_refresh(ctx):
+    # The periodic recount behind /stats
+    return ctx["dashboard_counters"].refresh
+
+
+@benchmark("serialize.user_response")
+def bench_user_response(ctx):
+    from typing import List
+
+    from pydantic import TypeAdapter
+
+    # The same validate + dump FastAPI performs for response_model=List[UserResponse]
+    adapter = TypeAdapter(List[ctx["main"].UserResponse])
+    db = ctx["SessionLocal"]()
+    try:
+        users = db.query(ctx["User"]).limit(1000).all()
+        db.expunge_all()
+    finally:
+        db.close()
+    return lambda: adapter.dump_json(adapter.validate_python(users, from_attributes=True))
+
+
+def endpoint_call(ctx, handler):
+    """Call an endpoint the way a request would: fresh async session, awaited on a loop"""
+    loop = ctx["loop"]
+    AsyncSessionLocal = ctx["AsyncSessionLocal"]
+
+    async def request():
+        async with AsyncSessionLocal() as db:
+            return await handler(db=db)
+
+    return lambda: loop.run_until_complete(request())
+
+
+def mndp_packet():
+    """A typical MNDP announcement: header followed by TLV fields"""
+    fields = [
+        (1, bytes.fromhex("4c5e0c123456")),
+        (5, b"MikroTik-Office"),
+        (7, b"7.14.3 (stable)"),
+        (8, b"MikroTik"),
+        (10, struct.pack("<I", 1234567)),
+        (11, b"ABCD-1234"),
+        (12, b"hAP ac^2"),
+        (15, b"bridge"),
+        (17, socket.inet_aton("192.168.88.1")),
+    ]
+    packet = b"\x00\x00\x00\x01"
+    for tlv_type, value in fields:
+        packet += struct.pack("!HH", tlv_type, len(value)) + value
+    return packet
+
+
+# ==================== SETUP ====================
+
+
+def load_context(args):
+    """Import the app against the benchmark database and seed it"""
+    os.environ["DATABASE_URL"] = args.database_url or (
+        "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="benchmark-"), "billing.db")
+    )
+    os.environ.setdefault("ZENOPAY_API_KEY", "benchmark")
+    os.environ["SENTRY_DSN"] = ""
+    sys.path.insert(0, BACKEND_DIR)
+
+    import main
+    from dashboard_counters import dashboard_counters
+    from database import AsyncSessionLocal, Payment, SessionLocal, User, async_engine, init_db
+    from payment_service import payment_service
+    from whatsapp_service import whatsapp_service
+
+    main.scheduler.shutdown(wait=False)
+    init_db()
+    if not args.database_url:
+        seed(SessionLocal, User, Payment, args.rows)
+
+    return {
+        "main": main,
+        "SessionLocal": SessionLocal,
+        "AsyncSessionLocal": AsyncSessionLocal,
+        "async_engine": async_engine,
+        "User": User,
+        "dashboard_counters": dashboard_counters,
+        "payment_service": payment_service,
+        "whatsapp_service": whatsapp_service,
+        "loop": asyncio.new_event_loop(),
+    }
+
+
+def seed(SessionLocal, User, Payment, rows):
+    """rows users (a third expired, a tenth deleted) and half as many payments"""
+    now = datetime.utcnow()
+    users = []
+    for i in range(rows):
+        expired = i % 3 == 0
+        deleted = i % 10 == 0
+        users.append(
+            {
+                "username": f"bench_{i:06d}",
+                "password": "secret12",
+                "plan_type": "daily_1000" if i % 2 else "monthly_1000",
+                "expiry": now + timedelta(days=-1 if expired else 1),
+                "is_active": not expired,
+                "created_at": now - timedelta(minutes=i),
+                "desired_state": "deleted" if deleted else ("disabled" if expired else "enabled"),
+                "router_state": "disabled" if expired else "enabled",
+                "router": "default",
+            }
+        )
+    db = SessionLocal()
+    try:
+        db.bulk_insert_mappings(User, users)
+        db.bulk_insert_mappings(
+            Payment,
+            [
+                {"user_id": i + 1, "amount": 1000, "date": now}
+                for i in range(rows // 2)
+            ],
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+# ==================== MEASUREMENT ====================
+
+
+def measure(func, repeat, min_time):
+    """Per-call seconds of the best and median round"""
+    loops = 1
+    while True:
+        elapsed = time_loops(func, loops)
+        if elapsed >= min_time:
+            break
+        loops *= 2 if elapsed == 0 else max(2, int(min_time / elapsed * 1.2))
+    rounds = sorted([elapsed] + [time_loops(func, loops) for _ in range(repeat - 1)])
+    return {
+        "best": rounds[0] / loops,
+        "median": rounds[len(rounds) // 2] / loops,
+        "loops": loops,
+    }
+
+
+def time_loops(func, loops):
+    started = time.perf_counter()
+    for _ in range(loops):
+        func()
+    return time.perf_counter() - started
+
+
+def format_time(seconds):
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f}ms"
+    return f"{seconds * 1e6:.2f}µs"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark backend hot functions")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline file")
+    parser.add_argument("--save", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown (0.2 = 20%%)")
+    parser.add_argument("--only", default=None, help="Run benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5, help="Rounds per benchmark")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Minimum seconds per round")
+    parser.add_argument("--rows", type=int, default=2000, help="Users seeded for the db benchmarks")
+    parser.add_argument("--database-url", default=None, help="Use an existing database (not seeded)")
+    args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS if not args.only or args.only in name]
+    ctx = load_context(args)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get("results", {})
+    elif not args.save:
+        print(f"No baseline at {args.baseline}; run with --save to record one")
+
+    results = {}
+    regressions = []
+    print(f"\n{'benchmark':<32}{'best':>12}{'median':>12}{'baseline':>12}{'change':>10}")
+    print("-" * 78)
+    for name in names:
+        result = measure(BENCHMARKS[name](ctx), args.repeat, args.min_time)
+        results[name] = result
+        line = f"{name:<32}{format_time(result['best']):>12}{format_time(result['median']):>12}"
+        previous = baseline.get(name)
+        if previous:
+            change = result["best"] / previous["best"] - 1
+            line += f"{format_time(previous['best']):>12}{change:>+9.0%}"
+            if change > args.threshold:
+                regressions.append(name)
+                line += "  ✗ REGRESSION"
+        print(line)
+    # Close the pooled async connections so their driver threads let the process exit
+    ctx["loop"].run_until_complete(ctx["async_engine"].dispose())
+
+    if args.save:
+        # Keep baselines of benchmarks that were not part of this run
+        saved = dict(baseline)
+        saved.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(
+                {"recorded_at": datetime.utcnow().isoformat(), "rows": args.rows, "results": saved},
+                f,
+                indent=2,
+            )
+        print(f"\n✓ Baseline saved to {args.baseline}")
+    elif regressions:
+        print(f"\n✗ {len(regressions)} benchmark(s) regressed more than {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+    elif baseline:
+        print(f"\n✓ No regressions beyond {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import asyncio
+import os
+import time
+
+# Consecutive failures that open the breaker, and seconds before it probes again
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("MIKROTIK_BREAKER_THRESHOLD", "3"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("MIKROTIK_BREAKER_RESET", "15"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency the breaker considers down"""
+
+
+class CircuitBreaker:
+    """
+    Fail fast while a dependency is down.
+
+    closed: calls go through; ``failure_threshold`` consecutive failures
+        open the breaker.
+    open: calls fail immediately with CircuitOpenError. After
+        ``reset_timeout`` seconds the next caller starts one shared probe
+        and the breaker goes half-open.
+    half_open: calls keep failing fast while the single probe runs; its
+        success closes the breaker, its failure re-opens it for another
+        ``reset_timeout``.
+
+    Must be used from one event loop (the router loop).
+    """
+
+    def __init__(
+        self,
+        name,
+        probe,
+        failure_threshold=BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=BREAKER_RESET_TIMEOUT,
+    ):
+        self.name = name
+        self._probe = probe  # coroutine function; raises if still down
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+        self.rejected = 0
+        self.trips = 0
+        self._probe_task = None
+
+    async def check(self):
+        """Raise CircuitOpenError unless calls may go through right now"""
+        if self.state == CLOSED:
+            return
+        if self.state == OPEN and time.time() - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+            self._probe_task = asyncio.create_task(self._run_probe())
+        self.rejected += 1
+        retry_in = max(0.0, self.reset_timeout - (time.time() - self.opened_at))
+        raise CircuitOpenError(
+            f"{self.name} unavailable ({self.state}, last error: {self.last_error}); "
+            f"retry in {retry_in:.0f}s"
+        )
+
+    def record_success(self):
+        if self.state != CLOSED:
+            print(f"✓ [{self.name}] circuit closed - router reachable again")
+        self.state = CLOSED
+        self.failures = 0
+        self.last_error = None
+
+    def record_failure(self, error):
+        self.failures += 1
+        self.last_error = str(error) or type(error).__name__
+        if self.state == CLOSED and self.failures >= self.failure_threshold:
+            self._trip()
+
+    def _trip(self):
+        self.state = OPEN
+        self.opened_at = time.time()
+        self.trips += 1
+        print(
+            f"✗ [{self.name}] circuit open after {self.failures} failures "
+            f"({self.last_error}) - failing fast for {self.reset_timeout:.0f}s"
+        )
+
+    async def _run_probe(self):
+        try:
+            await self._probe()
+        except Exception as e:
+            self.last_error = str(e) or type(e).__name__
+            self._trip()
+        else:
+            self.record_success()
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "opened_at": self.opened_at,
+            "trips": self.trips,
+            "rejected": self.rejected,
+        }
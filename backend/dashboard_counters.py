@@ -0,0 +1,215 @@
+import heapq
+import os
+import threading
+from datetime import datetime
+
+from database import Payment, PaymentTransaction, SessionLocal, User
+from sqlalchemy import func
+
+# Minutes between full recounts that correct any drift in the counters
+STATS_REFRESH_MINUTES = float(os.getenv("STATS_REFRESH_MINUTES", "5"))
+
+
+def snapshot(user):
+    """(is_active, expiry) of a user as /stats counts it; None once it is deleted"""
+    if user is None or user.desired_state == "deleted":
+        return None
+    return (bool(user.is_active), user.expiry)
+
+
+class DashboardCounters:
+    """
+    /stats figures kept in memory instead of counted on every request.
+
+    ``refresh()`` counts everything once (at startup and then every
+    ``STATS_REFRESH_MINUTES``); between refreshes the write paths report
+    their changes:
+
+    - ``user_changed(user_id, before, after)`` with the ``snapshot()`` of
+      the user before and after the write (None = not a live user)
+    - ``users_disabled(count)`` after the expiry sweep
+    - ``payment_recorded(amount, at)`` and ``revenue_received(amount, at)``
+
+    A user becomes expired by the clock, not by a write, so live users
+    whose expiry is still ahead are kept in a min-heap and moved to the
+    expired count as their expiry passes. Revenue is kept for the current
+    day and month only and starts again from zero when they roll over.
+
+    Reading is constant time. A write racing a refresh can leave a figure
+    off by one until the next refresh corrects it; ``stats()`` reports the
+    corrections the last refresh made.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.loaded = False
+        self.total_users = 0
+        self.active_users = 0
+        self.expired_users = 0
+        self.total_payments = 0
+        self._heap = []  # (expiry, user id) of live users not expired yet
+        self._upcoming = {}  # user id -> expiry, the heap's current entries
+        self._day = None  # (date, revenue)
+        self._month = None  # ((year, month), revenue)
+
+        self.refreshes = 0
+        self.last_refresh_at = None
+        self.last_corrections = {}
+
+    def refresh(self):
+        """Recount every figure from the database"""
+        now = datetime.utcnow()
+        day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        month_start = day_start.replace(day=1)
+        live = User.desired_state != "deleted"
+        db = SessionLocal()
+        try:
+            total_users, active_users = db.query(
+                func.count(), func.count().filter(User.is_active == True)
+            ).filter(live).one()
+            upcoming = db.query(User.id, User.expiry).filter(live, User.expiry >= now).all()
+            total_payments = db.query(func.count(Payment.id)).scalar()
+
+            revenue_day = revenue_month = 0
+            for amount, at in (
+                (Payment.amount, Payment.date),
+                (PaymentTransaction.amount, PaymentTransaction.completed_at),
+            ):
+                day, month = (
+                    db.query(
+                        func.coalesce(func.sum(amount).filter(at >= day_start), 0),
+                        func.coalesce(func.sum(amount), 0),
+                    )
+                    .select_from(amount.class_)
+                    .filter(at >= month_start)
+                    .one()
+                )
+                revenue_day += day
+                revenue_month += month
+        finally:
+            db.close()
+
+        with self._lock:
+            before = self._figures(now) if self.loaded else None
+            self.total_users = total_users
+            self.active_users = active_users
+            self.expired_users = total_users - len(upcoming)
+            self.total_payments = total_payments
+            self._upcoming = {user_id: expiry for user_id, expiry in upcoming}
+            self._heap = [(expiry, user_id) for user_id, expiry in upcoming]
+            heapq.heapify(self._heap)
+            self._day = (now.date(), revenue_day)
+            self._month = ((now.year, now.month), revenue_month)
+
+            after = self._figures(now)
+            if before is not None:
+                self.last_corrections = {
+                    name: after[name] - before[name]
+                    for name in after
+                    if after[name] != before[name]
+                }
+            self.loaded = True
+            self.refreshes += 1
+            self.last_refresh_at = now
+
+    def user_changed(self, user_id, before, after):
+        """Move one user from its ``before`` snapshot to ``after``"""
+        if before == after:
+            return
+        with self._lock:
+            if not self.loaded:
+                return
+            self._advance(datetime.utcnow())
+            if before is not None:
+                self._count_user(user_id, before, -1)
+            if after is not None:
+                self._count_user(user_id, after, 1)
+
+    def users_disabled(self, count):
+        """``count`` expired active users were switched off"""
+        with self._lock:
+            if self.loaded:
+                self.active_users -= count
+
+    def payment_recorded(self, amount, at=None):
+        with self._lock:
+            if self.loaded:
+                self.total_payments += 1
+                self._add_revenue(amount, at or datetime.utcnow())
+
+    def revenue_received(self, amount, at=None):
+        """A ZenoPay transaction completed"""
+        with self._lock:
+            if self.loaded:
+                self._add_revenue(amount, at or datetime.utcnow())
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._figures(datetime.utcnow()),
+                "refreshed_at": self.last_refresh_at,
+            }
+
+    def status(self):
+        """Refresh bookkeeping for troubleshooting drift"""
+        with self._lock:
+            return {
+                "refreshes": self.refreshes,
+                "last_refresh_at": self.last_refresh_at,
+                "last_corrections": self.last_corrections,
+                "upcoming_expiries": len(self._upcoming),
+            }
+
+    def _figures(self, now):
+        """The /stats figures (lock held)"""
+        self._advance(now)
+        revenue_today = self._day[1] if self._day and self._day[0] == now.date() else 0
+        month = (now.year, now.month)
+        revenue_month = self._month[1] if self._month and self._month[0] == month else 0
+        return {
+            "total_users": self.total_users,
+            "active_users": self.active_users,
+            "expired_users": self.expired_users,
+            "total_payments": self.total_payments,
+            "revenue_today": revenue_today,
+            "revenue_month": revenue_month,
+        }
+
+    def _advance(self, now):
+        """Count the users whose expiry has passed as expired (lock held)"""
+        while self._heap and self._heap[0][0] < now:
+            expiry, user_id = heapq.heappop(self._heap)
+            if self._upcoming.get(user_id) == expiry:
+                del self._upcoming[user_id]
+                self.expired_users += 1
+
+    def _count_user(self, user_id, state, sign):
+        """Add (sign 1) or remove (sign -1) one live user (lock held, clock advanced)"""
+        is_active, expiry = state
+        self.total_users += sign
+        self.active_users += sign if is_active else 0
+        if sign < 0:
+            if self._upcoming.pop(user_id, None) is None:
+                self.expired_users -= 1
+        elif expiry < datetime.utcnow():
+            self.expired_users += 1
+        else:
+            # A stale heap entry for this user is skipped when popped
+            self._upcoming[user_id] = expiry
+            heapq.heappush(self._heap, (expiry, user_id))
+
+    def _add_revenue(self, amount, at):
+        """Add to today's and this month's revenue (lock held)"""
+        now = datetime.utcnow()
+        if not self._day or self._day[0] != now.date():
+            self._day = (now.date(), 0)
+        if not self._month or self._month[0] != (now.year, now.month):
+            self._month = ((now.year, now.month), 0)
+        if at.date() == now.date():
+            self._day = (self._day[0], self._day[1] + amount)
+        if (at.year, at.month) == (now.year, now.month):
+            self._month = (self._month[0], self._month[1] + amount)
+
+
+# Global instance
+dashboard_counters = DashboardCounters()
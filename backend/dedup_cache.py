@@ -0,0 +1,74 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds a processed payment notification is remembered
+WEBHOOK_DEDUP_TTL = float(os.getenv("WEBHOOK_DEDUP_TTL", "600"))
+# Notifications remembered at most (the oldest are forgotten first)
+WEBHOOK_DEDUP_MAX = int(os.getenv("WEBHOOK_DEDUP_MAX", "10000"))
+
+
+class DedupCache:
+    """
+    Short-lived memory of recently seen keys, e.g. (tx_ref, status) of
+    payment notifications, so a retry storm is answered without touching
+    the database or the router.
+
+    Per process and best effort: a miss (expired, evicted, another worker
+    process) is always safe because the database transition in
+    process_payment_webhook is what guarantees a payment is applied once.
+    """
+
+    def __init__(self, ttl=WEBHOOK_DEDUP_TTL, max_size=WEBHOOK_DEDUP_MAX):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # key -> expires at, oldest first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def seen(self, key):
+        """True if ``key`` was added within the TTL"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if key in self._entries:
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def add(self, key):
+        now = time.monotonic()
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = now + self.ttl
+            self._expire(now)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _expire(self, now):
+        while self._entries:
+            key, expires = next(iter(self._entries.items()))
+            if expires > now:
+                break
+            del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "ttl_seconds": self.ttl,
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+# Global instance
+webhook_dedup = DedupCache()
@@ -78,8 +78,9 @@ class MikroTikDiscovery:
                 'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
             }
 
-            # MNDP packets contain TLV (Type-Length-Value) fields
-            offset = 0
+            # MNDP packets have a 4-byte header (type, TTL, sequence number)
+            # followed by TLV (Type-Length-Value) fields
+            offset = 4
             while offset < len(data) - 4:
                 try:
                     # Read TLV header
@@ -114,6 +115,8 @@ class MikroTikDiscovery:
                         device['ipv6'] = tlv_value.decode('utf-8', errors='ignore')
                     elif tlv_type == 15:  # Interface name
                         device['interface'] = tlv_value.decode('utf-8', errors='ignore')
+                    elif tlv_type == 17 and len(tlv_value) == 4:  # IPv4 address
+                        device['ipv4'] = socket.inet_ntoa(tlv_value)
 
                 except Exception as e:
                     # Skip malformed TLV
@@ -0,0 +1,161 @@
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from database import Log, engine
+from sqlalchemy import insert
+
+# Seconds an event may wait in memory before it is written
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "1"))
+# Queued events that trigger a flush without waiting for the interval
+LOG_FLUSH_BATCH = int(os.getenv("LOG_FLUSH_BATCH", "500"))
+# Events held in memory at most; beyond this new events are dropped (and counted)
+LOG_QUEUE_MAX = int(os.getenv("LOG_QUEUE_MAX", "10000"))
+
+# Rows per INSERT statement
+INSERT_CHUNK = 1000
+
+
+class EventLog:
+    """
+    Buffered writer for the ``logs`` audit table.
+
+    ``write()`` only appends to an in-memory queue, so request handlers no
+    longer pay a commit per audit line. A background thread writes the
+    queue with multi-row INSERTs in one transaction every
+    ``flush_interval`` seconds, or as soon as ``flush_batch`` events are
+    waiting, and ``stop()`` writes whatever is left.
+
+    Each event keeps the time it was logged, not the time it was written.
+    A failed flush puts its events back and is retried on the next
+    interval. When the queue is full (the database is down or slower than
+    the event rate) new events are dropped rather than blocking the
+    caller; ``stats()`` reports the queue depth, its high-water mark and
+    the drops.
+    """
+
+    def __init__(self, flush_interval=LOG_FLUSH_INTERVAL, flush_batch=LOG_FLUSH_BATCH, max_queue=LOG_QUEUE_MAX):
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.max_queue = max_queue
+        self._queue = deque()  # Log rows as dicts
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()  # one flush at a time
+        self._stop = False
+        self._thread = None
+        self._dropping = False
+
+        # Counters for /event-log
+        self.written = 0
+        self.flushes = 0
+        self.failures = 0
+        self.dropped = 0
+        self.high_water = 0
+        self.last_flush_at = None
+        self.last_flush_ms = None
+        self.last_error = None
+
+    def write(self, event_type, event, user_id=None, tx_ref=None, payload=None, timestamp=None):
+        """Queue one event; returns False if it was dropped because the queue is full"""
+        row = {
+            "event_type": event_type,
+            "event": event,
+            "user_id": user_id,
+            "tx_ref": tx_ref,
+            "payload": payload or None,
+            "timestamp": timestamp or datetime.utcnow(),
+        }
+        with self._condition:
+            if len(self._queue) >= self.max_queue:
+                if not self._dropping:
+                    print(f"✗ Event log queue full ({self.max_queue} events) - dropping new events")
+                    self._dropping = True
+                self.dropped += 1
+                return False
+            self._dropping = False
+            self._queue.append(row)
+            self.high_water = max(self.high_water, len(self._queue))
+            if len(self._queue) == self.flush_batch:
+                self._condition.notify()
+        return True
+
+    def flush(self):
+        """Write every queued event; returns the number written"""
+        with self._flush_lock:
+            with self._condition:
+                batch = list(self._queue)
+                self._queue.clear()
+            if not batch:
+                return 0
+
+            started = time.perf_counter()
+            try:
+                with engine.begin() as connection:
+                    for start in range(0, len(batch), INSERT_CHUNK):
+                        connection.execute(insert(Log), batch[start:start + INSERT_CHUNK])
+            except Exception as e:
+                # Put the batch back in front of newer events, as far as it fits
+                with self._condition:
+                    room = max(self.max_queue - len(self._queue), 0)
+                    self.dropped += max(len(batch) - room, 0)
+                    self._queue.extendleft(reversed(batch[:room]))
+                self.failures += 1
+                self.last_error = str(e)
+                print(f"✗ Event log flush of {len(batch)} events failed: {e}")
+                return 0
+
+            self.written += len(batch)
+            self.flushes += 1
+            self.last_flush_at = datetime.utcnow()
+            self.last_flush_ms = round((time.perf_counter() - started) * 1000, 1)
+            return len(batch)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name="event-log", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the writer thread and write what is still queued"""
+        with self._condition:
+            self._stop = True
+            self._condition.notify()
+        if self._thread:
+            self._thread.join(timeout=10)
+        self.flush()
+
+    def stats(self):
+        with self._condition:
+            return {
+                "queued": len(self._queue),
+                "max_queue": self.max_queue,
+                "high_water": self.high_water,
+                "dropped": self.dropped,
+                "written": self.written,
+                "flushes": self.flushes,
+                "failures": self.failures,
+                "last_flush_at": self.last_flush_at,
+                "last_flush_ms": self.last_flush_ms,
+                "last_error": self.last_error,
+            }
+
+    def _run(self):
+        failed = False
+        while True:
+            with self._condition:
+                # After a failure wait out the interval even if the queue is full
+                if not self._stop and (failed or len(self._queue) < self.flush_batch):
+                    self._condition.wait(self.flush_interval)
+                if self._stop:
+                    return
+            failures = self.failures
+            self.flush()
+            failed = self.failures != failures
+
+
+# Global instance
+event_log = EventLog()
@@ -0,0 +1,152 @@
+import heapq
+import os
+import threading
+from datetime import datetime, timedelta
+
+from database import SessionLocal, User
+from expiry_sweep import expiry_sweep
+
+# Expiries this close together (seconds) are disabled in one batch; a user
+# is disabled at most this long after its expiry
+EXPIRY_BATCH_WINDOW = float(os.getenv("EXPIRY_BATCH_WINDOW", "5"))
+
+
+class ExpiryScheduler:
+    """
+    Disable users when they expire instead of on the next periodic scan.
+
+    Keeps a min-heap of (expiry, user id) for every active user, loaded from
+    the database at startup and updated by ``schedule()``/``cancel()`` when
+    users are created, extended, toggled or deleted. A background thread
+    sleeps on a Condition until the earliest expiry, waits up to
+    ``batch_window`` seconds more so neighbouring expiries share one router
+    round trip, and passes the due user ids to ``expire(user_ids)``.
+
+    Re-scheduling a user pushes a new heap entry; the old one is skipped
+    when popped because it no longer matches ``_deadlines``.
+    """
+
+    def __init__(self, expire, batch_window=EXPIRY_BATCH_WINDOW):
+        self._expire = expire  # callable(list of user ids)
+        self.batch_window = batch_window
+        self._heap = []
+        self._deadlines = {}  # user id -> current expiry
+        self._condition = threading.Condition()
+        self._stop = False
+        self._thread = None
+
+        # Counters for /stats style reporting
+        self.batches = 0
+        self.expired = 0
+        self.last_batch = None
+        self.max_lateness = 0.0  # seconds between an expiry and its disable
+
+    def load(self):
+        """Rebuild the heap from every active user in the database"""
+        db = SessionLocal()
+        try:
+            rows = (
+                db.query(User.id, User.expiry)
+                .filter(User.is_active == True, User.desired_state != "deleted")
+                .all()
+            )
+        finally:
+            db.close()
+        with self._condition:
+            self._deadlines = {user_id: expiry for user_id, expiry in rows}
+            self._heap = [(expiry, user_id) for user_id, expiry in rows]
+            heapq.heapify(self._heap)
+            self._condition.notify()
+        print(f"✓ Expiry scheduler loaded {len(rows)} active users")
+
+    def schedule(self, user_id, expiry):
+        """Disable ``user_id`` at ``expiry`` (replaces any earlier schedule)"""
+        with self._condition:
+            self._deadlines[user_id] = expiry
+            heapq.heappush(self._heap, (expiry, user_id))
+            if self._heap[0][1] == user_id:
+                self._condition.notify()  # new earliest deadline
+
+    def cancel(self, user_id):
+        with self._condition:
+            self._deadlines.pop(user_id, None)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self.load()
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name="expiry-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stop = True
+            self._condition.notify()
+
+    def stats(self):
+        with self._condition:
+            next_expiry = self._next_deadline()
+            return {
+                "scheduled": len(self._deadlines),
+                "next_expiry": next_expiry,
+                "batches": self.batches,
+                "expired": self.expired,
+                "last_batch": self.last_batch,
+                "max_lateness_seconds": round(self.max_lateness, 3),
+            }
+
+    def _next_deadline(self):
+        """Earliest live deadline, dropping stale heap entries (lock held)"""
+        while self._heap:
+            expiry, user_id = self._heap[0]
+            if self._deadlines.get(user_id) == expiry:
+                return expiry
+            heapq.heappop(self._heap)
+        return None
+
+    def _take_due(self):
+        """Wait for the next batch and remove it from the heap (lock held)"""
+        while not self._stop:
+            first = self._next_deadline()
+            if first is None:
+                self._condition.wait()
+                continue
+            # Hold the batch open a little so close expiries go together
+            release_at = first + timedelta(seconds=self.batch_window)
+            delay = (release_at - datetime.utcnow()).total_seconds()
+            if delay > 0:
+                self._condition.wait(delay)
+                continue
+
+            now = datetime.utcnow()
+            due = []
+            while self._heap and self._heap[0][0] <= now:
+                expiry, user_id = heapq.heappop(self._heap)
+                if self._deadlines.get(user_id) == expiry:
+                    del self._deadlines[user_id]
+                    due.append((expiry, user_id))
+            if due:
+                return due, now
+        return [], None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                due, now = self._take_due()
+            if not due:
+                return  # stopped
+            try:
+                self._expire([user_id for _, user_id in due])
+            except Exception as e:
+                print(f"Expiry batch failed: {e}")
+            self.batches += 1
+            self.expired += len(due)
+            self.last_batch = now
+            self.max_lateness = max(
+                self.max_lateness, (now - min(expiry for expiry, _ in due)).total_seconds()
+            )
+
+
+# Global instance
+expiry_scheduler = ExpiryScheduler(expiry_sweep.run)
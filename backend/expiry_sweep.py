@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from dashboard_counters import dashboard_counters
+from database import SessionLocal, User
+from event_log import event_log
+from reconciler import reconciler
+from sqlalchemy import update
+
+# Recent sweeps kept for the metrics endpoint
+SWEEP_HISTORY = 20
+
+
+class ExpirySweep:
+    """
+    Disable expired users as one set-based pipeline.
+
+    1. One ``UPDATE ... RETURNING`` flips every expired active user to
+       inactive/disabled and returns who they are; once committed, their
+       audit events are queued on the buffered event log.
+    2. The reconciler is woken. It is the only writer of the routers: it
+       disables the users (now desired 'disabled', router 'enabled') with
+       the pipelined bulk operation and records ``router_state``.
+
+    Each run's row count and timings are kept for ``stats()``.
+    """
+
+    def __init__(self, reconciler):
+        self.reconciler = reconciler
+        self._lock = threading.Lock()
+        self.history = deque(maxlen=SWEEP_HISTORY)
+        self.total_rows = 0
+        self.total_sweeps = 0
+
+    def run(self, user_ids=None):
+        """Disable expired users (only ``user_ids`` if given); returns the number disabled"""
+        try:
+            return self._run(user_ids)
+        except Exception as e:
+            print(f"Error checking expired users: {e}")
+            return 0
+
+    def _run(self, user_ids):
+        started = time.perf_counter()
+        now = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            statement = (
+                update(User)
+                .where(
+                    User.expiry < now,
+                    User.is_active == True,
+                    User.desired_state != "deleted",
+                )
+                .values(is_active=False, desired_state="disabled")
+                .returning(User.id, User.username)
+                .execution_options(synchronize_session=False)
+            )
+            if user_ids is not None:
+                statement = statement.where(User.id.in_(user_ids))
+            expired = db.execute(statement).all()
+            if not expired:
+                db.rollback()
+                return 0
+
+            db.commit()
+            dashboard_counters.users_disabled(len(expired))
+        finally:
+            db.close()
+        for user_id, username in expired:
+            event_log.write(
+                "user.expired", f"Auto-disabled expired user: {username}", user_id=user_id, timestamp=now
+            )
+        self.reconciler.wake()
+
+        total_seconds = time.perf_counter() - started
+        metrics = {
+            "at": now,
+            "source": "scan" if user_ids is None else "scheduler",
+            "rows": len(expired),
+            "total_ms": round(total_seconds * 1000, 1),
+        }
+        with self._lock:
+            self.history.append(metrics)
+            self.total_rows += len(expired)
+            self.total_sweeps += 1
+        print(f"Disabled {len(expired)} expired users in {metrics['total_ms']}ms (routers via the reconciler)")
+        return len(expired)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sweeps": self.total_sweeps,
+                "rows": self.total_rows,
+                "recent": list(self.history),
+            }
+
+
+# Global instance
+expiry_sweep = ExpirySweep(reconciler)
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Query-plan regression check for the hot database paths.
+
+Seeds a scratch database at production-like scale, runs EXPLAIN on every
+hot query (expiry sweep, /expired, /stats, reconciler, payment lookups,
+/logs)
+and fails (exit code 1) if any of them reads a table with a sequential
+scan instead of an index. Run it after changing a query or an index:
+
+    python explain_check.py                          # fresh SQLite file
+    python explain_check.py --database-url postgresql+psycopg2://.../scratch
+    python explain_check.py --database-url ... --no-seed   # a copy of production
+
+Without --no-seed the tables are created and filled with --users rows, so
+only point --database-url at a disposable database.
+
+tests/test_query_plans.py runs the same check on a smaller SQLite seed.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def hot_queries(models, now):
+    """(name, statement) for every query the check covers, mirroring the app"""
+    from sqlalchemy import func, or_, select, update
+
+    User, Payment, PaymentTransaction, Log = models
+    live = User.desired_state != "deleted"
+    a_day_ago = now - timedelta(days=1)
+
+    def page(model, sort, *filters, after=None):
+        """A KeysetListing page (pagination.py); ``after`` is the cursor's sort value"""
+        query = select(model).where(*filters)
+        if after is not None:
+            query = query.where(sort <= after, or_(sort < after, model.id < 1000))
+        return query.order_by(sort.desc(), model.id.desc()).limit(51)
+
+    return [
+        (
+            "expiry sweep",
+            update(User)
+            .where(User.expiry < now, User.is_active == True, live)
+            .values(is_active=False, desired_state="disabled")
+            .returning(User.id, User.username),
+        ),
+        ("/users", page(User, User.created_at, live)),
+        ("/users (next page)", page(User, User.created_at, live, after=a_day_ago)),
+        ("/expired", page(User, User.expiry, User.expiry < now, live)),
+        ("/expired (next page)", page(User, User.expiry, User.expiry < now, live, after=a_day_ago)),
+        (
+            "/stats",
+            select(
+                func.count(),
+                func.count().filter(User.is_active == True),
+                func.count().filter(User.expiry < now),
+            ).where(live),
+        ),
+        (
+            "reconciler pending",
+            select(User)
+            .where(or_(User.router_state.is_(None), User.router_state != User.desired_state))
+            .order_by(User.reconcile_error.isnot(None), User.id)
+            .limit(500),
+        ),
+        ("user by username", select(User).where(User.username == "user_000042")),
+        ("payments by user", select(Payment).where(Payment.user_id == 42)),
+        ("/payments (next page)", select(Payment).where(Payment.id < 1000).order_by(Payment.id.desc()).limit(51)),
+        ("/payments/transactions", page(PaymentTransaction, PaymentTransaction.created_at)),
+        (
+            "/payments/transactions (next page)",
+            page(PaymentTransaction, PaymentTransaction.created_at, after=a_day_ago),
+        ),
+        (
+            "/payments/transactions?status=PENDING",
+            page(PaymentTransaction, PaymentTransaction.created_at, PaymentTransaction.status == "PENDING"),
+        ),
+        ("transactions by user", select(PaymentTransaction).where(PaymentTransaction.user_id == 42)),
+        ("transaction by tx_ref", select(PaymentTransaction).where(PaymentTransaction.tx_ref == "TX00000042")),
+        ("/logs?user_id", page(Log, Log.timestamp, Log.user_id == 42)),
+        ("/logs?user_id (next page)", page(Log, Log.timestamp, Log.user_id == 42, after=a_day_ago)),
+        ("/logs?tx_ref", page(Log, Log.timestamp, Log.tx_ref == "TX00000042")),
+        ("/logs?event_type", page(Log, Log.timestamp, Log.event_type == "payment.failed")),
+        (
+            "log rollup (one day)",
+            select(Log.event_type, func.count())
+            .where(Log.timestamp >= a_day_ago - timedelta(days=1), Log.timestamp < a_day_ago)
+            .group_by(Log.event_type),
+        ),
+    ]
+
+
+# ==================== EXPLAIN ====================
+
+
+def explain(connection, statement):
+    """Plan lines and the tables read with a sequential scan"""
+    sql = statement.compile(dialect=connection.dialect)
+    params = sql.construct_params()
+    processors = sql._bind_processors
+    params = {
+        key: processors[key](value) if key in processors else value
+        for key, value in params.items()
+    }
+
+    if connection.dialect.name == "postgresql":
+        raw = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}", params).scalar()
+        plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]["Plan"]
+        lines, seq_scans = [], []
+        walk_postgres_plan(plan, 0, lines, seq_scans)
+        return lines, seq_scans
+
+    positional = tuple(params[key] for key in sql.positiontup)
+    rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}", positional).all()
+    lines = [row[-1] for row in rows]
+    # "SCAN users" reads the whole table; "SCAN users USING (COVERING) INDEX ..." walks an index
+    seq_scans = [
+        line.split()[1] if line.split()[1] != "TABLE" else line.split()[2]
+        for line in lines
+        if line.startswith("SCAN ") and " USING " not in line
+    ]
+    return lines, seq_scans
+
+
+def walk_postgres_plan(node, depth, lines, seq_scans):
+    label = node["Node Type"]
+    if "Relation Name" in node:
+        label += f" on {node['Relation Name']}"
+    if "Index Name" in node:
+        label += f" using {node['Index Name']}"
+    lines.append("  " * depth + label)
+    if node["Node Type"] == "Seq Scan":
+        seq_scans.append(node["Relation Name"])
+    for child in node.get("Plans", []):
+        walk_postgres_plan(child, depth + 1, lines, seq_scans)
+
+
+# ==================== SEEDING ====================
+
+
+def seed(engine, models, users, now):
+    """
+    A mature deployment: most users long expired, a third active, a few
+    due for the sweep or waiting for the reconciler; two transactions and
+    one payment per user, almost all completed, and a log event for each
+    """
+    from sqlalchemy import insert
+
+    User, Payment, PaymentTransaction, Log = models
+    rng = random.Random(7)
+    user_rows, payment_rows, transaction_rows, log_rows = [], [], [], []
+    for i in range(users):
+        roll = rng.random()
+        created = now - timedelta(days=rng.uniform(0, 365))
+        if roll < 0.6:  # expired and disabled
+            state, active, expiry = "disabled", False, created + timedelta(days=1)
+        elif roll < 0.99:  # active
+            state, active, expiry = "enabled", True, now + timedelta(hours=rng.uniform(1, 720))
+        elif roll < 0.995:  # expired, waiting for the sweep
+            state, active, expiry = "enabled", True, now - timedelta(minutes=rng.uniform(0, 10))
+        else:  # being deleted
+            state, active, expiry = "deleted", False, created + timedelta(days=1)
+        pending = rng.random() < 0.01
+        user_rows.append(
+            {
+                "username": f"user_{i:06d}",
+                "password": "secret12",
+                "plan_type": rng.choice(["daily_1000", "monthly_1000"]),
+                "expiry": expiry,
+                "is_active": active,
+                "created_at": created,
+                "desired_state": state,
+                "router_state": None if pending else ("enabled" if state == "enabled" else "disabled"),
+                "router": "default",
+            }
+        )
+        payment_rows.append({"user_id": i + 1, "amount": 1000, "date": created})
+        for attempt in range(2):
+            status = "COMPLETED" if rng.random() < 0.96 else rng.choice(["PENDING", "FAILED"])
+            transaction_rows.append(
+                {
+                    "tx_ref": f"TX{i * 2 + attempt:08d}",
+                    "phone": "0781588379",
+                    "buyer_name": "Load Test",
+                    "plan_type": "daily_1000",
+                    "amount": 1000,
+                    "payment_link": "https://pay.example/checkout",
+                    "status": status,
+                    "user_id": i + 1 if status == "COMPLETED" else None,
+                    "created_at": created - timedelta(minutes=attempt),
+                }
+            )
+            log_rows.append(
+                {
+                    "event_type": "payment.completed" if status == "COMPLETED" else "payment.failed",
+                    "event": f"Payment {status.lower()}: TX{i * 2 + attempt:08d}",
+                    "user_id": i + 1 if status == "COMPLETED" else None,
+                    "tx_ref": f"TX{i * 2 + attempt:08d}",
+                    "timestamp": created - timedelta(minutes=attempt),
+                }
+            )
+
+    with engine.begin() as connection:
+        for model, rows in (
+            (User, user_rows),
+            (Payment, payment_rows),
+            (PaymentTransaction, transaction_rows),
+            (Log, log_rows),
+        ):
+            for start in range(0, len(rows), 10000):
+                connection.execute(insert(model), rows[start:start + 10000])
+
+    # Fresh statistics, as autovacuum would have by now
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.exec_driver_sql("VACUUM ANALYZE" if engine.dialect.name == "postgresql" else "ANALYZE")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail if a hot query falls back to a sequential scan")
+    parser.add_argument("--users", type=int, default=100000, help="Users to seed (transactions: twice as many)")
+    parser.add_argument("--database-url", default=None, help="Scratch database (default: a fresh SQLite file)")
+    parser.add_argument("--no-seed", action="store_true", help="Check the database as it is")
+    parser.add_argument("--verbose", action="store_true", help="Print every plan")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = args.database_url or (
+        "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="explain-"), "billing.db")
+    )
+    sys.path.insert(0, BACKEND_DIR)
+    from database import Log, Payment, PaymentTransaction, User, engine, init_db
+
+    models = (User, Payment, PaymentTransaction, Log)
+    now = datetime.utcnow()
+    if not args.no_seed:
+        init_db()
+        print(f"Seeding {args.users} users...")
+        seed(engine, models, args.users, now)
+
+    failures = []
+    with engine.connect() as connection:
+        for name, statement in hot_queries(models, now):
+            lines, seq_scans = explain(connection, statement)
+            if seq_scans:
+                failures.append(name)
+                print(f"✗ {name}: sequential scan on {', '.join(seq_scans)}")
+            else:
+                print(f"✓ {name}")
+            if seq_scans or args.verbose:
+                for line in lines:
+                    print(f"      {line}")
+            connection.rollback()
+
+    if failures:
+        print(f"\n✗ {len(failures)} hot query(ies) use a sequential scan")
+        sys.exit(1)
+    print("\n✓ Every hot query uses an index")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+Fake RouterOS API server for development, load tests and benchmarks.
+
+Speaks the RouterOS API wire protocol (the same encoder/decoder as
+routeros_async) and emulates the parts of a hotspot router this backend
+uses: plaintext /login, /ip/hotspot/user (print/add/set/remove/enable/
+disable), /ip/hotspot/active (print/remove), /system/identity/print and
+/cancel. Commands are handled concurrently per tag, so pipelining behaves
+like on a real router.
+
+Latency, jitter and failures (trapped commands, dropped connections,
+commands that never answer, refused logins) are configurable, also while
+running, to reproduce a slow or flaky router without hardware.
+
+Run on a port:
+    python fake_routeros.py --port 8728 --users 5000 --active 500 --latency 0.02
+
+Or in-process (tests, benchmarks):
+    router = FakeRouterOS(users=1000, latency=0.01).start_in_thread()
+    os.environ["MIKROTIK_HOST"], os.environ["MIKROTIK_PORT"] = "127.0.0.1", str(router.port)
+    ...
+    router.stop()
+"""
+
+import argparse
+import asyncio
+import itertools
+import random
+import threading
+import time
+from collections import Counter
+
+from routeros_async import encode_sentence, read_sentence
+
+
+def format_uptime(seconds):
+    """Seconds as a RouterOS duration such as '1d2h3m4s'"""
+    seconds = int(seconds)
+    parts = []
+    for unit, size in (("w", 604800), ("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds >= size:
+            parts.append(f"{seconds // size}{unit}")
+            seconds %= size
+    if seconds or not parts:
+        parts.append(f"{seconds}s")
+    return "".join(parts)
+
+
+class _Trap(Exception):
+    def __init__(self, message, category=None):
+        super().__init__(message)
+        self.message = message
+        self.category = category
+
+
+class FakeRouterOS:
+    """
+    In-memory hotspot router speaking the RouterOS API.
+
+    Args:
+        username, password: accepted login (any login if username is None)
+        users: hotspot users created at start ('user00001', ...)
+        active: active sessions created at start (for the first N users)
+        latency, jitter: seconds added to every reply (uniform jitter)
+        fail_rate: probability a command is answered with a !trap
+        drop_rate: probability the connection is closed instead of answering
+        hang_rate: probability a command is never answered
+        identity: name returned by /system/identity/print
+    """
+
+    def __init__(
+        self,
+        username=None,
+        password=None,
+        users=0,
+        active=0,
+        latency=0.0,
+        jitter=0.0,
+        fail_rate=0.0,
+        drop_rate=0.0,
+        hang_rate=0.0,
+        identity="FakeRouterOS",
+        seed=None,
+    ):
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.drop_rate = drop_rate
+        self.hang_rate = hang_rate
+        self.refuse_logins = False
+        self.identity = identity
+        self._random = random.Random(seed)
+
+        self._ids = itertools.count(1)
+        self.users = {}  # .id -> attributes (all str, like the router)
+        self.active = {}  # .id -> session (counters derived from login time)
+        self.commands = Counter()
+        self.connections = 0
+
+        self.host = None
+        self.port = None
+        self._server = None
+        self._loop = None
+        self._thread = None
+        self._writers = set()
+
+        for i in range(users):
+            self.add_user(f"user{i + 1:05d}", "password", "daily_1000")
+        for item_id, user in list(self.users.items())[:active]:
+            self.add_session(user["name"])
+
+    # ==================== TABLES ====================
+
+    def _next_id(self):
+        return f"*{next(self._ids):X}"
+
+    def add_user(self, name, password, profile="default", **attributes):
+        item_id = self._next_id()
+        self.users[item_id] = {
+            ".id": item_id,
+            "name": name,
+            "password": password,
+            "profile": profile,
+            "disabled": "false",
+            **attributes,
+        }
+        return item_id
+
+    def add_session(self, user, address=None, rate=50_000):
+        """Log ``user`` in; its byte counters grow by about ``rate`` bytes/s"""
+        item_id = self._next_id()
+        n = len(self.active) + 1
+        self.active[item_id] = {
+            ".id": item_id,
+            "user": user,
+            "address": address or f"10.5.{n // 250}.{n % 250 + 2}",
+            "mac-address": "02:00:00:%02X:%02X:%02X" % (n >> 16 & 255, n >> 8 & 255, n & 255),
+            "login-by": "http-chap",
+            "_login": time.time(),
+            "_rate": rate,
+        }
+        return item_id
+
+    def _session_row(self, session):
+        elapsed = time.time() - session["_login"]
+        row = {k: v for k, v in session.items() if not k.startswith("_")}
+        row["uptime"] = format_uptime(elapsed)
+        row["bytes-in"] = str(int(elapsed * session["_rate"] * 0.1))
+        row["bytes-out"] = str(int(elapsed * session["_rate"]))
+        return row
+
+    def user_by_name(self, name):
+        for user in self.users.values():
+            if user["name"] == name:
+                return user
+        return None
+
+    # ==================== SERVER ====================
+
+    async def start(self, host="127.0.0.1", port=0):
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, host, port)
+        self.host, self.port = self._server.sockets[0].getsockname()[:2]
+        return self
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+        if self._server:
+            await self._server.wait_closed()
+
+    def start_in_thread(self, host="127.0.0.1", port=0):
+        """Run the server on its own event loop thread; returns self once listening"""
+        started = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start(host, port))
+            started.set()
+            loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="fake-routeros", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        """Stop a server started with start_in_thread()"""
+        if self._loop and self._thread:
+            asyncio.run_coroutine_threadsafe(self.close(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._thread = None
+
+    def drop_connections(self):
+        """Close every client connection (simulates a router reboot or link loss)"""
+        def close_all():
+            for writer in list(self._writers):
+                writer.close()
+        self._loop.call_soon_threadsafe(close_all)
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self._writers.add(writer)
+        state = {"logged_in": False, "tasks": {}}
+        try:
+            while True:
+                words = await read_sentence(reader)
+                if not words:
+                    continue
+                command, attributes, queries, tag = self._parse(words)
+                task = asyncio.create_task(
+                    self._respond(writer, state, command, attributes, queries, tag)
+                )
+                if tag is not None:
+                    state["tasks"][tag] = task
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for task in state["tasks"].values():
+                task.cancel()
+            self._writers.discard(writer)
+            writer.close()
+
+    @staticmethod
+    def _parse(words):
+        attributes, queries, tag = {}, {}, None
+        for word in words[1:]:
+            if word.startswith(".tag="):
+                tag = word[5:]
+            elif word.startswith("="):
+                key, _, value = word[1:].partition("=")
+                attributes[key] = value
+            elif word.startswith("?"):
+                key, _, value = word[1:].partition("=")
+                queries[key] = value
+        return words[0], attributes, queries, tag
+
+    def _send(self, writer, reply_type, attributes=None, tag=None):
+        words = [reply_type] + [f"={k}={v}" for k, v in (attributes or {}).items()]
+        if tag is not None:
+            words.append(f".tag={tag}")
+        if not writer.is_closing():
+            writer.write(encode_sentence(words))
+
+    async def _respond(self, writer, state, command, attributes, queries, tag):
+        self.commands[command] += 1
+        try:
+            if command == "/cancel":
+                self._cancel(writer, state, attributes.get("tag"))
+                self._send(writer, "!done", tag=tag)
+                return
+
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            if delay:
+                await asyncio.sleep(delay)
+
+            roll = self._random.random()
+            if command != "/login" and roll < self.drop_rate:
+                writer.close()
+                return
+            if command != "/login" and roll < self.drop_rate + self.hang_rate:
+                await asyncio.Event().wait()  # never answers (until cancelled)
+
+            try:
+                if command != "/login":
+                    if not state["logged_in"]:
+                        raise _Trap("not logged in")
+                    if self._random.random() < self.fail_rate:
+                        raise _Trap("injected failure", category=1)
+                rows, done = self._execute(state, command, attributes, queries)
+            except _Trap as trap:
+                fields = {"message": trap.message}
+                if trap.category is not None:
+                    fields = {"category": trap.category, **fields}
+                self._send(writer, "!trap", fields, tag)
+                self._send(writer, "!done", tag=tag)
+                return
+
+            for row in rows:
+                self._send(writer, "!re", row, tag)
+            self._send(writer, "!done", done, tag)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            state["tasks"].pop(tag, None)
+
+    def _cancel(self, writer, state, target):
+        task = state["tasks"].pop(target, None)
+        if task and not task.done():
+            task.cancel()
+            self._send(writer, "!trap", {"category": 2, "message": "interrupted"}, target)
+            self._send(writer, "!done", tag=target)
+
+    # ==================== COMMANDS ====================
+
+    def _execute(self, state, command, attributes, queries):
+        """Run one command; returns (!re rows, !done attributes)"""
+        if command == "/login":
+            valid = self.username is None or (
+                attributes.get("name") == self.username
+                and attributes.get("password", "") == (self.password or "")
+            )
+            if self.refuse_logins or not valid:
+                raise _Trap("invalid user name or password (6)")
+            state["logged_in"] = True
+            return [], {}
+
+        if command == "/system/identity/print":
+            return [{"name": self.identity}], {}
+
+        menu, _, action = command.rpartition("/")
+        if menu == "/ip/hotspot/user":
+            table = self.users
+        elif menu == "/ip/hotspot/active":
+            table = self.active
+        else:
+            raise _Trap("no such command prefix")
+
+        if action == "print":
+            rows = [
+                self._session_row(row) if table is self.active else row
+                for row in table.values()
+                if all(row.get(key) == value for key, value in queries.items())
+            ]
+            proplist = attributes.get(".proplist")
+            if proplist:
+                keys = proplist.split(",")
+                rows = [{k: row[k] for k in keys if k in row} for row in rows]
+            return rows, {}
+
+        if action == "add" and table is self.users:
+            name = attributes.get("name")
+            if not name:
+                raise _Trap("failure: name must be set")
+            if self.user_by_name(name):
+                raise _Trap("failure: already have user with this name")
+            fields = {k: v for k, v in attributes.items() if k not in ("name", "password", "profile")}
+            if "disabled" in fields:
+                fields["disabled"] = "true" if fields["disabled"] in ("yes", "true") else "false"
+            item_id = self.add_user(
+                name, attributes.get("password", ""), attributes.get("profile", "default"), **fields
+            )
+            return [], {"ret": item_id}
+
+        item_id = attributes.get(".id")
+        if action in ("set", "remove", "enable", "disable"):
+            if item_id not in table:
+                raise _Trap("no such item")
+            if action == "remove":
+                del table[item_id]
+            elif table is self.users:
+                user = table[item_id]
+                if action in ("enable", "disable"):
+                    user["disabled"] = "true" if action == "disable" else "false"
+                for key, value in attributes.items():
+                    if key == ".id":
+                        continue
+                    if key == "disabled":
+                        value = "true" if value in ("yes", "true") else "false"
+                    user[key] = value
+            else:
+                raise _Trap("no such command")
+            return [], {}
+
+        raise _Trap("no such command")
+
+    def stats(self):
+        return {
+            "users": len(self.users),
+            "active": len(self.active),
+            "connections": self.connections,
+            "commands": dict(self.commands),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake RouterOS API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8728)
+    parser.add_argument("--username", default=None, help="Accepted login (default: any)")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--users", type=int, default=0, help="Hotspot users to create")
+    parser.add_argument("--active", type=int, default=0, help="Active sessions to create")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds per reply")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random seconds per reply")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Probability of a !trap")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Probability of closing the connection")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Probability of never answering")
+    args = parser.parse_args()
+
+    router = FakeRouterOS(
+        username=args.username,
+        password=args.password,
+        users=args.users,
+        active=args.active,
+        latency=args.latency,
+        jitter=args.jitter,
+        fail_rate=args.fail_rate,
+        drop_rate=args.drop_rate,
+        hang_rate=args.hang_rate,
+    )
+
+    async def serve():
+        await router.start(args.host, args.port)
+        print(
+            f"✓ Fake RouterOS listening on {router.host}:{router.port} "
+            f"({len(router.users)} users, {len(router.active)} active, "
+            f"latency {args.latency}s)"
+        )
+        await router.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        print(f"\nStopped. {router.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import threading
+import time
+
+
+class HotspotUserIndex:
+    """
+    In-memory map of router hotspot user names to their RouterOS ``.id``.
+
+    The index is maintained incrementally: MikroTikAPI records the ``.id``
+    returned by every ``add``, forgets users it removes, looks up misses on
+    demand and drops entries whose ``.id`` the router rejects ("no such
+    item"), so a cached ``.id`` is never used twice after it goes stale.
+    A full reload only happens when the caller asks for the complete list.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._lock = threading.Lock()
+        self.loaded_at = None  # time of the last full reload
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._ids)
+
+    def reload(self, rows):
+        """Replace the index with a full ``.id,name`` listing from the router"""
+        ids = {row["name"]: row["id"] for row in rows if row.get("name")}
+        with self._lock:
+            self._ids = ids
+            self.loaded_at = time.time()
+        return list(ids)
+
+    def get_many(self, names):
+        """Return cached ids for ``names`` and the list of names not cached"""
+        found = {}
+        missing = []
+        with self._lock:
+            for name in names:
+                user_id = self._ids.get(name)
+                if user_id is None:
+                    missing.append(name)
+                else:
+                    found[name] = user_id
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def remember(self, name, user_id):
+        with self._lock:
+            self._ids[name] = user_id
+
+    def forget(self, name):
+        with self._lock:
+            self._ids.pop(name, None)
+
+    def names(self):
+        with self._lock:
+            return list(self._ids)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._ids),
+                "loaded_at": self.loaded_at,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
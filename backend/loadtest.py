@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+End-to-end load generator for the purchase -> webhook -> provisioning path.
+
+Starts local stand-ins for ZenoPay (checkout API), the WhatsApp Cloud API
+and the router (fake_routeros), launches the app with uvicorn pointed at
+them, and drives a scenario with many concurrent customers:
+
+  peak   customers arrive over --ramp seconds; each creates a checkout,
+         "pays" after a random delay (the tool posts the COMPLETED webhook
+         ZenoPay would send) and polls /payments/check/{tx_ref} until the
+         credentials arrive (--wait: long-polls it instead)
+  burst  every checkout is created first, then all webhooks are posted at
+         once while the customers poll
+
+Dashboards poll /stats and /active-connections for the whole run. The
+report gives throughput and p50/p95/p99 latency per endpoint.
+
+    python loadtest.py --customers 300 --concurrency 100 --dashboards 5
+    python loadtest.py --scenario burst --customers 500 --router-latency 0.05
+
+Use --url to target an app that is already running (it must be configured
+with the stand-in addresses the tool prints).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+from fake_routeros import FakeRouterOS
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# ==================== STAND-INS ====================
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    """Answers every POST after the server's latency with server.respond(path, body)"""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        time.sleep(self.server.latency)
+        self.server.requests += 1
+        status, payload = self.server.respond(self.path, body)
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stand_in(respond, latency):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StandInHandler)
+    server.daemon_threads = True
+    server.respond = respond
+    server.latency = latency
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def zenopay_checkout(path, body):
+    """ZenoPay /api/payments/checkout/ stand-in"""
+    tx_ref = f"LT-{uuid.uuid4().hex[:16]}"
+    return 200, {"payment_link": f"https://pay.example/{tx_ref}", "tx_ref": tx_ref}
+
+
+def whatsapp_message(path, body):
+    """WhatsApp Cloud API /messages stand-in"""
+    return 200, {"messages": [{"id": f"wamid.{uuid.uuid4().hex}"}]}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# ==================== MEASUREMENT ====================
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def request(self, client, name, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            response, ok = None, False
+        self.latencies[name].append(time.perf_counter() - started)
+        if not ok:
+            self.errors[name] += 1
+        return response if ok else None
+
+    def report(self, duration):
+        rows = []
+        for name, samples in sorted(self.latencies.items()):
+            samples = sorted(samples)
+            rows.append(
+                {
+                    "endpoint": name,
+                    "requests": len(samples),
+                    "errors": self.errors[name],
+                    "rps": round(len(samples) / duration, 1),
+                    "p50_ms": round(percentile(samples, 50) * 1000, 1),
+                    "p95_ms": round(percentile(samples, 95) * 1000, 1),
+                    "p99_ms": round(percentile(samples, 99) * 1000, 1),
+                    "max_ms": round(samples[-1] * 1000, 1),
+                }
+            )
+        return rows
+
+
+def percentile(sorted_samples, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_samples:
+        return 0.0
+    rank = max(1, round(pct / 100 * len(sorted_samples)))
+    return sorted_samples[min(rank, len(sorted_samples)) - 1]
+
+
+def print_report(rows, duration, summary):
+    print(f"\n=== Load test finished in {duration:.1f}s ===")
+    for key, value in summary.items():
+        print(f"{key}: {value}")
+    header = f"{'endpoint':<34}{'reqs':>7}{'errs':>6}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"
+    print("\n" + header)
+    print("-" * len(header))
+    for row in rows:
+        print(
+            f"{row['endpoint']:<34}{row['requests']:>7}{row['errors']:>6}{row['rps']:>8}"
+            f"{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}{row['max_ms']:>9}"
+        )
+    print("(latencies in ms)")
+
+
+# ==================== SCENARIOS ====================
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.recorder = Recorder()
+        self.provisioned = 0
+        self.timed_out = 0
+        self.provision_times = []
+        self._done = asyncio.Event()
+
+    async def checkout(self, client, i):
+        response = await self.recorder.request(
+            client,
+            "POST /payments/create-checkout",
+            "POST",
+            "/payments/create-checkout",
+            json={
+                "phone": f"07{i:08d}",
+                "buyer_name": f"Load Test {i}",
+                "plan_type": random.choice(["daily_1000", "monthly_1000"]),
+                "device_count": random.choice([1, 2]),
+            },
+        )
+        return response.json()["tx_ref"] if response else None
+
+    async def pay(self, client, tx_ref):
+        await self.recorder.request(
+            client,
+            "POST /payments/webhook",
+            "POST",
+            "/payments/webhook",
+            json={"order_id": tx_ref, "reference": tx_ref, "payment_status": "COMPLETED"},
+        )
+
+    async def wait_for_credentials(self, client, tx_ref, paid_at):
+        deadline = time.time() + self.args.poll_timeout
+        while time.time() < deadline:
+            if self.args.wait:
+                # Long poll: the app answers when the status changes
+                response = await self.recorder.request(
+                    client,
+                    "GET /payments/check/{tx_ref}?wait",
+                    "GET",
+                    f"/payments/check/{tx_ref}",
+                    params={"wait": min(self.args.wait, max(deadline - time.time(), 0))},
+                )
+            else:
+                response = await self.recorder.request(
+                    client, "GET /payments/check/{tx_ref}", "GET", f"/payments/check/{tx_ref}"
+                )
+            if response and response.json().get("status") == "COMPLETED":
+                self.provisioned += 1
+                self.provision_times.append(time.time() - paid_at)
+                return
+            if not self.args.wait:
+                await asyncio.sleep(self.args.poll_interval)
+        self.timed_out += 1
+
+    async def customer(self, client, i):
+        """peak: check out, pay a little later, poll until provisioned"""
+        await asyncio.sleep(random.uniform(0, self.args.ramp))
+        tx_ref = await self.checkout(client, i)
+        if not tx_ref:
+            return
+        await asyncio.sleep(random.uniform(0, self.args.pay_delay))
+        paid_at = time.time()
+        await self.pay(client, tx_ref)
+        await self.wait_for_credentials(client, tx_ref, paid_at)
+
+    async def dashboard(self, client):
+        while not self._done.is_set():
+            await self.recorder.request(client, "GET /stats", "GET", "/stats")
+            await self.recorder.request(
+                client, "GET /active-connections", "GET", "/active-connections"
+            )
+            try:
+                await asyncio.wait_for(self._done.wait(), self.args.dashboard_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self, base_url):
+        limits = httpx.Limits(max_connections=self.args.concurrency)
+        async with httpx.AsyncClient(
+            base_url=base_url, limits=limits, timeout=self.args.request_timeout
+        ) as client:
+            dashboards = [
+                asyncio.create_task(self.dashboard(client)) for _ in range(self.args.dashboards)
+            ]
+            started = time.time()
+            if self.args.scenario == "peak":
+                await asyncio.gather(
+                    *(self.customer(client, i) for i in range(self.args.customers))
+                )
+            else:
+                tx_refs = await asyncio.gather(
+                    *(self.checkout(client, i) for i in range(self.args.customers))
+                )
+                tx_refs = [tx_ref for tx_ref in tx_refs if tx_ref]
+                paid_at = time.time()
+                await asyncio.gather(
+                    *(self.pay(client, tx_ref) for tx_ref in tx_refs),
+                    *(self.wait_for_credentials(client, tx_ref, paid_at) for tx_ref in tx_refs),
+                )
+            duration = time.time() - started
+            self._done.set()
+            await asyncio.gather(*dashboards)
+        return duration
+
+
+# ==================== APP PROCESS ====================
+
+
+def launch_app(args, env):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=None if args.app_logs else subprocess.DEVNULL,
+        stderr=None if args.app_logs else subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit("App exited during startup (run with --app-logs to see why)")
+        try:
+            if httpx.get(f"{base_url}/", timeout=1).status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise SystemExit("App did not start within 30s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the payment and provisioning path")
+    parser.add_argument("--scenario", choices=["peak", "burst"], default="peak")
+    parser.add_argument("--customers", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=100, help="Max open HTTP connections")
+    parser.add_argument("--ramp", type=float, default=10.0, help="Seconds over which customers arrive (peak)")
+    parser.add_argument("--pay-delay", type=float, default=5.0, help="Max seconds between checkout and payment (peak)")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="Customer status poll interval")
+    parser.add_argument("--poll-timeout", type=float, default=60.0, help="Give up waiting for credentials after this")
+    parser.add_argument(
+        "--wait", type=float, default=0, help="Long-poll /payments/check with this wait instead of polling"
+    )
+    parser.add_argument("--request-timeout", type=float, default=30.0, help="Count a request as failed after this")
+    parser.add_argument("--dashboards", type=int, default=3, help="Dashboards polling /stats")
+    parser.add_argument("--dashboard-interval", type=float, default=5.0)
+    parser.add_argument("--zenopay-latency", type=float, default=0.3)
+    parser.add_argument("--whatsapp-latency", type=float, default=0.3)
+    parser.add_argument("--router-latency", type=float, default=0.01)
+    parser.add_argument("--router-users", type=int, default=0, help="Existing users on the fake router")
+    parser.add_argument("--database-url", default=None, help="Default: a fresh SQLite file")
+    parser.add_argument("--url", default=None, help="Target an already running app instead")
+    parser.add_argument("--app-logs", action="store_true", help="Show the app's output")
+    parser.add_argument("--json", dest="json_path", default=None, help="Also write the report here")
+    args = parser.parse_args()
+
+    process = None
+    summary = {"scenario": args.scenario, "customers": args.customers}
+    if args.url:
+        base_url = args.url
+    else:
+        zenopay = start_stand_in(zenopay_checkout, args.zenopay_latency)
+        whatsapp = start_stand_in(whatsapp_message, args.whatsapp_latency)
+        router = FakeRouterOS(users=args.router_users, latency=args.router_latency).start_in_thread()
+        database_url = args.database_url or (
+            "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="loadtest-"), "billing.db")
+        )
+        env = dict(
+            os.environ,
+            DATABASE_URL=database_url,
+            ZENOPAY_API_KEY="loadtest",
+            ZENOPAY_BASE_URL=f"http://127.0.0.1:{zenopay.server_port}",
+            WHATSAPP_API_BASE_URL=f"http://127.0.0.1:{whatsapp.server_port}",
+            WHATSAPP_ACCESS_TOKEN="loadtest",
+            WHATSAPP_PHONE_NUMBER_ID="loadtest",
+            MIKROTIK_ROUTERS="",
+            MIKROTIK_HOST="127.0.0.1",
+            MIKROTIK_PORT=str(router.port),
+            SENTRY_DSN="",
+        )
+        print(f"Stand-ins: ZenoPay {env['ZENOPAY_BASE_URL']}, WhatsApp {env['WHATSAPP_API_BASE_URL']}, router 127.0.0.1:{router.port}")
+        print(f"Database: {database_url}")
+        process, base_url = launch_app(args, env)
+
+    try:
+        load_test = LoadTest(args)
+        duration = asyncio.run(load_test.run(base_url))
+    finally:
+        if process:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    times = sorted(load_test.provision_times)
+    summary.update(
+        {
+            "provisioned": load_test.provisioned,
+            "timed_out": load_test.timed_out,
+            "payment_to_credentials_p50_s": round(percentile(times, 50), 2),
+            "payment_to_credentials_p95_s": round(percentile(times, 95), 2),
+        }
+    )
+    if not args.url:
+        summary["router_commands"] = dict(router.commands)
+        summary["zenopay_requests"] = zenopay.requests
+        summary["whatsapp_requests"] = whatsapp.requests
+
+    rows = load_test.recorder.report(duration)
+    print_report(rows, duration, summary)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"duration": duration, "summary": summary, "endpoints": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+from database import Log, LogRollup, SessionLocal, engine
+from sqlalchemy import delete, func, insert, text
+
+# Months of events kept besides the current one; older months are dropped
+LOG_RETENTION_MONTHS = int(os.getenv("LOG_RETENTION_MONTHS", "12"))
+# Monthly partitions created ahead of time on PostgreSQL
+LOG_PARTITIONS_AHEAD = int(os.getenv("LOG_PARTITIONS_AHEAD", "2"))
+
+PARTITION_NAME = re.compile(r"^logs_(\d{4})_(\d{2})$")
+
+
+def month_start(value, offset=0):
+    """First instant of the month ``offset`` months after the one containing ``value``"""
+    index = value.year * 12 + value.month - 1 + offset
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+class LogRetention:
+    """
+    Keep the ``logs`` table bounded and summarised.
+
+    Each run (at startup and then daily):
+
+    1. Rolls every complete day not rolled up yet into ``log_rollups``
+       (events per type per day), so counts outlive the events.
+    2. On PostgreSQL, where the migration partitions ``logs`` by month,
+       creates the partitions for the next ``LOG_PARTITIONS_AHEAD`` months
+       so new events never land in the default partition.
+    3. Drops events older than ``LOG_RETENTION_MONTHS`` full months:
+       whole partitions with ``DROP TABLE`` when partitioned (no row by row
+       delete, no vacuum debt), an indexed ``DELETE`` otherwise.
+    """
+
+    def __init__(self, retention_months=LOG_RETENTION_MONTHS, partitions_ahead=LOG_PARTITIONS_AHEAD):
+        self.retention_months = retention_months
+        self.partitions_ahead = partitions_ahead
+        self._lock = threading.Lock()
+        self.last_run = None
+
+    def run(self):
+        try:
+            return self._run()
+        except Exception as e:
+            print(f"✗ Log retention failed: {e}")
+            return None
+
+    def _run(self):
+        with self._lock:
+            started = time.perf_counter()
+            now = datetime.utcnow()
+            cutoff = month_start(now, -self.retention_months)
+            rolled_up = self.rollup(now)
+            with engine.begin() as connection:
+                partitioned = self.partitioned(connection)
+                if partitioned:
+                    created = self.create_partitions(connection, now)
+                    dropped, deleted = self.drop_partitions(connection, cutoff)
+                else:
+                    created, dropped = [], []
+                    deleted = connection.execute(delete(Log).where(Log.timestamp < cutoff)).rowcount
+
+            self.last_run = {
+                "at": now,
+                "partitioned": partitioned,
+                "days_rolled_up": rolled_up,
+                "partitions_created": created,
+                "partitions_dropped": dropped,
+                "rows_deleted": deleted,
+                "kept_since": cutoff,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+            }
+        print(
+            f"✓ Log retention: rolled up {rolled_up} days, created {len(created)} and "
+            f"dropped {len(dropped)} partitions, deleted {deleted} rows"
+        )
+        return self.last_run
+
+    def rollup(self, now):
+        """Count the events of each complete day after the last rolled-up one"""
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        db = SessionLocal()
+        try:
+            last = db.query(func.max(LogRollup.day)).scalar()
+            if last is not None:
+                day = last + timedelta(days=1)
+            else:
+                first = db.query(func.min(Log.timestamp)).scalar()
+                if first is None:
+                    return 0
+                day = first.replace(hour=0, minute=0, second=0, microsecond=0)
+
+            days = 0
+            while day < today:
+                counts = (
+                    db.query(Log.event_type, func.count())
+                    .filter(Log.timestamp >= day, Log.timestamp < day + timedelta(days=1))
+                    .group_by(Log.event_type)
+                    .all()
+                )
+                if counts:
+                    db.execute(
+                        insert(LogRollup),
+                        [
+                            {"day": day, "event_type": event_type or "unknown", "count": count}
+                            for event_type, count in counts
+                        ],
+                    )
+                    db.commit()
+                    days += 1
+                day += timedelta(days=1)
+            return days
+        finally:
+            db.close()
+
+    def partitioned(self, connection):
+        if connection.dialect.name != "postgresql":
+            return False
+        kind = connection.execute(
+            text("SELECT relkind FROM pg_class WHERE relname = 'logs' AND relkind IN ('r', 'p')")
+        ).scalar()
+        return kind == "p"
+
+    def partitions(self, connection):
+        """{month start: partition name} of the monthly partitions of ``logs``"""
+        names = connection.execute(
+            text(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+                "WHERE parent.relname = 'logs'"
+            )
+        ).scalars()
+        months = {}
+        for name in names:
+            match = PARTITION_NAME.match(name)
+            if match:
+                months[datetime(int(match.group(1)), int(match.group(2)), 1)] = name
+        return months
+
+    def create_partitions(self, connection, now):
+        existing = self.partitions(connection)
+        created = []
+        for offset in range(self.partitions_ahead + 1):
+            start = month_start(now, offset)
+            if start in existing:
+                continue
+            name = f"logs_{start:%Y_%m}"
+            connection.execute(
+                text(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF logs "
+                    f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{month_start(start, 1):%Y-%m-%d}')"
+                )
+            )
+            created.append(name)
+        return created
+
+    def drop_partitions(self, connection, cutoff):
+        """Drop the monthly partitions that end before ``cutoff``; returns (names, rows)"""
+        dropped = []
+        for start, name in sorted(self.partitions(connection).items()):
+            if month_start(start, 1) <= cutoff:
+                connection.execute(text(f"DROP TABLE {name}"))
+                dropped.append(name)
+        # Stragglers outside every monthly range sit in the default partition
+        deleted = connection.execute(delete(Log).where(Log.timestamp < cutoff)).rowcount
+        return dropped, deleted
+
+    def stats(self):
+        return {
+            "retention_months": self.retention_months,
+            "partitions_ahead": self.partitions_ahead,
+            "last_run": self.last_run,
+        }
+
+
+# Global instance
+log_retention = LogRetention()
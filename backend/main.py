@@ -1,18 +1,49 @@
+import asyncio
+import json
 import os
 from datetime import datetime, timedelta
-from typing import List, Optional
+from typing import Optional
 
 import sentry_sdk
 import uvicorn
 from apscheduler.schedulers.background import BackgroundScheduler
-from database import Log, Payment, PaymentTransaction, User, get_db, init_db
+from dashboard_counters import STATS_REFRESH_MINUTES, dashboard_counters, snapshot
+from database import (
+    AsyncSessionLocal,
+    Log,
+    LogRollup,
+    Payment,
+    PaymentTransaction,
+    UsageRollup,
+    UsageSample,
+    User,
+    WebhookJob,
+    async_engine,
+    get_db,
+    init_db,
+)
+from dedup_cache import webhook_dedup
 from dotenv import load_dotenv
+from event_log import event_log
+from log_retention import log_retention
+from expiry_scheduler import expiry_scheduler
+from expiry_sweep import expiry_sweep
 from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from mikrotik_api import mikrotik
+from fastapi.responses import StreamingResponse
+from mikrotik_api import mikrotik, mikrotik_async
+from pagination import PAGE_DEFAULT_LIMIT, KeysetListing
+from payment_notifier import PAYMENT_STREAM_HEARTBEAT, PAYMENT_STREAM_MAX, PAYMENT_WAIT_MAX, payment_notifier
 from payment_service import payment_service
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from reconciler import reconciler
+from session_monitor import session_monitor
+from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from usage_accounting import usage_accounting
+from user_sync import SYNC_INTERVAL_MINUTES, user_sync
+from webhook_queue import WEBHOOK_LOCK_TIMEOUT, PermanentJobError, webhook_queue
 from whatsapp_service import whatsapp_service
 
 load_dotenv()
@@ -51,6 +82,8 @@ class UserResponse(BaseModel):
     expiry: datetime
     is_active: bool
     created_at: datetime
+    desired_state: str = "enabled"
+    router_state: Optional[str] = None  # None until the reconciler provisions the user
 
     class Config:
         from_attributes = True
@@ -109,41 +142,133 @@ def calculate_expiry(plan_type: str) -> datetime:
         raise ValueError(f"Invalid plan type: {plan_type}")
 
 
-def log_event(db: Session, event: str):
-    """Log an event to the database"""
-    log = Log(event=event)
-    db.add(log)
-    db.commit()
+def log_event(
+    event_type: str, event: str, user_id: int = None, tx_ref: str = None, **payload
+):
+    """
+    Log an event to the database (queued and written in bulk by event_log)
 
+    ``event_type`` is a dotted code such as 'payment.completed'; keyword
+    arguments beyond ``user_id``/``tx_ref`` go into the JSON payload.
+    """
+    event_log.write(event_type, event, user_id=user_id, tx_ref=tx_ref, payload=payload)
 
-# Background Task for Auto-Disabling Expired Users
-def check_expired_users():
-    """Check and disable expired users"""
-    db = next(get_db())
-    try:
-        now = datetime.utcnow()
-        expired_users = (
-            db.query(User).filter(User.expiry < now, User.is_active == True).all()
-        )
 
-        for user in expired_users:
-            # Disable in MikroTik
-            success = mikrotik.disable_user(user.username)
-            if success:
-                # Update database
-                user.is_active = False
-                db.commit()
-                log_event(db, f"Auto-disabled expired user: {user.username}")
-                print(f"Disabled expired user: {user.username}")
-    except Exception as e:
-        print(f"Error checking expired users: {e}")
-    finally:
-        db.close()
+async def router_counts(db: AsyncSession) -> dict:
+    """Number of users assigned to each router"""
+    rows = await db.execute(select(User.router, func.count(User.id)).group_by(User.router))
+    return dict(rows.all())
+
+
+async def assign_router(db: AsyncSession) -> str:
+    """Pick the router with the most free capacity for a new user"""
+    return mikrotik.pick_router(await router_counts(db))
+
+
+async def get_live_user(db: AsyncSession, user_id: int) -> User:
+    """Fetch a user that is not pending deletion, or raise 404"""
+    user = await db.scalar(
+        select(User).where(User.id == user_id, User.desired_state != "deleted")
+    )
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
+
+
+# List endpoints: the fields each may return (never passwords) and the
+# ones returned when the client does not pick
+USER_FIELDS = {
+    "id": User.id,
+    "username": User.username,
+    "plan_type": User.plan_type,
+    "expiry": User.expiry,
+    "is_active": User.is_active,
+    "created_at": User.created_at,
+    "desired_state": User.desired_state,
+    "router_state": User.router_state,
+    "router": User.router,
+    "auto_generated": User.auto_generated,
+    "phone": User.phone,
+    "buyer_name": User.buyer_name,
+    "device_count": User.device_count,
+}
+user_listing = KeysetListing(
+    User,
+    USER_FIELDS,
+    ["id", "username", "plan_type", "expiry", "is_active", "created_at", "desired_state", "router_state"],
+    sort=User.created_at,
+)
+expired_listing = KeysetListing(
+    User,
+    USER_FIELDS,
+    ["id", "username", "plan_type", "expiry", "is_active", "phone"],
+    sort=User.expiry,
+)
+payment_listing = KeysetListing(
+    Payment,
+    {
+        "id": Payment.id,
+        "user_id": Payment.user_id,
+        "username": User.username,
+        "amount": Payment.amount,
+        "date": Payment.date,
+        "verified": Payment.verified,
+    },
+    ["id", "user_id", "amount", "date", "verified"],
+    joins={"username": (User, User.id == Payment.user_id)},
+)
+transaction_listing = KeysetListing(
+    PaymentTransaction,
+    {column.name: column for column in PaymentTransaction.__table__.columns},
+    ["id", "tx_ref", "phone", "buyer_name", "plan_type", "device_count", "amount", "status", "user_id", "created_at", "completed_at"],
+    sort=PaymentTransaction.created_at,
+)
+webhook_job_listing = KeysetListing(
+    WebhookJob,
+    {column.name: column for column in WebhookJob.__table__.columns},
+    ["id", "tx_ref", "status", "attempts", "run_at", "last_error", "created_at", "completed_at"],
+    sort=WebhookJob.created_at,
+)
+log_listing = KeysetListing(
+    Log,
+    {column.name: column for column in Log.__table__.columns},
+    ["id", "timestamp", "event_type", "event", "user_id", "tx_ref", "payload"],
+    sort=Log.timestamp,
+)
+
+
+def user_filters(plan_type, is_active, q):
+    """Filters shared by the user listings"""
+    filters = [User.desired_state != "deleted"]
+    if plan_type:
+        filters.append(User.plan_type == plan_type)
+    if is_active is not None:
+        filters.append(User.is_active == is_active)
+    if q:
+        filters.append(User.username.startswith(q, autoescape=True))
+    return filters
+
+
+def date_filters(column, date_from, date_to):
+    filters = []
+    if date_from:
+        filters.append(column >= date_from)
+    if date_to:
+        filters.append(column < date_to)
+    return filters
 
 
 # Initialize Scheduler
+# Users are disabled as they expire by expiry_scheduler; this 10-minute
+# sweep is the safety net for anything it missed
 scheduler = BackgroundScheduler()
-scheduler.add_job(check_expired_users, "interval", minutes=10)
+scheduler.add_job(expiry_sweep.run, "interval", minutes=10)
+scheduler.add_job(usage_accounting.prune, "interval", hours=24)
+scheduler.add_job(dashboard_counters.refresh, "interval", minutes=STATS_REFRESH_MINUTES)
+scheduler.add_job(log_retention.run, "interval", hours=24)
+scheduler.add_job(webhook_queue.prune, "interval", hours=24)
+if SYNC_INTERVAL_MINUTES > 0:
+    scheduler.add_job(user_sync.run, "interval", minutes=SYNC_INTERVAL_MINUTES)
 scheduler.start()
 
 
@@ -152,31 +277,65 @@ scheduler.start()
 async def startup_event():
     """Initialize database on startup"""
     # Refresh MikroTik config from .env (clears any IP caches)
-    mikrotik.refresh_config()
+    await mikrotik_async.refresh_config()
 
-    init_db()
+    # Blocking database work at startup runs in the thread pool, off the event loop
+    await run_in_threadpool(init_db)
     print("Database initialized")
 
-    # Try to connect to MikroTik (non-blocking)
-    try:
-        import socket
+    # Write audit events in bulk in the background; roll up, partition and
+    # expire the audit log now (in the scheduler's thread) and then daily
+    event_log.start()
+    scheduler.add_job(log_retention.run)
 
-        # Set default socket timeout
-        socket.setdefaulttimeout(5)
+    # Load every active user's expiry into the expiry scheduler
+    await run_in_threadpool(expiry_scheduler.start)
 
-        if mikrotik.connect():
+    # Count the /stats figures once; the write paths keep them current
+    await run_in_threadpool(dashboard_counters.refresh)
+
+    # Warm up the MikroTik connection pool (connections use their own timeouts)
+    try:
+        if await mikrotik_async.connect():
             print("MikroTik connected successfully")
         else:
-            print("Warning: MikroTik connection failed - will retry on first API call")
+            print("Warning: MikroTik connection failed - the circuit breaker will probe it in the background")
     except Exception as e:
         print(f"Warning: MikroTik connection failed: {e}")
         print("System will continue - connection will retry on API calls")
 
+    # Poll /ip/hotspot/active in the background for /active-connections,
+    # feeding each poll's byte counters into usage accounting
+    session_monitor.add_listener(usage_accounting.ingest)
+    session_monitor.start()
+
+    # Apply user changes to the routers in the background
+    reconciler.start()
+
+    # Process stored payment webhooks
+    webhook_queue.start(process_payment_webhook, on_failure=forget_payment_webhook)
+
+    # Wake customers waiting on a payment, across processes on PostgreSQL
+    payment_notifier.start()
+
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
-    mikrotik.disconnect()
+    await webhook_queue.stop()
+    await payment_notifier.stop()
+    session_monitor.stop()
+    try:
+        usage_accounting.flush()
+    except Exception as e:
+        # The stops below must still run: they write the queued audit events
+        # and close the router connections
+        print(f"✗ Final usage flush failed: {e}")
+    reconciler.stop()
+    expiry_scheduler.stop()
+    await mikrotik_async.disconnect()
+    event_log.stop()  # writes the events still queued
+    await async_engine.dispose()
     scheduler.shutdown()
 
 
@@ -192,74 +351,110 @@ async def root():
 
 
 @app.post("/users", response_model=UserResponse)
-async def create_user(user: UserCreate, db: Session = Depends(get_db)):
-    """Create a new user in database and MikroTik"""
+async def create_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
+    """Create a new user; the reconciler provisions it on the router"""
     # Check if username already exists
-    existing_user = db.query(User).filter(User.username == user.username).first()
+    existing_user = await db.scalar(select(User).where(User.username == user.username))
     if existing_user:
+        if existing_user.desired_state == "deleted":
+            raise HTTPException(
+                status_code=409, detail="Username is still being removed from the router"
+            )
         raise HTTPException(status_code=400, detail="Username already exists")
 
     # Calculate expiry
     expiry = calculate_expiry(user.plan_type)
 
-    # Create in MikroTik first
-    success = mikrotik.create_user(user.username, user.password, user.plan_type)
-    if not success:
-        log_event(db, f"Failed to create user in MikroTik: {user.username}")
-        raise HTTPException(status_code=500, detail="Failed to create user in MikroTik")
-
-    # Create in database
+    # Create in database on the least loaded router; router_state stays NULL
+    # until the reconciler has added the user there
     db_user = User(
         username=user.username,
         password=user.password,
         plan_type=user.plan_type,
         expiry=expiry,
         is_active=True,
+        router=await assign_router(db),
+        desired_state="enabled",
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    reconciler.wake()
+    expiry_scheduler.schedule(db_user.id, db_user.expiry)
+    dashboard_counters.user_changed(db_user.id, None, snapshot(db_user))
 
-    log_event(db, f"Created user: {user.username}")
+    log_event(
+        "user.created",
+        f"Created user: {user.username}",
+        user_id=db_user.id,
+        plan_type=db_user.plan_type,
+    )
     return db_user
 
 
-@app.get("/users", response_model=List[UserResponse])
-async def list_users(db: Session = Depends(get_db)):
-    """List all users"""
-    users = db.query(User).all()
-    return users
+@app.get("/users")
+async def list_users(
+    limit: int = PAGE_DEFAULT_LIMIT,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    plan_type: Optional[str] = None,
+    is_active: Optional[bool] = None,
+    state: Optional[str] = None,
+    q: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    List users, newest first, one page at a time
+
+    Pass ``next_cursor`` from the response as ``cursor`` for the next page.
+    ``q`` matches the start of the username, ``state`` is 'enabled' or
+    'disabled', and the date range applies to ``created_at``. ``fields``
+    picks the columns to return (comma separated).
+    """
+    filters = user_filters(plan_type, is_active, q)
+    if state:
+        if state not in ("enabled", "disabled"):
+            raise HTTPException(status_code=400, detail="state must be 'enabled' or 'disabled'")
+        filters.append(User.desired_state == state)
+    filters += date_filters(User.created_at, date_from, date_to)
+    return await user_listing.page(db, filters, cursor, limit, fields)
 
 
 @app.get("/users/{user_id}", response_model=UserResponse)
-async def get_user(user_id: int, db: Session = Depends(get_db)):
+async def get_user(user_id: int, db: AsyncSession = Depends(get_db)):
     """Get a specific user"""
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return user
+    return await get_live_user(db, user_id)
 
 
 @app.post("/users/{user_id}/extend")
 async def extend_user(
-    user_id: int, extension: ExtendSubscription, db: Session = Depends(get_db)
+    user_id: int, extension: ExtendSubscription, db: AsyncSession = Depends(get_db)
 ):
     """Extend user subscription"""
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    user = await get_live_user(db, user_id)
+    before = snapshot(user)
 
     # Extend expiry
     user.expiry = user.expiry + timedelta(days=extension.days)
 
-    # Enable user if disabled
+    # Enable user if disabled (the reconciler enables it on the router)
     if not user.is_active:
-        success = mikrotik.enable_user(user.username)
-        if success:
-            user.is_active = True
+        user.is_active = True
+        user.desired_state = "enabled"
 
-    db.commit()
-    log_event(db, f"Extended user {user.username} by {extension.days} days")
+    await db.commit()
+    reconciler.wake()
+    expiry_scheduler.schedule(user.id, user.expiry)
+    dashboard_counters.user_changed(user.id, before, snapshot(user))
+    log_event(
+        "user.extended",
+        f"Extended user {user.username} by {extension.days} days",
+        user_id=user.id,
+        days=extension.days,
+        expiry=user.expiry.isoformat(),
+    )
 
     return {
         "message": f"User extended by {extension.days} days",
@@ -268,172 +463,405 @@ async def extend_user(
 
 
 @app.post("/users/{user_id}/toggle")
-async def toggle_user(user_id: int, db: Session = Depends(get_db)):
-    """Toggle user active status"""
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+async def toggle_user(user_id: int, db: AsyncSession = Depends(get_db)):
+    """Toggle user active status (the reconciler applies it on the router)"""
+    user = await get_live_user(db, user_id)
+    before = snapshot(user)
 
+    user.is_active = not user.is_active
+    user.desired_state = "enabled" if user.is_active else "disabled"
+
+    await db.commit()
+    reconciler.wake()
     if user.is_active:
-        success = mikrotik.disable_user(user.username)
-        if success:
-            user.is_active = False
+        expiry_scheduler.schedule(user.id, user.expiry)
     else:
-        success = mikrotik.enable_user(user.username)
-        if success:
-            user.is_active = True
-
-    db.commit()
+        expiry_scheduler.cancel(user.id)
+    dashboard_counters.user_changed(user.id, before, snapshot(user))
     log_event(
-        db,
+        "user.toggled",
         f"Toggled user {user.username} to {'active' if user.is_active else 'inactive'}",
+        user_id=user.id,
+        is_active=user.is_active,
     )
 
-    return {"message": "User toggled", "is_active": user.is_active}
+    return {
+        "message": "User toggled",
+        "is_active": user.is_active,
+        "router_state": user.router_state,
+    }
 
 
 @app.delete("/users/{user_id}")
-async def delete_user(user_id: int, db: Session = Depends(get_db)):
-    """Delete user from both MikroTik and database"""
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+async def delete_user(user_id: int, db: AsyncSession = Depends(get_db)):
+    """
+    Delete user from both MikroTik and database
 
-    username = user.username
-    mikrotik_deleted = False
-    warning_message = None
+    The user is marked for deletion and disappears from listings at once;
+    the reconciler removes it from the router and then drops the row, so a
+    failed router delete is retried instead of leaving an orphan behind.
+    """
+    user = await get_live_user(db, user_id)
 
-    # Try to delete from MikroTik first
-    try:
-        mikrotik_deleted = mikrotik.delete_user(username)
-        if not mikrotik_deleted:
-            warning_message = "Could not delete from MikroTik (connection issue or user not found in router)"
-    except Exception as e:
-        warning_message = f"MikroTik deletion failed: {str(e)}"
-        print(f"MikroTik error during delete: {e}")
+    username = user.username
+    before = snapshot(user)
+    user.is_active = False
+    user.desired_state = "deleted"
+    await db.commit()
+    reconciler.wake()
+    expiry_scheduler.cancel(user.id)
+    dashboard_counters.user_changed(user.id, before, None)
 
-    # Always delete from database (even if MikroTik fails)
-    db.delete(user)
-    db.commit()
     log_event(
-        db,
-        f"Deleted user {username} from database. MikroTik status: {'success' if mikrotik_deleted else 'failed'}",
+        "user.deleted",
+        f"Scheduled deletion of user {username} from MikroTik and database",
+        user_id=user.id,
     )
 
-    # Return appropriate message
-    if mikrotik_deleted:
-        return {
-            "message": f"User {username} deleted successfully from both MikroTik and database",
-            "success": True,
-        }
-    else:
-        return {
-            "message": f"User {username} deleted from database. {warning_message}. You may need to manually remove from MikroTik if it still exists.",
-            "success": True,
-            "warning": warning_message,
-        }
+    return {
+        "message": f"User {username} deleted. Removal from MikroTik is in progress.",
+        "success": True,
+    }
 
 
 @app.post("/payments", response_model=PaymentResponse)
-async def record_payment(payment: PaymentCreate, db: Session = Depends(get_db)):
+async def record_payment(payment: PaymentCreate, db: AsyncSession = Depends(get_db)):
     """Record a payment"""
     # Verify user exists
-    user = db.query(User).filter(User.id == payment.user_id).first()
+    user = await db.get(User, payment.user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     # Create payment record
     db_payment = Payment(user_id=payment.user_id, amount=payment.amount, verified=True)
     db.add(db_payment)
-    db.commit()
-    db.refresh(db_payment)
+    await db.commit()
+    await db.refresh(db_payment)
+    dashboard_counters.payment_recorded(db_payment.amount, db_payment.date)
 
-    log_event(db, f"Payment recorded for user ID {payment.user_id}: ${payment.amount}")
+    log_event(
+        "payment.recorded",
+        f"Payment recorded for user ID {payment.user_id}: ${payment.amount}",
+        user_id=payment.user_id,
+        amount=payment.amount,
+    )
     return db_payment
 
 
-@app.get("/payments", response_model=List[PaymentResponse])
-async def list_payments(db: Session = Depends(get_db)):
-    """List all payments"""
-    payments = db.query(Payment).all()
-    return payments
+@app.get("/payments")
+async def list_payments(
+    limit: int = PAGE_DEFAULT_LIMIT,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    user_id: Optional[int] = None,
+    verified: Optional[bool] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """List payments, newest first, one page at a time (``username`` can be requested as a field)"""
+    filters = date_filters(Payment.date, date_from, date_to)
+    if user_id is not None:
+        filters.append(Payment.user_id == user_id)
+    if verified is not None:
+        filters.append(Payment.verified == verified)
+    return await payment_listing.page(db, filters, cursor, limit, fields)
 
 
 @app.get("/expired")
-async def list_expired(db: Session = Depends(get_db)):
-    """List all expired users"""
-    now = datetime.utcnow()
-    expired_users = db.query(User).filter(User.expiry < now).all()
-    return expired_users
+async def list_expired(
+    limit: int = PAGE_DEFAULT_LIMIT,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    plan_type: Optional[str] = None,
+    is_active: Optional[bool] = None,
+    q: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """List expired users, most recently expired first (``date_from`` bounds the expiry)"""
+    filters = user_filters(plan_type, is_active, q)
+    filters += date_filters(User.expiry, date_from, datetime.utcnow())
+    return await expired_listing.page(db, filters, cursor, limit, fields)
 
 
 @app.get("/active-connections")
 async def get_active_connections():
-    """Get currently active connections from MikroTik"""
-    active_users = mikrotik.get_active_users()
-    return {"count": len(active_users), "users": active_users}
+    """Get currently active connections (served from the background snapshot)"""
+    return session_monitor.snapshot()
+
+
+@app.get("/routers")
+async def list_routers(db: AsyncSession = Depends(get_db)):
+    """List configured routers with their load, connection pool and circuit breaker state"""
+    counts = await router_counts(db)
+    default = mikrotik.default_router.name
+    routers = []
+    for stats in mikrotik.stats():
+        assigned = counts.get(stats["name"], 0)
+        if stats["name"] == default:
+            assigned += counts.get(None, 0)
+        routers.append({**stats, "assigned_users": assigned})
+    return routers
+
+
+@app.get("/expiry-scheduler")
+async def get_expiry_scheduler_status():
+    """Users waiting to expire and how late expiries were applied"""
+    return expiry_scheduler.stats()
+
+
+@app.get("/expiry-sweeps")
+async def get_expiry_sweep_metrics():
+    """Rows and timings of recent expiry sweeps"""
+    return expiry_sweep.stats()
+
+
+@app.get("/event-log")
+async def get_event_log_stats():
+    """Audit log writer: queue depth, high-water mark, dropped events and flush timings"""
+    return event_log.stats()
+
+
+@app.get("/logs")
+async def list_logs(
+    limit: int = PAGE_DEFAULT_LIMIT,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    user_id: Optional[int] = None,
+    tx_ref: Optional[str] = None,
+    event_type: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Audit events, newest first, one page at a time
 
+    Filter by ``user_id`` (a customer's history), ``tx_ref`` (one payment)
+    and ``event_type`` (comma separated, e.g. 'payment.completed,payment.failed');
+    each is served by its own index. A date range also limits the months
+    (partitions) read.
+    """
+    filters = date_filters(Log.timestamp, date_from, date_to)
+    if user_id is not None:
+        filters.append(Log.user_id == user_id)
+    if tx_ref:
+        filters.append(Log.tx_ref == tx_ref)
+    if event_type:
+        filters.append(Log.event_type.in_([name.strip() for name in event_type.split(",")]))
+    return await log_listing.page(db, filters, cursor, limit, fields)
+
+
+@app.get("/logs/rollups")
+async def list_log_rollups(
+    event_type: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """Events per type per day (default: the last 30 days), kept after the events expire"""
+    if not date_from:
+        date_from = datetime.utcnow() - timedelta(days=30)
+    query = select(LogRollup.day, LogRollup.event_type, LogRollup.count).where(
+        *date_filters(LogRollup.day, date_from, date_to)
+    )
+    if event_type:
+        query = query.where(LogRollup.event_type.in_([name.strip() for name in event_type.split(",")]))
+    rows = await db.execute(query.order_by(LogRollup.day, LogRollup.event_type))
+    return [dict(row._mapping) for row in rows]
+
+
+@app.get("/logs/retention")
+async def get_log_retention():
+    """Retention settings and what the last retention run rolled up, created and dropped"""
+    return log_retention.stats()
 
-@app.get("/stats")
-async def get_stats(db: Session = Depends(get_db)):
-    """Get system statistics"""
-    total_users = db.query(User).count()
-    active_users = db.query(User).filter(User.is_active == True).count()
-    expired_users = db.query(User).filter(User.expiry < datetime.utcnow()).count()
-    total_payments = db.query(Payment).count()
 
+@app.get("/reconciler")
+async def get_reconciler_status():
+    """Pending router changes and reconciler counters"""
+    return await run_in_threadpool(reconciler.stats)  # counts pending users on the sync engine
+
+
+# Default look-back per usage period
+USAGE_DEFAULT_RANGE = {
+    "raw": timedelta(days=1),
+    "hour": timedelta(days=2),
+    "day": timedelta(days=30),
+}
+
+
+def usage_range(period: str, since: Optional[datetime], until: Optional[datetime]):
+    """Validate a usage query period and fill in its default time range"""
+    if period not in USAGE_DEFAULT_RANGE:
+        raise HTTPException(status_code=400, detail="period must be 'raw', 'hour' or 'day'")
+    until = until or datetime.utcnow()
+    since = since or until - USAGE_DEFAULT_RANGE[period]
+    return since, until
+
+
+@app.get("/usage/users/{username}")
+async def get_user_usage(
+    username: str,
+    period: str = "day",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """Data usage of one user per hour or day ('raw' returns the stored samples)"""
+    since, until = usage_range(period, since, until)
+    user = await db.scalar(select(User).where(User.username == username))
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    if period == "raw":
+        query = (
+            select(
+                UsageSample.timestamp,
+                UsageSample.bytes_in,
+                UsageSample.bytes_out,
+                UsageSample.uptime_seconds,
+            )
+            .where(
+                UsageSample.user_id == user.id,
+                UsageSample.timestamp >= since,
+                UsageSample.timestamp < until,
+            )
+            .order_by(UsageSample.timestamp)
+        )
+    else:
+        query = (
+            select(
+                UsageRollup.bucket,
+                UsageRollup.bytes_in,
+                UsageRollup.bytes_out,
+                UsageRollup.uptime_seconds,
+            )
+            .where(
+                UsageRollup.user_id == user.id,
+                UsageRollup.period == period,
+                UsageRollup.bucket >= since,
+                UsageRollup.bucket < until,
+            )
+            .order_by(UsageRollup.bucket)
+        )
+    rows = (await db.execute(query)).all()
+
+    buckets = [
+        {"bucket": bucket, "bytes_in": bytes_in, "bytes_out": bytes_out, "uptime_seconds": uptime}
+        for bucket, bytes_in, bytes_out, uptime in rows
+    ]
     return {
-        "total_users": total_users,
-        "active_users": active_users,
-        "expired_users": expired_users,
-        "total_payments": total_payments,
+        "username": user.username,
+        "plan_type": user.plan_type,
+        "period": period,
+        "since": since,
+        "until": until,
+        "buckets": buckets,
+        "totals": {
+            "bytes_in": sum(b["bytes_in"] for b in buckets),
+            "bytes_out": sum(b["bytes_out"] for b in buckets),
+            "uptime_seconds": sum(b["uptime_seconds"] for b in buckets),
+        },
     }
 
 
-@app.post("/sync-users")
-async def sync_users(db: Session = Depends(get_db)):
-    """Sync database users with MikroTik - remove stale users not in MikroTik"""
-    try:
-        # Get all users from MikroTik
-        mikrotik_usernames = set(mikrotik.get_all_users())
-
-        if not mikrotik_usernames:
-            return {
-                "success": False,
-                "message": "Failed to get users from MikroTik",
-                "removed": 0,
+@app.get("/usage/plans/{plan_type}")
+async def get_plan_usage(
+    plan_type: str,
+    period: str = "day",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """Data usage summed over every user of a plan, per hour or day"""
+    if period == "raw":
+        raise HTTPException(status_code=400, detail="period must be 'hour' or 'day'")
+    since, until = usage_range(period, since, until)
+    rows = await db.execute(
+        select(
+            UsageRollup.bucket,
+            func.count(UsageRollup.user_id),
+            func.sum(UsageRollup.bytes_in),
+            func.sum(UsageRollup.bytes_out),
+            func.sum(UsageRollup.uptime_seconds),
+        )
+        .where(
+            UsageRollup.plan_type == plan_type,
+            UsageRollup.period == period,
+            UsageRollup.bucket >= since,
+            UsageRollup.bucket < until,
+        )
+        .group_by(UsageRollup.bucket)
+        .order_by(UsageRollup.bucket)
+    )
+    return {
+        "plan_type": plan_type,
+        "period": period,
+        "since": since,
+        "until": until,
+        "buckets": [
+            {
+                "bucket": bucket,
+                "users": users,
+                "bytes_in": bytes_in,
+                "bytes_out": bytes_out,
+                "uptime_seconds": uptime,
             }
+            for bucket, users, bytes_in, bytes_out, uptime in rows
+        ],
+    }
 
-        # Get all users from database
-        db_users = db.query(User).all()
 
-        # Find stale users (in database but not in MikroTik)
-        stale_users = []
-        for user in db_users:
-            if user.username not in mikrotik_usernames:
-                stale_users.append(user.username)
+@app.get("/usage/stats")
+async def get_usage_stats():
+    """Usage ingestion counters (tracked sessions, samples written, counter resets)"""
+    return usage_accounting.stats()
 
-        # Remove stale users
-        removed_count = 0
-        for username in stale_users:
-            user = db.query(User).filter(User.username == username).first()
-            if user:
-                db.delete(user)
-                removed_count += 1
-                log_event(db, f"Removed stale user {username} during sync")
 
-        db.commit()
+@app.get("/stats")
+async def get_stats():
+    """
+    Get system statistics
 
-        return {
-            "success": True,
-            "message": f"Sync completed. Removed {removed_count} stale users.",
-            "removed": removed_count,
-            "stale_users": stale_users,
-            "mikrotik_total": len(mikrotik_usernames),
-            "database_total": len(db_users) - removed_count,
-        }
-    except Exception as e:
-        return {"success": False, "message": f"Sync failed: {str(e)}", "removed": 0}
+    Served from in-memory counters the write paths keep up to date (see
+    dashboard_counters), so the cost does not grow with the tables.
+    """
+    if not dashboard_counters.loaded:
+        await run_in_threadpool(dashboard_counters.refresh)
+    return dashboard_counters.stats()
+
+
+@app.get("/stats/counters")
+async def get_stats_counters():
+    """Refresh history of the /stats counters and the drift each refresh corrected"""
+    return dashboard_counters.status()
+
+
+@app.post("/sync-users")
+async def sync_users(full: bool = False, db_only: str = "remove", prune_router: bool = False):
+    """
+    Sync database users with MikroTik in both directions
+
+    Checks the next slice of users (or the whole table with ``full``).
+    Users missing from their router are removed from the database, or
+    re-provisioned with ``db_only=restore``. Router users unknown to the
+    database are reported, and deleted from the router with ``prune_router``
+    once earlier runs found them too (SYNC_PRUNE_GRACE_SECONDS).
+    """
+    if db_only not in ("remove", "restore"):
+        raise HTTPException(status_code=400, detail="db_only must be 'remove' or 'restore'")
+    report = await run_in_threadpool(user_sync.run, full, db_only, prune_router)
+    if db_only == "restore" and report.get("restored"):
+        reconciler.wake()
+    return report
+
+
+@app.get("/sync-users/last")
+async def last_sync_report():
+    """Diff report of the last sync run"""
+    return await run_in_threadpool(user_sync.last_report)
 
 
 # ==================== PAYMENT ENDPOINTS ====================
@@ -441,14 +869,15 @@ async def sync_users(db: Session = Depends(get_db)):
 
 @app.post("/payments/create-checkout", response_model=PaymentCheckoutResponse)
 async def create_payment_checkout(
-    request: PaymentCheckoutRequest, db: Session = Depends(get_db)
+    request: PaymentCheckoutRequest, db: AsyncSession = Depends(get_db)
 ):
     """
     Create a ZenoPay checkout session for internet access payment
     """
     try:
         # Create checkout with ZenoPay
-        checkout_data = payment_service.create_payment_checkout(
+        checkout_data = await run_in_threadpool(
+            payment_service.create_payment_checkout,
             phone=request.phone,
             buyer_name=request.buyer_name,
             plan_type=request.plan_type,
@@ -468,13 +897,20 @@ async def create_payment_checkout(
             status="PENDING",
         )
         db.add(transaction)
-        db.commit()
+        await db.commit()
 
-        log_event(db, f"Payment checkout created: {checkout_data['tx_ref']}")
+        log_event(
+            "checkout.created",
+            f"Payment checkout created: {checkout_data['tx_ref']}",
+            tx_ref=checkout_data["tx_ref"],
+            plan_type=request.plan_type,
+            amount=checkout_data["amount"],
+        )
 
         # Send payment link via WhatsApp
         try:
-            whatsapp_result = whatsapp_service.send_payment_reminder(
+            whatsapp_result = await run_in_threadpool(
+                whatsapp_service.send_payment_reminder,
                 phone=request.phone,
                 buyer_name=request.buyer_name,
                 payment_link=checkout_data["payment_link"],
@@ -482,94 +918,180 @@ async def create_payment_checkout(
 
             if whatsapp_result["success"]:
                 log_event(
-                    db,
+                    "whatsapp.sent",
                     f"WhatsApp payment reminder sent to {request.phone} - Message ID: {whatsapp_result.get('message_id')}",
+                    tx_ref=checkout_data["tx_ref"],
+                    message="payment_reminder",
+                    message_id=whatsapp_result.get("message_id"),
                 )
             else:
                 log_event(
-                    db,
+                    "whatsapp.failed",
                     f"WhatsApp payment reminder failed for {request.phone}: {whatsapp_result.get('error')}",
+                    tx_ref=checkout_data["tx_ref"],
+                    message="payment_reminder",
+                    error=whatsapp_result.get("error"),
                 )
                 print(
                     f"WhatsApp payment reminder error: {whatsapp_result.get('error')}"
                 )
 
         except Exception as e:
-            log_event(db, f"WhatsApp payment reminder exception: {str(e)}")
+            log_event(
+                "whatsapp.failed",
+                f"WhatsApp payment reminder exception: {str(e)}",
+                tx_ref=checkout_data["tx_ref"],
+                message="payment_reminder",
+                error=str(e),
+            )
             print(f"WhatsApp payment reminder exception: {e}")
 
         return PaymentCheckoutResponse(**checkout_data)
 
     except Exception as e:
-        log_event(db, f"Payment checkout failed: {str(e)}")
+        await db.rollback()
+        log_event("checkout.failed", f"Payment checkout failed: {str(e)}", error=str(e))
         raise HTTPException(
             status_code=500, detail=f"Failed to create payment checkout: {str(e)}"
         )
 
 
 @app.post("/payments/webhook")
-async def payment_webhook(request: Request, db: Session = Depends(get_db)):
+async def payment_webhook(request: Request, db: AsyncSession = Depends(get_db)):
     """
     ZenoPay webhook endpoint for payment notifications
+
+    Stores the raw notification and answers at once; webhook_queue workers
+    process it (process_payment_webhook) and retry it if that fails.
     """
-    try:
-        # Get raw body
-        raw_body = await request.body()
-        body_str = raw_body.decode("utf-8")
+    body_str = (await request.body()).decode("utf-8", errors="replace")
+    key = webhook_dedup_key(body_str)
 
-        # Parse JSON
-        import json
+    # A repeat of a notification seen moments ago costs no database work
+    if key and webhook_dedup.seen(key):
+        return {"status": "duplicate"}
 
-        payload = json.loads(body_str)
+    job = await webhook_queue.enqueue(db, body_str, key[0] if key else None)
+    if key:
+        webhook_dedup.add(key)
+    return {"status": "accepted", "job_id": job.id}
 
-        print(f"Received webhook: {payload}")
 
-        # Extract payment data (adjust based on ZenoPay webhook format)
-        payment_status = payload.get("payment_status", "").upper()
+def webhook_dedup_key(body_str: str):
+    """(tx_ref, payment_status) of a ZenoPay notification; None without a reference"""
+    try:
+        payload = json.loads(body_str)
         tx_ref = payload.get("reference") or payload.get("tx_ref")
+        payment_status = (payload.get("payment_status") or "").upper()
+    except (ValueError, AttributeError):
+        return None  # stored anyway; the worker dead-letters it
+    return (tx_ref, payment_status) if tx_ref else None
 
-        if not tx_ref:
-            return {"status": "error", "message": "No transaction reference found"}
 
-        # Find transaction in database
-        transaction = (
-            db.query(PaymentTransaction)
-            .filter(PaymentTransaction.tx_ref == tx_ref)
-            .first()
-        )
+def forget_payment_webhook(job):
+    """A webhook job failed or was dead-lettered: let ZenoPay's resend of it through"""
+    key = webhook_dedup_key(job.payload)
+    if key:
+        webhook_dedup.discard(key)
 
-        if not transaction:
-            return {
-                "status": "error",
-                "message": f"Transaction not found: {tx_ref}",
-            }
 
-        # Handle payment status
-        if payment_status == "COMPLETED" and transaction.status != "COMPLETED":
-            # Create user with auto-generated credentials
-            user_data = payment_service.create_user_after_payment(
-                tx_ref=tx_ref,
-                phone=transaction.phone,
-                buyer_name=transaction.buyer_name,
-                plan_type=transaction.plan_type,
+async def process_payment_webhook(db: AsyncSession, body_str: str):
+    """
+    Apply one stored ZenoPay notification (run by the webhook queue)
+
+    Raises PermanentJobError for notifications that can never be applied
+    and any other exception for failures worth retrying.
+    """
+    try:
+        payload = json.loads(body_str)
+    except ValueError:
+        raise PermanentJobError("Payload is not JSON")
+    if not isinstance(payload, dict):
+        raise PermanentJobError("Payload is not a JSON object")
+
+    print(f"Processing webhook: {payload}")
+
+    # Extract payment data (adjust based on ZenoPay webhook format)
+    payment_status = (payload.get("payment_status") or "").upper()
+    tx_ref = payload.get("reference") or payload.get("tx_ref")
+
+    if not tx_ref:
+        raise PermanentJobError("No transaction reference found")
+
+    # Find transaction in database
+    transaction = await db.scalar(
+        select(PaymentTransaction).where(PaymentTransaction.tx_ref == tx_ref)
+    )
+
+    if not transaction:
+        raise PermanentJobError(f"Transaction not found: {tx_ref}")
+
+    # Handle payment status
+    if payment_status == "COMPLETED":
+        if transaction.status == "COMPLETED":
+            return {"status": "duplicate", "message": "Payment already applied", "user_id": transaction.user_id}
+
+        # Take the payment with one conditional UPDATE: of concurrent
+        # notifications only one matches, so a customer is provisioned once.
+        # A claim older than the webhook lock timeout belongs to a dead worker.
+        transaction_id, previous_status = transaction.id, transaction.status
+        claimed_at = datetime.utcnow()
+        claimed = await db.execute(
+            update(PaymentTransaction)
+            .where(
+                PaymentTransaction.id == transaction_id,
+                or_(
+                    PaymentTransaction.status.in_(["PENDING", "FAILED"]),
+                    and_(
+                        PaymentTransaction.status == "PROCESSING",
+                        PaymentTransaction.processing_at < claimed_at - timedelta(seconds=WEBHOOK_LOCK_TIMEOUT),
+                    ),
+                ),
             )
+            .values(status="PROCESSING", processing_at=claimed_at)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        if claimed.rowcount != 1:
+            await db.refresh(transaction)
+            if transaction.status == "COMPLETED":
+                return {"status": "duplicate", "message": "Payment already applied", "user_id": transaction.user_id}
+            raise RuntimeError(f"Payment {tx_ref} is being processed by another worker")  # retried later
+        await payment_notifier.notify(tx_ref)
+
+        # Create user with auto-generated credentials
+        user_data = payment_service.create_user_after_payment(
+            tx_ref=tx_ref,
+            phone=transaction.phone,
+            buyer_name=transaction.buyer_name,
+            plan_type=transaction.plan_type,
+        )
 
-            # Calculate expiry
-            expiry = calculate_expiry(transaction.plan_type)
+        # Calculate expiry
+        expiry = calculate_expiry(transaction.plan_type)
 
-            # Create user in MikroTik
-            success = mikrotik.create_user(
-                user_data["username"], user_data["password"], transaction.plan_type
+        router = None
+        provisioned = False
+        try:
+            # Create user in MikroTik, on the least loaded router
+            router = await assign_router(db)
+            provisioned = await mikrotik_async.create_user(
+                user_data["username"],
+                user_data["password"],
+                transaction.plan_type,
+                router=router,
             )
 
-            if not success:
-                log_event(db, f"Failed to create MikroTik user for payment: {tx_ref}")
-                return {
-                    "status": "error",
-                    "message": "Failed to create user in MikroTik",
-                }
+            if not provisioned:
+                log_event(
+                    "provision.failed",
+                    f"Failed to create MikroTik user for payment: {tx_ref}",
+                    tx_ref=tx_ref,
+                    router=router,
+                )
+                raise RuntimeError("Failed to create user in MikroTik")
 
-            # Create user in database
+            # Create the user and complete the transaction in one commit
             db_user = User(
                 username=user_data["username"],
                 password=user_data["password"],
@@ -581,106 +1103,310 @@ async def payment_webhook(request: Request, db: Session = Depends(get_db)):
                 buyer_name=transaction.buyer_name,
                 tx_ref=tx_ref,
                 device_count=transaction.device_count,
+                router=router,
+                desired_state="enabled",
+                router_state="enabled",  # created synchronously above
             )
             db.add(db_user)
-            db.commit()
-            db.refresh(db_user)
+            await db.flush()
+            completed_at = datetime.utcnow()
+            completed = await db.execute(
+                update(PaymentTransaction)
+                .where(
+                    PaymentTransaction.id == transaction_id,
+                    PaymentTransaction.status == "PROCESSING",
+                    PaymentTransaction.processing_at == claimed_at,
+                )
+                .values(status="COMPLETED", user_id=db_user.id, completed_at=completed_at, processing_at=None)
+                .execution_options(synchronize_session=False)
+            )
+            if completed.rowcount != 1:
+                raise RuntimeError(f"Payment {tx_ref} was taken over by another worker")
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            if provisioned:
+                # Nothing references the router account; don't leave it behind
+                try:
+                    await mikrotik_async.delete_user(user_data["username"], router=router)
+                except Exception as e:
+                    print(f"✗ Could not remove MikroTik user {user_data['username']}: {e}")
+            # Give the payment back so the retry can take it
+            await db.execute(
+                update(PaymentTransaction)
+                .where(
+                    PaymentTransaction.id == transaction_id,
+                    PaymentTransaction.status == "PROCESSING",
+                    PaymentTransaction.processing_at == claimed_at,
+                )
+                .values(status=previous_status if previous_status != "PROCESSING" else "PENDING", processing_at=None)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+            await payment_notifier.notify(tx_ref)
+            raise
+
+        await db.refresh(db_user)
+        transaction.status, transaction.user_id, transaction.completed_at = "COMPLETED", db_user.id, completed_at
+        expiry_scheduler.schedule(db_user.id, db_user.expiry)
+        dashboard_counters.user_changed(db_user.id, None, snapshot(db_user))
+        dashboard_counters.revenue_received(transaction.amount, transaction.completed_at)
+        await payment_notifier.notify(tx_ref)  # customers waiting get their credentials now
+
+        log_event(
+            "payment.completed",
+            f"Payment completed: {tx_ref} - User {user_data['username']} created",
+            user_id=db_user.id,
+            tx_ref=tx_ref,
+            amount=transaction.amount,
+            plan_type=transaction.plan_type,
+        )
 
-            # Update transaction status
-            transaction.status = "COMPLETED"
-            transaction.user_id = db_user.id
-            transaction.completed_at = datetime.utcnow()
-            db.commit()
+        # Send credentials via WhatsApp
+        try:
+            whatsapp_result = await run_in_threadpool(
+                whatsapp_service.send_credentials_message,
+                phone=transaction.phone,
+                username=user_data["username"],
+                password=user_data["password"],
+                plan_type=transaction.plan_type,
+                buyer_name=transaction.buyer_name,
+            )
+
+            if whatsapp_result["success"]:
+                log_event(
+                    "whatsapp.sent",
+                    f"WhatsApp credentials sent to {transaction.phone} - Message ID: {whatsapp_result.get('message_id')}",
+                    user_id=db_user.id,
+                    tx_ref=tx_ref,
+                    message="credentials",
+                    message_id=whatsapp_result.get("message_id"),
+                )
+            else:
+                log_event(
+                    "whatsapp.failed",
+                    f"WhatsApp send failed for {transaction.phone}: {whatsapp_result.get('error')}",
+                    user_id=db_user.id,
+                    tx_ref=tx_ref,
+                    message="credentials",
+                    error=whatsapp_result.get("error"),
+                )
+                print(f"WhatsApp error: {whatsapp_result.get('error')}")
 
+        except Exception as e:
             log_event(
-                db,
-                f"Payment completed: {tx_ref} - User {user_data['username']} created",
+                "whatsapp.failed",
+                f"WhatsApp service error: {str(e)}",
+                user_id=db_user.id,
+                tx_ref=tx_ref,
+                message="credentials",
+                error=str(e),
             )
+            print(f"WhatsApp exception: {e}")
 
-            # Send credentials via WhatsApp
-            try:
-                whatsapp_result = whatsapp_service.send_credentials_message(
-                    phone=transaction.phone,
-                    username=user_data["username"],
-                    password=user_data["password"],
-                    plan_type=transaction.plan_type,
-                    buyer_name=transaction.buyer_name,
-                )
+        # Kept as the job's result; the credentials stay in the users table
+        return {
+            "status": "success",
+            "message": "User created successfully",
+            "user_id": db_user.id,
+            "username": user_data["username"],
+        }
 
-                if whatsapp_result["success"]:
-                    log_event(
-                        db,
-                        f"WhatsApp credentials sent to {transaction.phone} - Message ID: {whatsapp_result.get('message_id')}",
-                    )
-                else:
-                    log_event(
-                        db,
-                        f"WhatsApp send failed for {transaction.phone}: {whatsapp_result.get('error')}",
-                    )
-                    print(f"WhatsApp error: {whatsapp_result.get('error')}")
-
-            except Exception as e:
-                log_event(db, f"WhatsApp service error: {str(e)}")
-                print(f"WhatsApp exception: {e}")
-
-            return {
-                "status": "success",
-                "message": "User created successfully",
-                "username": user_data["username"],
-                "password": user_data["password"],
-            }
+    elif payment_status == "FAILED":
+        # Only a payment still pending can fail; a late FAILED never undoes a completion
+        failed = await db.execute(
+            update(PaymentTransaction)
+            .where(PaymentTransaction.id == transaction.id, PaymentTransaction.status == "PENDING")
+            .values(status="FAILED")
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        if failed.rowcount != 1:
+            return {"status": "acknowledged", "message": f"Payment is {transaction.status}"}
+        await payment_notifier.notify(tx_ref)
+        log_event("payment.failed", f"Payment failed: {tx_ref}", tx_ref=tx_ref)
+        return {"status": "acknowledged", "message": "Payment failed"}
+
+    return {"status": "acknowledged"}
+
+
+@app.get("/payments/webhook/jobs")
+async def list_webhook_jobs(
+    limit: int = PAGE_DEFAULT_LIMIT,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    status: Optional[str] = None,
+    tx_ref: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """Stored webhooks, newest first; ``status=dead`` lists the dead letters"""
+    filters = []
+    if status:
+        filters.append(WebhookJob.status == status)
+    if tx_ref:
+        filters.append(WebhookJob.tx_ref == tx_ref)
+    return await webhook_job_listing.page(db, filters, cursor, limit, fields)
 
-        elif payment_status == "FAILED":
-            transaction.status = "FAILED"
-            db.commit()
-            log_event(db, f"Payment failed: {tx_ref}")
-            return {"status": "acknowledged", "message": "Payment failed"}
 
-        return {"status": "acknowledged"}
+@app.get("/payments/webhook/jobs/stats")
+async def get_webhook_queue_stats(db: AsyncSession = Depends(get_db)):
+    """Queue depth, retries, dead letters, throughput and latency of the webhook workers"""
+    return {**await webhook_queue.stats(db), "dedup": webhook_dedup.stats()}
 
-    except Exception as e:
-        print(f"Webhook error: {e}")
-        log_event(db, f"Webhook error: {str(e)}")
-        return {"status": "error", "message": str(e)}
 
+@app.post("/payments/webhook/jobs/{job_id}/retry")
+async def retry_webhook_job(job_id: int, db: AsyncSession = Depends(get_db)):
+    """Queue a dead-lettered webhook again"""
+    if not await webhook_queue.retry(db, job_id):
+        raise HTTPException(status_code=404, detail="No dead webhook job with this id")
+    log_event("webhook.retried", f"Webhook job {job_id} queued again", job_id=job_id)
+    return {"message": f"Webhook job {job_id} queued again"}
 
-@app.get("/payments/transactions")
-async def list_payment_transactions(db: Session = Depends(get_db)):
-    """List all payment transactions"""
-    transactions = (
-        db.query(PaymentTransaction)
-        .order_by(PaymentTransaction.created_at.desc())
-        .all()
-    )
-    return transactions
 
+@app.get("/payments/transactions")
+async def list_payment_transactions(
+    limit: int = PAGE_DEFAULT_LIMIT,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    status: Optional[str] = None,
+    plan_type: Optional[str] = None,
+    phone: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """List payment transactions, newest first, one page at a time"""
+    filters = date_filters(PaymentTransaction.created_at, date_from, date_to)
+    if status:
+        filters.append(PaymentTransaction.status == status.upper())
+    if plan_type:
+        filters.append(PaymentTransaction.plan_type == plan_type)
+    if phone:
+        filters.append(PaymentTransaction.phone == phone)
+    return await transaction_listing.page(db, filters, cursor, limit, fields)
+
+
+async def read_payment_status(tx_ref: str):
+    """
+    A payment's status, with the credentials once it is completed; None if unknown
 
-@app.get("/payments/check/{tx_ref}")
-async def check_payment_status(tx_ref: str, db: Session = Depends(get_db)):
-    """Check payment status and return credentials if completed"""
-    transaction = (
-        db.query(PaymentTransaction).filter(PaymentTransaction.tx_ref == tx_ref).first()
-    )
+    One query on a short-lived session, so requests waiting for a payment
+    hold no database connection in between.
+    """
+    async with AsyncSessionLocal() as db:
+        row = (
+            await db.execute(
+                select(PaymentTransaction.status, User)
+                .outerjoin(User, User.id == PaymentTransaction.user_id)
+                .where(PaymentTransaction.tx_ref == tx_ref)
+            )
+        ).first()
 
-    if not transaction:
-        raise HTTPException(status_code=404, detail="Transaction not found")
+    if row is None:
+        return None
 
-    if transaction.status == "COMPLETED" and transaction.user_id:
-        user = db.query(User).filter(User.id == transaction.user_id).first()
-        if user:
-            return {
-                "status": "COMPLETED",
-                "username": user.username,
-                "password": user.password,
-                "plan_type": user.plan_type,
-                "expiry": user.expiry,
-            }
+    status, user = row
+    if status == "COMPLETED" and user:
+        return {
+            "status": "COMPLETED",
+            "username": user.username,
+            "password": user.password,
+            "plan_type": user.plan_type,
+            "expiry": user.expiry,
+        }
 
     return {
-        "status": transaction.status,
+        "status": status,
         "message": "Payment not yet completed",
     }
 
 
+@app.get("/payments/check/{tx_ref}")
+async def check_payment_status(tx_ref: str, wait: float = 0):
+    """
+    Check payment status and return credentials if completed
+
+    With ``wait`` (seconds, up to PAYMENT_WAIT_MAX) a payment that is not
+    completed yet holds the request until its status changes (past
+    PROCESSING) or the time is up: long polling, instead of the client
+    polling every few seconds.
+    """
+    # Subscribe before reading so a change in between is not missed
+    changed = payment_notifier.subscribe(tx_ref)
+    try:
+        result = await read_payment_status(tx_ref)
+        if not result:
+            raise HTTPException(status_code=404, detail="Transaction not found")
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + min(max(wait, 0), PAYMENT_WAIT_MAX)
+        initial = result["status"]
+        while result["status"] in (initial, "PROCESSING") and result["status"] != "COMPLETED":
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            changed.clear()
+            try:
+                await asyncio.wait_for(changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+            result = await read_payment_status(tx_ref) or result
+        return result
+    finally:
+        payment_notifier.unsubscribe(tx_ref, changed)
+
+
+@app.get("/payments/events/{tx_ref}")
+async def stream_payment_status(tx_ref: str):
+    """
+    Server-sent events with the payment's status (same body as /payments/check)
+
+    Sends the current status at once and again whenever it changes; the
+    stream ends after the COMPLETED event with the credentials, or after
+    PAYMENT_STREAM_MAX seconds (EventSource then reconnects by itself).
+    """
+    if not await read_payment_status(tx_ref):
+        raise HTTPException(status_code=404, detail="Transaction not found")
+
+    async def events():
+        changed = payment_notifier.subscribe(tx_ref)
+        deadline = asyncio.get_running_loop().time() + PAYMENT_STREAM_MAX
+        last = None
+        try:
+            while True:
+                changed.clear()
+                result = await read_payment_status(tx_ref)
+                if result and result != last:
+                    last = result
+                    yield f"event: status\ndata: {json.dumps(result, default=str)}\n\n"
+                    if result["status"] == "COMPLETED":
+                        return
+                else:
+                    yield ": keep-alive\n\n"
+
+                remaining = deadline - asyncio.get_running_loop().time()
+                if remaining <= 0:
+                    return
+                try:
+                    # Woken by the notifier; the heartbeat re-read covers a missed notification
+                    await asyncio.wait_for(changed.wait(), min(PAYMENT_STREAM_HEARTBEAT, remaining))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            payment_notifier.unsubscribe(tx_ref, changed)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},  # no proxy buffering
+    )
+
+
+@app.get("/payments/notifier")
+async def get_payment_notifier_status():
+    """Requests waiting on payments and notifications sent and received"""
+    return payment_notifier.stats()
+
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=API_PORT)
@@ -1,408 +1,813 @@
+import asyncio
+import json
 import os
 import re
-import subprocess
+import threading
 from datetime import datetime
 
-import routeros_api
+from circuit_breaker import CircuitBreaker
 from dotenv import load_dotenv
+from hotspot_index import HotspotUserIndex
+from neighbor_resolver import neighbor_resolver
+from routeros_async import (
+    AsyncRouterOsConnection,
+    AsyncRouterOsPool,
+    RouterOsConnectionError,
+    RouterOsTrapError,
+)
 
 load_dotenv()
 
+# Max commands kept in flight on one session by the bulk operations
+MIKROTIK_BULK_CHUNK = int(os.getenv("MIKROTIK_BULK_CHUNK", "100"))
+
+# Only the /ip/hotspot/active fields the dashboard and accounting use
+ACTIVE_SESSION_PROPERTIES = ".id,user,address,mac-address,uptime,login-by,bytes-in,bytes-out"
+
+# Errors that mean the router link is down (as opposed to a command the router rejected)
+LINK_ERRORS = (RouterOsConnectionError, asyncio.TimeoutError, OSError)
+
+
+def _uptime_limit(plan_type):
+    """Uptime limit (actual usage time, not calendar time) for a plan"""
+    if plan_type == "daily_1000":
+        return "1d"  # 24 hours of actual usage
+    elif plan_type == "monthly_1000":
+        return "30d"  # 30 days of actual usage
+    return "1d"  # Default to 1 day
+
+
+def _describe(error):
+    """Readable error text (timeouts have an empty message)"""
+    return str(error) or type(error).__name__
+
+
+def _is_missing_item(error):
+    """True if a router trap says the referenced .id no longer exists"""
+    return "no such item" in str(error)
+
+
+def _is_duplicate(error):
+    """True if a router trap says an item with that name already exists"""
+    return "already have" in str(error)
+
+
+def _user_arguments(user):
+    """/ip/hotspot/user/add arguments for a user dict"""
+    return {
+        "name": user["username"],
+        "password": user["password"],
+        "profile": user["plan_type"],
+        "limit-uptime": _uptime_limit(user["plan_type"]),
+        "disabled": "yes" if user.get("disabled") else "no",
+    }
+
+
+def load_router_configs():
+    """
+    Read the router list from the environment
+
+    MIKROTIK_ROUTERS holds a JSON list such as
+    [{"name": "hq", "host": "10.0.0.2", "username": "api_admin",
+      "password": "...", "port": 8728, "capacity": 500}, ...]
+    Without it the single MIKROTIK_HOST/USERNAME/PASSWORD/PORT router is used
+    under the name "default".
+    """
+    raw = os.getenv("MIKROTIK_ROUTERS", "").strip()
+    if raw:
+        configs = json.loads(raw)
+        if not configs:
+            raise ValueError("MIKROTIK_ROUTERS must list at least one router")
+        return configs
+    return [
+        {
+            "name": "default",
+            "host": os.getenv("MIKROTIK_HOST", "192.168.88.1"),
+            "username": os.getenv("MIKROTIK_USERNAME", "admin"),
+            "password": os.getenv("MIKROTIK_PASSWORD", ""),
+            "port": int(os.getenv("MIKROTIK_PORT", "8728")),
+            "capacity": int(os.getenv("MIKROTIK_CAPACITY", "0")) or None,
+        }
+    ]
+
+
+class RouterLoop:
+    """Background thread running the event loop that owns every router socket"""
 
-class MikroTikAPI:
     def __init__(self):
-        self.original_host = os.getenv(
-            "MIKROTIK_HOST", "192.168.88.1"
-        )  # Store original (MAC or IP)
-        self.host = self.original_host
-        self.username = os.getenv("MIKROTIK_USERNAME", "admin")
-        self.password = os.getenv("MIKROTIK_PASSWORD", "")
-        self.port = int(os.getenv("MIKROTIK_PORT", "8728"))
-        self.connection = None
-        self.cached_ip = None  # Cache resolved IP
-        self.last_scan_time = 0  # Track last scan (avoid frequent rescans)
-
-        # If host is MAC address, try to find IP
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever, name="router-io", daemon=True
+                ).start()
+        return self._loop
+
+    def run(self, coro):
+        """Run a coroutine on the router loop and block until it finishes"""
+        loop = self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    async def run_async(self, coro):
+        """
+        Await a coroutine running on the router loop from another event loop.
+
+        Cancelling the awaiting task cancels the router-side task too, which
+        sends /cancel for any command still in flight.
+        """
+        loop = self._ensure_started()
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+
+class MikroTikRouter:
+    """
+    One router: its host, credentials and capacity, its connection pool,
+    its name -> .id index and the circuit breaker guarding its link. All
+    coroutines run on the router loop.
+    """
+
+    def __init__(self, name, host, username="admin", password="", port=8728, capacity=None):
+        self.name = name
+        self.original_host = host  # Store original (MAC or IP)
+        self.host = host
+        self.username = username
+        self.password = password
+        self.port = int(port or 8728)
+        self.capacity = capacity  # max users assigned here (None = unlimited)
+
+        self.pool = AsyncRouterOsPool(self._open_connection)
+
+        # Router user name -> .id, so updates skip the per-user lookup
+        self.index = HotspotUserIndex()
+
+        # Fail fast while the router is down instead of queueing on connect timeouts
+        self.breaker = CircuitBreaker(f"router {self.name}", self._probe)
+
+        # If host is MAC address, let the resolver track it in the background
         if self._is_mac_address(self.original_host):
-            print(f"MAC address detected: {self.original_host}")
-            ip = self._find_ip_from_mac(self.original_host)
+            print(f"[{self.name}] MAC address detected: {self.original_host}")
+            neighbor_resolver.watch(self.original_host)
+            ip = neighbor_resolver.resolve(self.original_host)
             if ip:
                 print(f"✓ Resolved to: {ip}")
                 self.host = ip
-                self.cached_ip = ip
-                import time
-
-                self.last_scan_time = time.time()
             else:
-                print(f"✗ Could not resolve MAC to IP")
-
-    def refresh_config(self):
-        """Reload configuration from .env and clear caches"""
-        from dotenv import load_dotenv
-
-        load_dotenv(override=True)  # Force reload .env
-
-        # Clear connection and caches
-        if self.connection:
-            try:
-                self.connection.disconnect()
-            except:
-                pass
-        self.connection = None
-        self.cached_ip = None
-        self.last_scan_time = 0
-
-        # Reload config
-        self.original_host = os.getenv("MIKROTIK_HOST", "192.168.88.1")
-        self.host = self.original_host
-        self.username = os.getenv("MIKROTIK_USERNAME", "admin")
-        self.password = os.getenv("MIKROTIK_PASSWORD", "")
-        self.port = int(os.getenv("MIKROTIK_PORT", "8728"))
-
-        print(f"✓ Configuration refreshed - MikroTik host: {self.host}")
+                print(f"✗ MAC not in neighbour table yet - will resolve in the background")
 
     def _is_mac_address(self, address):
         """Check if the address is a MAC address"""
         mac_pattern = re.compile(r"^([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})$")
         return bool(mac_pattern.match(address))
 
-    def _get_local_network(self):
-        """Get local network subnet"""
-        try:
-            import socket
-
-            import netifaces
+    def _resolve_host(self):
+        """Return the router IP; MAC hosts are answered from the neighbour cache"""
+        if not self._is_mac_address(self.original_host):
+            return self.host
 
-            # Try using netifaces (more reliable)
+        ip = neighbor_resolver.resolve(self.original_host)
+        if not ip:
+            raise RouterOsConnectionError(
+                f"MAC {self.original_host} not seen yet (ARP/MNDP) - is the router on this network?"
+            )
+        self.host = ip
+        return self.host
+
+    async def _open_connection(self):
+        """Open and log in a new API connection (called by the pool only)"""
+        host = self._resolve_host()
+        print(f"[{self.name}] Opening MikroTik session to {host}:{self.port}...")
+        connection = AsyncRouterOsConnection(host, self.port, self.username, self.password)
+        return await connection.open()
+
+    async def _probe(self):
+        """Single round trip the breaker uses to test a router it considers down"""
+        connection = await self.pool.connection()
+        try:
+            await connection.ping()
+        except Exception:
+            await self.pool.discard(connection)
+            raise
+
+    # ==================== ROUTER COROUTINES ====================
+    #
+    # Bulk operations pipeline their commands on one connection: a whole
+    # chunk of tagged commands is written before any reply is read, so N
+    # users cost roughly one round trip per chunk. They return a dict
+    # mapping each username to True/False.
+
+    async def connect(self):
+        print(f"[{self.name}] Connecting to MikroTik at {self.host}:{self.port}...")
+        try:
+            await self.run("Connect", lambda connection: connection.ping())
+        except Exception as e:
+            print(f"❌ [{self.name}] Connection failed: {_describe(e)}")
+            return False
+        print(f"✅ [{self.name}] Connected to MikroTik successfully")
+        return True
+
+    async def run(self, description, operation):
+        """
+        Run operation(connection) through the circuit breaker
+
+        A broken connection is retried once on a fresh one. Link failures
+        (refused, dropped, timed out) count towards opening the breaker;
+        while it is open this raises CircuitOpenError without touching the
+        network.
+        """
+        for attempt in range(2):
+            await self.breaker.check()
+            connection = None
             try:
-                gateways = netifaces.gateways()
-                default_interface = gateways["default"][netifaces.AF_INET][1]
-                addrs = netifaces.ifaddresses(default_interface)
-                ip = addrs[netifaces.AF_INET][0]["addr"]
-                # Extract subnet (e.g., 192.168.1.x from 192.168.1.100)
-                subnet = ".".join(ip.split(".")[0:3])
-                return subnet
-            except:
-                pass
-
-            # Fallback: use socket to get local IP
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.connect(("8.8.8.8", 80))
-            local_ip = s.getsockname()[0]
-            s.close()
-            subnet = ".".join(local_ip.split(".")[0:3])
-            return subnet
-        except:
-            return "192.168.1"  # Default fallback
-
-    def _find_ip_from_mac(self, mac_address):
-        """Find IP address from MAC address using ARP - FAST VERSION"""
+                connection = await self.pool.connection()
+                result = await operation(connection)
+            except RouterOsTrapError:
+                # The router answered - the link itself is fine
+                self.breaker.record_success()
+                raise
+            except LINK_ERRORS as e:
+                self.breaker.record_failure(e)
+                # Timeouts are not retried: the command may already have run
+                if attempt == 0 and connection is not None and isinstance(e, RouterOsConnectionError):
+                    print(f"[{self.name}] {description}: connection lost ({e}), retrying on a fresh one")
+                    await self.pool.discard(connection)
+                    continue
+                raise
+            self.breaker.record_success()
+            return result
+
+    async def pipeline(self, connection, command, calls):
+        """Send ``command`` once per (arguments, queries) pair and collect results"""
+        results = []
+        for start in range(0, len(calls), MIKROTIK_BULK_CHUNK):
+            chunk = calls[start:start + MIKROTIK_BULK_CHUNK]
+            replies = await asyncio.gather(
+                *(connection.call(command, arguments, queries) for arguments, queries in chunk),
+                return_exceptions=True,
+            )
+            for reply in replies:
+                if isinstance(reply, RouterOsTrapError):
+                    results.append((False, reply))
+                elif isinstance(reply, BaseException):
+                    raise reply
+                else:
+                    results.append((True, reply))
+        return results
+
+    async def resolve_ids(self, connection, usernames, use_index=True):
+        """Map usernames to router .id values, looking up index misses on the router"""
+        if use_index:
+            ids, missing = self.index.get_many(usernames)
+        else:
+            ids, missing = {}, list(usernames)
+        if not missing:
+            return ids
+
+        replies = await self.pipeline(
+            connection,
+            "/ip/hotspot/user/print",
+            [({"proplist": ".id,name"}, {"name": name}) for name in missing],
+        )
+        for name, (ok, rows) in zip(missing, replies):
+            if ok and rows:
+                ids[name] = rows[0]["id"]
+                self.index.remember(name, rows[0]["id"])
+        return ids
+
+    async def apply_by_id(self, connection, command, usernames, arguments, missing_ok):
+        """
+        Run ``command`` against each user's .id, refreshing ids the router rejects
+
+        A cached .id the router no longer knows ("no such item") is dropped from
+        the index and looked up again by name once before the user is treated
+        as missing.
+        """
+        results = {}
+        pending = usernames
+        for attempt in range(2):
+            ids = await self.resolve_ids(connection, pending, use_index=attempt == 0)
+            found = [name for name in pending if name in ids]
+            for name in pending:
+                if name not in ids:
+                    results[name] = missing_ok
+
+            replies = await self.pipeline(
+                connection,
+                f"/ip/hotspot/user/{command}",
+                [(dict(arguments, id=ids[name]), {}) for name in found],
+            )
+            stale = []
+            for name, (ok, reply) in zip(found, replies):
+                if not ok and _is_missing_item(reply):
+                    self.index.forget(name)
+                    stale.append(name)
+                    continue
+                results[name] = ok
+                if ok and command == "remove":
+                    self.index.forget(name)
+                elif not ok:
+                    print(f"[{self.name}] Failed to {command} user {name}: {reply}")
+            if not stale:
+                break
+            pending = stale
+
+        for name in usernames:
+            results.setdefault(name, missing_ok)
+        return results
+
+    async def bulk_apply(self, description, command, usernames, arguments, missing_ok=False):
+        usernames = list(dict.fromkeys(usernames))
+        results = {name: False for name in usernames}
+        if not usernames:
+            return results
         try:
-            mac_normalized = mac_address.lower().replace("-", ":")
-
-            # STEP 1: Quick ARP cache check (instant)
-            result = subprocess.run(
-                ["arp", "-a"], capture_output=True, text=True, timeout=5
+            results.update(
+                await self.run(
+                    description,
+                    lambda connection: self.apply_by_id(
+                        connection, command, usernames, arguments, missing_ok
+                    ),
+                )
+            )
+        except Exception as e:
+            print(f"[{self.name}] {description} failed: {_describe(e)}")
+        print(f"[{self.name}] {description}: {sum(results.values())}/{len(usernames)} users")
+        return results
+
+    async def create_users(self, users, upsert=False):
+        """
+        Add users; with ``upsert`` a user the router already has is updated
+        in place (password, profile, disabled) instead of failing
+        """
+        users = list(users)
+        results = {user["username"]: False for user in users}
+        if not users:
+            return results
+
+        async def add_all(connection):
+            replies = await self.pipeline(
+                connection,
+                "/ip/hotspot/user/add",
+                [(_user_arguments(user), {}) for user in users],
             )
-            for line in result.stdout.split("\n"):
-                if mac_normalized in line.lower():
-                    ip_match = re.search(r"\(([0-9.]+)\)", line)
-                    if ip_match:
-                        found_ip = ip_match.group(1)
-                        print(f"✓ Found in ARP cache: {found_ip}")
-                        return found_ip
-
-            # STEP 2: Quick targeted ping (2-3 seconds max)
-            print(f"Scanning for MAC {mac_address}...")
-            subnet = self._get_local_network()
-
-            # Only check most likely IPs (gateway, MikroTik default, and .159)
-            quick_scan = [f"{subnet}.1", f"{subnet}.159", "192.168.88.1"]
-
-            # Ping all at once using threading for speed
-            import threading
-
-            def quick_ping(ip):
-                try:
-                    subprocess.run(
-                        ["ping", "-c", "1", "-W", "1", ip],
-                        capture_output=True,
-                        timeout=2,
+            if not upsert:
+                return replies
+
+            existing = [
+                index
+                for index, (ok, reply) in enumerate(replies)
+                if not ok and _is_duplicate(reply)
+            ]
+            if not existing:
+                return replies
+            names = [users[index]["username"] for index in existing]
+            ids = await self.resolve_ids(connection, names, use_index=False)
+            found = [index for index in existing if users[index]["username"] in ids]
+            updates = await self.pipeline(
+                connection,
+                "/ip/hotspot/user/set",
+                [
+                    (
+                        {
+                            key: value
+                            for key, value in _user_arguments(users[index]).items()
+                            if key != "name"
+                        }
+                        | {"id": ids[users[index]["username"]]},
+                        {},
                     )
-                except:
-                    pass
-
-            threads = []
-            for ip in quick_scan:
-                t = threading.Thread(target=quick_ping, args=(ip,))
-                t.start()
-                threads.append(t)
-
-            # Wait for all pings (max 2 seconds)
-            for t in threads:
-                t.join(timeout=2)
-
-            # Quick ARP check
-            result = subprocess.run(
-                ["arp", "-a"], capture_output=True, text=True, timeout=5
+                    for index in found
+                ],
             )
-            for line in result.stdout.split("\n"):
-                if mac_normalized in line.lower():
-                    ip_match = re.search(r"\(([0-9.]+)\)", line)
-                    if ip_match:
-                        found_ip = ip_match.group(1)
-                        print(f"✓ Found after quick scan: {found_ip}")
-                        return found_ip
-
-            print(f"✗ Could not find MAC {mac_address} quickly")
-            print(f"TIP: Make sure you're on the same network as the router")
+            for index, update in zip(found, updates):
+                replies[index] = update
+            return replies
 
+        try:
+            replies = await self.run("Create", add_all)
+            for user, (ok, reply) in zip(users, replies):
+                results[user["username"]] = ok
+                if ok:
+                    # "add" answers with the new item's .id - keep the index current
+                    user_id = reply.done.get("ret")
+                    if user_id:
+                        self.index.remember(user["username"], user_id)
+                else:
+                    print(f"[{self.name}] Failed to create user {user['username']}: {reply}")
         except Exception as e:
-            print(f"Error finding IP from MAC: {e}")
+            print(f"[{self.name}] Create failed: {_describe(e)}")
+        print(f"[{self.name}] Create: {sum(results.values())}/{len(users)} users")
+        return results
+
+    async def fetch_active_users(self):
+        """Read /ip/hotspot/active, tagging each session with this router's name"""
+        rows = await self.run(
+            "Active users",
+            lambda connection: connection.call(
+                "/ip/hotspot/active/print", {"proplist": ACTIVE_SESSION_PROPERTIES}
+            ),
+        )
+        return [dict(row, router=self.name) for row in rows]
+
+    async def list_users(self):
+        """List user names (only .id,name are read) and reload the index from it"""
+        rows = await self.run(
+            "List users",
+            lambda connection: connection.call(
+                "/ip/hotspot/user/print", {"proplist": ".id,name"}
+            ),
+        )
+        return self.index.reload(rows)
+
+    async def user_states(self):
+        """
+        Read every user's name and disabled flag (and reload the index)
+
+        Returns:
+            dict: {username: 'enabled' or 'disabled'}
+        """
+        rows = await self.run(
+            "User states",
+            lambda connection: connection.call(
+                "/ip/hotspot/user/print", {"proplist": ".id,name,disabled"}
+            ),
+        )
+        self.index.reload(rows)
+        return {
+            row["name"]: "disabled" if row.get("disabled") in ("true", "yes") else "enabled"
+            for row in rows
+        }
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "host": self.host,
+            "port": self.port,
+            "capacity": self.capacity,
+            "pool": self.pool.stats(),
+            "index": self.index.stats(),
+            "breaker": self.breaker.stats(),
+        }
 
-        return None
 
-    def connect(self, retry=True):
-        """Establish connection to MikroTik router"""
-        import time
+class MikroTikAPI:
+    """
+    Blocking interface to the routers for threads (scheduler, pollers).
 
-        max_retries = 3 if retry else 1
+    Manages every configured router. Users are pinned to a router (stored on
+    User.router); writes go to that router and reads fan out to all routers
+    concurrently and are merged. The work runs as coroutines on the shared
+    router loop; see AsyncMikroTikAPI for the non-blocking interface used by
+    endpoints.
+    """
 
-        for attempt in range(max_retries):
-            try:
-                # Disconnect existing connection if any
-                if self.connection:
-                    try:
-                        self.connection.disconnect()
-                    except:
-                        pass
-                    self.connection = None
-
-                # Re-resolve MAC to IP only if needed (smart caching)
-                if self._is_mac_address(self.original_host):
-                    current_time = time.time()
-                    cache_age = current_time - self.last_scan_time
-
-                    # Use cached IP if it's less than 5 minutes old, otherwise re-scan
-                    if self.cached_ip and cache_age < 300:  # 5 minutes
-                        self.host = self.cached_ip
-                        if attempt == 0:  # Only print on first attempt
-                            print(f"Using cached IP: {self.cached_ip}")
-                    else:
-                        print(f"Refreshing IP for MAC {self.original_host}...")
-                        ip = self._find_ip_from_mac(self.original_host)
-                        if ip:
-                            self.host = ip
-                            self.cached_ip = ip
-                            self.last_scan_time = current_time
-                        else:
-                            print(f"✗ Could not resolve MAC to IP")
-                            if attempt < max_retries - 1:
-                                time.sleep(2)
-                                continue
-                            return False
-
-                print(
-                    f"Connecting to MikroTik at {self.host}:{self.port} (attempt {attempt + 1}/{max_retries})..."
-                )
+    def __init__(self):
+        # All router sockets live on one background event loop; request
+        # handlers (via AsyncMikroTikAPI) and scheduler threads submit to it
+        self.router_loop = RouterLoop()
+        self.routers = self._build_routers()
+
+    def _build_routers(self):
+        routers = {}
+        for config in load_router_configs():
+            router = MikroTikRouter(
+                config["name"],
+                config["host"],
+                username=config.get("username", "admin"),
+                password=config.get("password", ""),
+                port=config.get("port", 8728),
+                capacity=config.get("capacity"),
+            )
+            routers[router.name] = router
+        return routers
 
-                # Set socket timeout (increased for network latency)
-                import socket
+    @property
+    def default_router(self):
+        """First configured router; users without an assignment live here"""
+        return next(iter(self.routers.values()))
 
-                socket.setdefaulttimeout(240)
+    def refresh_config(self):
+        """Reload configuration from .env and clear caches"""
+        self.router_loop.run(self._refresh_config())
 
-                self.connection = routeros_api.RouterOsApiPool(
-                    self.host,
-                    username=self.username,
-                    password=self.password,
-                    port=self.port,
-                    plaintext_login=True,
-                )
-                print(f"✅ Connected to MikroTik successfully")
-                return True
-            except Exception as e:
-                print(f"❌ Connection attempt {attempt + 1} failed: {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(2)  # Wait before retry
-                    continue
-                return False
+    async def _refresh_config(self):
+        from dotenv import load_dotenv
+
+        load_dotenv(override=True)  # Force reload .env
+
+        # Drop pooled connections (they may point at an old host)
+        for router in self.routers.values():
+            await router.pool.shutdown()
+        self.routers = self._build_routers()
+
+        hosts = ", ".join(f"{r.name}={r.host}" for r in self.routers.values())
+        print(f"✓ Configuration refreshed - MikroTik routers: {hosts}")
+
+    def pick_router(self, assigned_counts):
+        """
+        Choose the router for a new user
+
+        Args:
+            assigned_counts: {router name: users currently assigned}; users
+                with no router count against the default router
+
+        Returns:
+            str: name of the router with the most free capacity
+
+        Every router is ranked by its free share of capacity. A router
+        without a capacity counts as holding as many users as the largest
+        configured one, so in a mixed setup new users spread over all
+        routers; it is never full, so it takes the overflow once the
+        others are. With no capacities at all, users spread evenly.
+        """
+        default = self.default_router.name
+        notional = max((router.capacity or 0 for router in self.routers.values()), default=0) or None
+
+        def used(router):
+            count = assigned_counts.get(router.name, 0)
+            if router.name == default:
+                count += assigned_counts.get(None, 0)
+            return count
+
+        def free_share(router):
+            capacity = router.capacity or notional
+            has_room = not router.capacity or used(router) < router.capacity
+            share = (capacity - used(router)) / capacity if capacity else 0
+            return (has_room, share, -used(router))
+
+        best = max(self.routers.values(), key=free_share)
+        if best.capacity and used(best) >= best.capacity:
+            print(f"Warning: all routers are at capacity, assigning to {best.name}")
+        return best.name
+
+    def router_for(self, username, router=None):
+        """Router holding ``username``: its assignment, else any index that knows it"""
+        if router in self.routers:
+            return self.routers[router]
+        if router:
+            print(f"Warning: unknown router {router!r} for {username}, using default")
+        for candidate in self.routers.values():
+            if candidate.index.get_many([username])[0]:
+                return candidate
+        return self.default_router
+
+    def _group(self, usernames, routers):
+        """Group usernames by the router they live on"""
+        routers = routers or {}
+        groups = {}
+        for name in dict.fromkeys(usernames):
+            router = self.router_for(name, routers.get(name))
+            groups.setdefault(router.name, []).append(name)
+        return groups
+
+    # ==================== ROUTER LOOP COROUTINES ====================
+
+    async def _fan_out(self, make_call, routers=None):
+        """Run make_call(router) on every router at once; returns {name: result or exception}"""
+        targets = list(routers or self.routers.values())
+        results = await asyncio.gather(
+            *(make_call(router) for router in targets), return_exceptions=True
+        )
+        return {router.name: result for router, result in zip(targets, results)}
+
+    async def _connect(self):
+        results = await self._fan_out(lambda router: router.connect())
+        return all(result is True for result in results.values())
+
+    async def _shutdown(self):
+        await self._fan_out(lambda router: router.pool.shutdown())
+
+    async def _bulk_apply(self, description, command, usernames, arguments, missing_ok=False, routers=None):
+        groups = self._group(usernames, routers)
+        results = await self._fan_out(
+            lambda router: router.bulk_apply(
+                description, command, groups[router.name], arguments, missing_ok
+            ),
+            [self.routers[name] for name in groups],
+        )
+        merged = {}
+        for name, result in results.items():
+            if isinstance(result, BaseException):
+                print(f"[{name}] {description} failed: {_describe(result)}")
+                result = {username: False for username in groups[name]}
+            merged.update(result)
+        return merged
+
+    async def _create_users(self, users, upsert=False):
+        groups = {}
+        for user in users:
+            router = self.router_for(user["username"], user.get("router"))
+            groups.setdefault(router.name, []).append(user)
+        results = await self._fan_out(
+            lambda router: router.create_users(groups[router.name], upsert),
+            [self.routers[name] for name in groups],
+        )
+        merged = {}
+        for name, result in results.items():
+            if isinstance(result, BaseException):
+                print(f"[{name}] Create failed: {_describe(result)}")
+                result = {user["username"]: False for user in groups[name]}
+            merged.update(result)
+        return merged
+
+    async def _user_states_by_router(self):
+        return await self._fan_out(lambda router: router.user_states())
+
+    async def _fetch_active_users_by_router(self):
+        return await self._fan_out(lambda router: router.fetch_active_users())
+
+    async def _fetch_active_users(self):
+        results = await self._fetch_active_users_by_router()
+        failures = [r for r in results.values() if isinstance(r, BaseException)]
+        if len(failures) == len(results):
+            raise failures[0]
+        return [row for rows in results.values() if isinstance(rows, list) for row in rows]
+
+    async def _get_active_users(self):
+        try:
+            return await self._fetch_active_users()
+        except Exception as e:
+            print(f"Failed to get active users: {_describe(e)}")
+            return []
 
-        return False
+    async def _list_users_by_router(self):
+        results = await self._fan_out(lambda router: router.list_users())
+        for name, result in results.items():
+            if isinstance(result, BaseException):
+                print(f"[{name}] Failed to get all users: {_describe(result)}")
+        return results
+
+    async def _get_all_users(self):
+        results = await self._list_users_by_router()
+        if all(isinstance(names, BaseException) for names in results.values()):
+            return None  # No router could be read (an empty list means no users)
+        return [
+            username
+            for names in results.values()
+            if isinstance(names, list)
+            for username in names
+        ]
+
+    # ==================== BLOCKING API ====================
+
+    def connect(self):
+        """Check that every router is reachable by warming up one pooled connection each"""
+        return self.router_loop.run(self._connect())
 
     def disconnect(self):
-        """Close connection to MikroTik router"""
-        if self.connection:
-            self.connection.disconnect()
+        """Close all pooled connections to the routers"""
+        self.router_loop.run(self._shutdown())
 
-    def create_user(self, username, password, plan_type):
+    def create_user(self, username, password, plan_type, router=None):
         """Create a new hotspot user in MikroTik"""
-        for attempt in range(2):  # Try twice
-            try:
-                # Always reconnect for each operation to avoid stale connections
-                if not self.connect():
-                    raise Exception("Failed to connect to MikroTik")
+        return self.create_users(
+            [{"username": username, "password": password, "plan_type": plan_type, "router": router}]
+        )[username]
 
-                # Get fresh API instance
-                api = self.connection.get_api()
+    def disable_user(self, username, router=None):
+        """Disable a hotspot user in MikroTik"""
+        return self.disable_users([username], {username: router})[username]
 
-                # Determine profile and uptime limit based on plan type
-                profile = plan_type  # 'daily_1000' or 'monthly_1000'
+    def enable_user(self, username, router=None):
+        """Enable a hotspot user in MikroTik"""
+        return self.enable_users([username], {username: router})[username]
 
-                # Set uptime limit (actual usage time, not calendar time)
-                if plan_type == "daily_1000":
-                    uptime_limit = "1d"  # 24 hours of actual usage
-                elif plan_type == "monthly_1000":
-                    uptime_limit = "30d"  # 30 days of actual usage
-                else:
-                    uptime_limit = "1d"  # Default to 1 day
-
-                print(f"Getting hotspot user resource...")
-                # Create hotspot user
-                user_resource = api.get_resource("/ip/hotspot/user")
-
-                print(f"Adding user {username} with profile {profile} and uptime limit {uptime_limit}...")
-                user_resource.add(
-                    name=username,
-                    password=password,
-                    profile=profile,
-                    **{"limit-uptime": uptime_limit}
-                )
+    def delete_user(self, username, router=None):
+        """Delete a hotspot user from MikroTik (missing users count as deleted)"""
+        return self.delete_users([username], {username: router})[username]
 
-                print(f"User {username} created successfully in MikroTik")
-                return True
-            except Exception as e:
-                print(f"Failed to create user {username} (attempt {attempt + 1}): {e}")
-                if attempt == 0:  # First attempt failed, clear connection and retry
-                    self.connection = None
-                    continue
-                return False
-        return False
+    def fetch_active_users(self):
+        """Read /ip/hotspot/active on every router, raising if none can be queried"""
+        return self.router_loop.run(self._fetch_active_users())
 
-    def disable_user(self, username):
-        """Disable a hotspot user in MikroTik"""
-        for attempt in range(2):  # Try twice
-            try:
-                # Always reconnect for each operation
-                if not self.connect():
-                    raise Exception("Failed to connect to MikroTik")
-
-                api = self.connection.get_api()
-                user_resource = api.get_resource("/ip/hotspot/user")
-
-                # Find the user
-                users = user_resource.get(name=username)
-                if users:
-                    user_id = users[0]["id"]
-                    user_resource.set(id=user_id, disabled="yes")
-                    print(f"User {username} disabled successfully")
-                    return True
-                else:
-                    print(f"User {username} not found")
-                    return False
-            except Exception as e:
-                print(f"Failed to disable user {username} (attempt {attempt + 1}): {e}")
-                if attempt == 0:
-                    self.connection = None
-                    continue
-                return False
-        return False
-
-    def enable_user(self, username):
-        """Enable a hotspot user in MikroTik"""
-        for attempt in range(2):  # Try twice
-            try:
-                # Always reconnect for each operation
-                if not self.connect():
-                    raise Exception("Failed to connect to MikroTik")
-
-                api = self.connection.get_api()
-                user_resource = api.get_resource("/ip/hotspot/user")
-
-                # Find the user
-                users = user_resource.get(name=username)
-                if users:
-                    user_id = users[0]["id"]
-                    user_resource.set(id=user_id, disabled="no")
-                    print(f"User {username} enabled successfully")
-                    return True
-                else:
-                    print(f"User {username} not found")
-                    return False
-            except Exception as e:
-                print(f"Failed to enable user {username} (attempt {attempt + 1}): {e}")
-                if attempt == 0:
-                    self.connection = None
-                    continue
-                return False
-        return False
+    def fetch_active_users_by_router(self):
+        """Active sessions per router: {name: rows, or the exception that router raised}"""
+        return self.router_loop.run(self._fetch_active_users_by_router())
 
     def get_active_users(self):
         """Get list of all active hotspot users"""
-        try:
-            if not self.connection:
-                self.connect()
+        return self.router_loop.run(self._get_active_users())
 
-            api = self.connection.get_api()
-            active_resource = api.get_resource("/ip/hotspot/active")
+    def get_all_users(self):
+        """All hotspot user names on every router, or None if no router could be read"""
+        return self.router_loop.run(self._get_all_users())
+
+    def list_users_by_router(self):
+        """User names per router: {name: [usernames], or the exception that router raised}"""
+        return self.router_loop.run(self._list_users_by_router())
+
+    def disable_users(self, usernames, routers=None):
+        """Disable many hotspot users (``routers`` maps username -> router name)"""
+        return self.router_loop.run(
+            self._bulk_apply("Disable", "set", usernames, {"disabled": "yes"}, routers=routers)
+        )
+
+    def enable_users(self, usernames, routers=None):
+        """Enable many hotspot users (``routers`` maps username -> router name)"""
+        return self.router_loop.run(
+            self._bulk_apply("Enable", "set", usernames, {"disabled": "no"}, routers=routers)
+        )
+
+    def delete_users(self, usernames, routers=None):
+        """Delete many hotspot users (missing users count as deleted)"""
+        return self.router_loop.run(
+            self._bulk_apply("Delete", "remove", usernames, {}, missing_ok=True, routers=routers)
+        )
+
+    def create_users(self, users, upsert=False):
+        """
+        Create many hotspot users, one pipelined connection per router
+
+        Args:
+            users: iterable of dicts with 'username', 'password', 'plan_type'
+                and optionally 'router' and 'disabled'
+            upsert: update users the router already has instead of failing
+
+        Returns:
+            dict: {username: bool}
+        """
+        return self.router_loop.run(self._create_users(list(users), upsert))
+
+    def user_states_by_router(self):
+        """Per router: {username: 'enabled'/'disabled'}, or the exception that router raised"""
+        return self.router_loop.run(self._user_states_by_router())
+
+    def stats(self):
+        return [router.stats() for router in self.routers.values()]
+
+
+class AsyncMikroTikAPI:
+    """
+    Non-blocking interface to the routers for async endpoints.
+
+    Same methods as MikroTikAPI, as coroutines. The router work runs on the
+    router loop, so a stuck router call never stalls the web server's event
+    loop; every router command has its own timeout (MIKROTIK_CALL_TIMEOUT)
+    and a cancelled request cancels its in-flight commands.
+    """
+
+    def __init__(self, api):
+        self.api = api
+
+    async def _call(self, coro):
+        return await self.api.router_loop.run_async(coro)
+
+    async def refresh_config(self):
+        await self._call(self.api._refresh_config())
+
+    async def connect(self):
+        return await self._call(self.api._connect())
+
+    async def disconnect(self):
+        await self._call(self.api._shutdown())
+
+    async def create_user(self, username, password, plan_type, router=None):
+        return (
+            await self.create_users(
+                [{"username": username, "password": password, "plan_type": plan_type, "router": router}]
+            )
+        )[username]
 
-            active_users = active_resource.get()
-            return active_users
-        except Exception as e:
-            print(f"Failed to get active users: {e}")
-            return []
+    async def disable_user(self, username, router=None):
+        return (await self.disable_users([username], {username: router}))[username]
 
-    def get_all_users(self):
-        """Get list of all configured hotspot users from MikroTik"""
-        try:
-            # Always reconnect for each operation to avoid stale connections
-            if not self.connect():
-                raise Exception("Failed to connect to MikroTik")
+    async def enable_user(self, username, router=None):
+        return (await self.enable_users([username], {username: router}))[username]
 
-            api = self.connection.get_api()
-            user_resource = api.get_resource("/ip/hotspot/user")
+    async def delete_user(self, username, router=None):
+        return (await self.delete_users([username], {username: router}))[username]
 
-            users = user_resource.get()
-            # Return list of usernames
-            return [user.get("name") for user in users if user.get("name")]
-        except Exception as e:
-            print(f"Failed to get all users: {e}")
-            return []
+    async def fetch_active_users(self):
+        return await self._call(self.api._fetch_active_users())
 
-    def delete_user(self, username):
-        """Delete a hotspot user from MikroTik with retry logic"""
-        for attempt in range(3):  # Try 3 times
-            try:
-                # Always reconnect for each operation to avoid stale connections
-                if not self.connect():
-                    print(f"Failed to connect to MikroTik (attempt {attempt + 1}/3)")
-                    if attempt < 2:
-                        self.connection = None
-                        continue
-                    return False
-
-                api = self.connection.get_api()
-                user_resource = api.get_resource("/ip/hotspot/user")
-
-                # Find and delete the user
-                users = user_resource.get(name=username)
-                if users:
-                    user_id = users[0]["id"]
-                    user_resource.remove(id=user_id)
-                    print(f"User {username} deleted successfully from MikroTik")
-                    return True
-                else:
-                    print(f"User {username} not found in MikroTik")
-                    return True  # Return True if user doesn't exist (already deleted)
-            except Exception as e:
-                print(
-                    f"Failed to delete user {username} (attempt {attempt + 1}/3): {e}"
-                )
-                if attempt < 2:
-                    self.connection = None
-                    continue
-                return False
-        return False
+    async def get_active_users(self):
+        return await self._call(self.api._get_active_users())
+
+    async def get_all_users(self):
+        return await self._call(self.api._get_all_users())
+
+    async def disable_users(self, usernames, routers=None):
+        return await self._call(
+            self.api._bulk_apply("Disable", "set", usernames, {"disabled": "yes"}, routers=routers)
+        )
+
+    async def enable_users(self, usernames, routers=None):
+        return await self._call(
+            self.api._bulk_apply("Enable", "set", usernames, {"disabled": "no"}, routers=routers)
+        )
+
+    async def delete_users(self, usernames, routers=None):
+        return await self._call(
+            self.api._bulk_apply("Delete", "remove", usernames, {}, missing_ok=True, routers=routers)
+        )
+
+    async def create_users(self, users, upsert=False):
+        return await self._call(self.api._create_users(list(users), upsert))
 
 
-# Global instance
+# Global instances
 mikrotik = MikroTikAPI()
+mikrotik_async = AsyncMikroTikAPI(mikrotik)
@@ -0,0 +1,215 @@
+import os
+import re
+import socket
+import subprocess
+import threading
+import time
+
+from discover_mikrotik import MikroTikDiscovery
+
+# Seconds between background refreshes of the neighbour table
+NEIGHBOR_REFRESH_INTERVAL = float(os.getenv("NEIGHBOR_REFRESH_INTERVAL", "30"))
+
+PROC_ARP_PATH = "/proc/net/arp"
+ARP_FLAG_COMPLETE = 0x2  # ATF_COM: entry has a resolved hardware address
+
+
+def normalize_mac(mac):
+    return mac.strip().lower().replace("-", ":")
+
+
+def read_proc_arp(path=PROC_ARP_PATH):
+    """
+    Parse the kernel neighbour table exposed at /proc/net/arp
+
+    Returns:
+        dict: {mac: ip} for complete entries, or None if the file is missing
+    """
+    try:
+        with open(path) as f:
+            lines = f.read().splitlines()[1:]  # skip header
+    except OSError:
+        return None
+
+    table = {}
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 4:
+            continue
+        ip, flags, mac = fields[0], fields[2], fields[3]
+        if int(flags, 16) & ARP_FLAG_COMPLETE and mac != "00:00:00:00:00:00":
+            table[normalize_mac(mac)] = ip
+    return table
+
+
+def read_arp_command():
+    """Fallback for systems without /proc (macOS): parse ``arp -a``"""
+    table = {}
+    try:
+        result = subprocess.run(["arp", "-a"], capture_output=True, text=True, timeout=5)
+    except Exception:
+        return table
+    for line in result.stdout.splitlines():
+        ip_match = re.search(r"\(([0-9.]+)\)", line)
+        mac_match = re.search(r"(([0-9a-fA-F]{1,2}[:-]){5}[0-9a-fA-F]{1,2})", line)
+        if ip_match and mac_match:
+            # macOS prints single-digit octets without padding (e.g. 4:d:...)
+            mac = ":".join(part.zfill(2) for part in re.split("[:-]", mac_match.group(1)))
+            table[normalize_mac(mac)] = ip_match.group(1)
+    return table
+
+
+class NeighborResolver:
+    """
+    Resolve router MAC addresses to IPs from memory.
+
+    ``resolve()`` never spawns processes or waits on the network: it answers
+    from a cache fed by the kernel neighbour table (/proc/net/arp) and by
+    MNDP announcements the routers broadcast. A background thread refreshes
+    both, and when a watched MAC is unknown it broadcasts an MNDP discovery
+    request and sends a datagram to the likely router addresses so the
+    kernel resolves them for the next refresh.
+    """
+
+    def __init__(self, refresh_interval=NEIGHBOR_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._cache = {}  # mac -> (ip, source, seen_at)
+        self._watched = set()
+        self._started = False
+        self._stop = threading.Event()
+        self._wake = threading.Event()  # refresh now instead of at the next interval
+        self._discovery = MikroTikDiscovery()
+
+    def watch(self, mac):
+        """Start tracking a MAC address; the background thread looks it up right away"""
+        mac = normalize_mac(mac)
+        with self._lock:
+            self._watched.add(mac)
+        self._ensure_started()
+        self._wake.set()
+
+    def resolve(self, mac):
+        """Return the cached IP for ``mac`` (or None) without blocking"""
+        mac = normalize_mac(mac)
+        with self._lock:
+            entry = self._cache.get(mac)
+        if entry:
+            return entry[0]
+        # A single read of /proc/net/arp is cheap - try it before giving up
+        table = read_proc_arp()
+        if table and mac in table:
+            self._store(mac, table[mac], "arp")
+            return table[mac]
+        return None
+
+    def refresh(self):
+        """Reload the neighbour table and nudge the network for missing MACs"""
+        table = read_proc_arp()
+        if table is None:
+            table = read_arp_command()
+        for mac, ip in table.items():
+            if mac in self._watched:
+                self._store(mac, ip, "arp")
+
+        with self._lock:
+            missing = [mac for mac in self._watched if mac not in self._cache]
+        if missing:
+            self._nudge()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                mac: {"ip": ip, "source": source, "seen_at": seen_at}
+                for mac, (ip, source, seen_at) in self._cache.items()
+            }
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _store(self, mac, ip, source):
+        with self._lock:
+            previous = self._cache.get(mac)
+            self._cache[mac] = (ip, source, time.time())
+        if not previous or previous[0] != ip:
+            print(f"✓ Resolved MAC {mac} to {ip} ({source})")
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._refresh_loop, name="neighbor-refresh", daemon=True).start()
+        threading.Thread(target=self._mndp_loop, name="mndp-listener", daemon=True).start()
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Neighbour table refresh failed: {e}")
+            self._wake.wait(self.refresh_interval)
+
+    def _mndp_loop(self):
+        """Record the IP of every MikroTik announcing itself via MNDP"""
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            sock.bind(("", MikroTikDiscovery.MNDP_PORT))
+            sock.settimeout(1.0)
+        except OSError as e:
+            print(f"MNDP listener unavailable ({e}) - using the ARP table only")
+            return
+
+        while not self._stop.is_set():
+            try:
+                data, addr = sock.recvfrom(1500)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            device = self._discovery._parse_mndp_packet(data, addr)
+            if not device:
+                continue
+            mac = normalize_mac(device["mac"])
+            if mac in self._watched:
+                self._store(mac, device.get("ipv4") or device["source_ip"], "mndp")
+        sock.close()
+
+    def _nudge(self):
+        """Trigger MNDP replies and ARP resolution without spawning processes"""
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            try:
+                # An empty MNDP packet asks every MikroTik to announce itself
+                sock.sendto(b"\x00\x00\x00\x00", ("255.255.255.255", MikroTikDiscovery.MNDP_PORT))
+                # Sending to a candidate makes the kernel ARP for it
+                for ip in self._candidate_ips():
+                    sock.sendto(b"", (ip, MikroTikDiscovery.MNDP_PORT))
+            finally:
+                sock.close()
+        except OSError as e:
+            print(f"Could not probe for routers: {e}")
+
+    def _candidate_ips(self):
+        """Most likely router addresses: gateway, .1/.159 of our subnet, MikroTik default"""
+        candidates = ["192.168.88.1"]
+        try:
+            import netifaces
+
+            gateway = netifaces.gateways()["default"][netifaces.AF_INET]
+            candidates.append(gateway[0])
+            addrs = netifaces.ifaddresses(gateway[1])
+            subnet = ".".join(addrs[netifaces.AF_INET][0]["addr"].split(".")[0:3])
+            candidates += [f"{subnet}.1", f"{subnet}.159"]
+        except Exception:
+            pass
+        return list(dict.fromkeys(candidates))
+
+
+# Global instance
+neighbor_resolver = NeighborResolver()
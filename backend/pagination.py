@@ -0,0 +1,105 @@
+import base64
+import json
+import os
+from datetime import datetime
+
+from fastapi import HTTPException
+from sqlalchemy import or_, select
+
+# Rows per page when the client does not ask for a limit, and the most it may ask for
+PAGE_DEFAULT_LIMIT = int(os.getenv("PAGE_DEFAULT_LIMIT", "50"))
+PAGE_MAX_LIMIT = int(os.getenv("PAGE_MAX_LIMIT", "500"))
+
+
+def encode_cursor(sort_value, row_id):
+    """Opaque cursor for the row after which the next page starts"""
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort_value, row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor, sort_type):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_value, row_id = json.loads(raw)
+        if sort_type is datetime:
+            sort_value = datetime.fromisoformat(sort_value)
+        return sort_value, int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+class KeysetListing:
+    """
+    Newest-first keyset pagination over one table, with a column projection.
+
+    Pages are ordered by ``sort`` (descending) with the primary key as the
+    tie-breaker. The next page starts after the last row of the previous
+    one (``sort <= value AND (sort < value OR id < last id)``), so every
+    page is an index range scan no matter how deep the client pages, and
+    rows inserted meanwhile never shift a page.
+
+    ``columns`` maps the field names a client may ask for to columns;
+    anything not listed (passwords) can never be returned. ``joins`` maps
+    a field to the (table, onclause) it needs, joined only when that field
+    is requested.
+    """
+
+    def __init__(self, model, columns, default_fields, sort=None, joins=None):
+        self.model = model
+        self.id = model.id
+        self.sort = sort if sort is not None else model.id
+        self.columns = columns
+        self.default_fields = default_fields
+        self.joins = joins or {}
+
+    def fields(self, requested):
+        """Validate a comma-separated ``fields`` parameter"""
+        if not requested:
+            return list(self.default_fields)
+        names = [name.strip() for name in requested.split(",") if name.strip()]
+        unknown = [name for name in names if name not in self.columns]
+        if unknown:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(self.columns)}",
+            )
+        return names
+
+    async def page(self, db, filters=(), cursor=None, limit=None, fields=None):
+        """One page as {"items": [...], "next_cursor": str or None}"""
+        names = self.fields(fields)
+        limit = min(max(limit or PAGE_DEFAULT_LIMIT, 1), PAGE_MAX_LIMIT)
+        by_id = self.sort is self.id
+
+        query = select(
+            *(self.columns[name].label(name) for name in names),
+            self.sort.label("_sort"),
+            self.id.label("_id"),
+        ).select_from(self.model)
+        for name in names:
+            if name in self.joins:
+                query = query.outerjoin(*self.joins[name])
+        query = query.where(*filters)
+
+        if cursor:
+            sort_value, row_id = decode_cursor(cursor, self.sort.type.python_type)
+            if by_id:
+                query = query.where(self.id < row_id)
+            else:
+                query = query.where(
+                    self.sort <= sort_value, or_(self.sort < sort_value, self.id < row_id)
+                )
+        order = [self.id.desc()] if by_id else [self.sort.desc(), self.id.desc()]
+        # One extra row tells whether there is a next page
+        rows = (await db.execute(query.order_by(*order).limit(limit + 1))).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]._sort, rows[-1]._id)
+        return {
+            "items": [{name: row._mapping[name] for name in names} for row in rows],
+            "next_cursor": next_cursor,
+        }
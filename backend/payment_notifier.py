@@ -0,0 +1,148 @@
+import asyncio
+import os
+
+from database import DATABASE_URL
+from sqlalchemy.engine import make_url
+
+# Longest a /payments/check?wait= request is held open (seconds)
+PAYMENT_WAIT_MAX = float(os.getenv("PAYMENT_WAIT_MAX", "30"))
+# Longest a /payments/events stream stays open (seconds); the browser reconnects after
+PAYMENT_STREAM_MAX = float(os.getenv("PAYMENT_STREAM_MAX", "600"))
+# Seconds between keep-alives on an idle stream; the status is re-read then too,
+# in case a notification was missed
+PAYMENT_STREAM_HEARTBEAT = float(os.getenv("PAYMENT_STREAM_HEARTBEAT", "15"))
+
+# PostgreSQL channel carrying the tx_ref of every payment whose status changed
+NOTIFY_CHANNEL = "payment_status"
+# Seconds before a lost LISTEN connection is opened again
+LISTEN_RETRY = 5
+
+
+class PaymentNotifier:
+    """
+    Wakes requests waiting for a payment's status to change.
+
+    Waiters (long-poll and SSE handlers) ``subscribe()`` to a tx_ref and
+    wait on the returned event; ``notify()`` is called wherever the
+    webhook path changes a payment's status and sets the events of that
+    tx_ref, so credentials go out the moment the payment completes.
+
+    On PostgreSQL ``notify()`` also sends ``NOTIFY payment_status`` and
+    every process LISTENs on its own connection, so a payment completed by
+    one uvicorn worker wakes customers connected to another. Elsewhere
+    (SQLite: one process) the in-process events are enough. Waiters still
+    re-read the status now and then, so a missed notification only costs
+    latency.
+    """
+
+    def __init__(self):
+        self._waiters = {}  # tx_ref -> set of asyncio.Event
+        self._listener = None
+        self._connection = None
+        self._send_lock = asyncio.Lock()  # one query at a time on the LISTEN connection
+        self._stop = False
+        self.listening = False
+
+        # Counters for /payments/notifier
+        self.notified = 0
+        self.received = 0
+        self.woken = 0
+        self.last_error = None
+
+    def subscribe(self, tx_ref):
+        event = asyncio.Event()
+        self._waiters.setdefault(tx_ref, set()).add(event)
+        return event
+
+    def unsubscribe(self, tx_ref, event):
+        waiters = self._waiters.get(tx_ref)
+        if waiters is not None:
+            waiters.discard(event)
+            if not waiters:
+                del self._waiters[tx_ref]
+
+    def _wake(self, tx_ref):
+        for event in self._waiters.get(tx_ref, ()):
+            event.set()
+            self.woken += 1
+
+    async def notify(self, tx_ref):
+        """The status of ``tx_ref`` changed (call after the commit)"""
+        self.notified += 1
+        self._wake(tx_ref)
+        if self._connection is not None:
+            try:
+                async with self._send_lock:
+                    await self._connection.execute("SELECT pg_notify($1, $2)", NOTIFY_CHANNEL, tx_ref)
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"✗ Payment notify failed: {e}")
+
+    def start(self):
+        """LISTEN for other processes' notifications (PostgreSQL only)"""
+        if make_url(DATABASE_URL).get_backend_name() != "postgresql" or self._listener:
+            return
+        self._stop = False
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        self._stop = True
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        await self._close()
+
+    async def _listen(self):
+        import asyncpg
+
+        dsn = make_url(DATABASE_URL).set(drivername="postgresql").render_as_string(hide_password=False)
+        while not self._stop:
+            lost = asyncio.Event()
+            try:
+                self._connection = await asyncpg.connect(dsn)
+                self._connection.add_termination_listener(lambda _: lost.set())
+                await self._connection.add_listener(NOTIFY_CHANNEL, self._on_notification)
+                self.listening = True
+                print(f"✓ Listening for payment notifications on '{NOTIFY_CHANNEL}'")
+                await lost.wait()
+                print("✗ Payment notification connection lost")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"✗ Payment notification listener failed: {e}")
+            finally:
+                self.listening = False
+                await self._close()
+            await asyncio.sleep(LISTEN_RETRY)
+
+    def _on_notification(self, connection, pid, channel, tx_ref):
+        self.received += 1
+        self._wake(tx_ref)
+
+    async def _close(self):
+        connection, self._connection = self._connection, None
+        if connection is not None and not connection.is_closed():
+            try:
+                await connection.close(timeout=2)
+            except Exception:
+                connection.terminate()
+
+    def stats(self):
+        return {
+            "listening": self.listening,
+            "waiting_requests": sum(len(waiters) for waiters in self._waiters.values()),
+            "waiting_payments": len(self._waiters),
+            "notified": self.notified,
+            "received": self.received,
+            "woken": self.woken,
+            "last_error": self.last_error,
+        }
+
+
+# Global instance
+payment_notifier = PaymentNotifier()
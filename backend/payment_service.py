@@ -72,28 +72,28 @@ class PaymentService:
         if not redirect_url:
             redirect_url = "https://your-domain.com/payment-success"
 
-        # Create checkout session
-        with self.client:
-            checkout = NewCheckout(
-                buyer_email=f"{phone}@temp.com",  # Temporary email (ZenoPay requires it)
-                buyer_name=buyer_name,
-                buyer_phone=phone,
-                amount=amount,
-                currency=Currency.TZS,
-                redirect_url=redirect_url,
-            )
-
-            response = self.client.checkout.sync.create(checkout)
-
-            return {
-                "payment_link": response.results.payment_link,
-                "tx_ref": response.results.tx_ref,
-                "amount": amount,
-                "plan_type": plan_type,
-                "phone": phone,
-                "buyer_name": buyer_name,
-                "device_count": device_count,
-            }
+        # Create checkout session. The client stays open between calls: checkouts
+        # run concurrently in worker threads and share its connection pool
+        checkout = NewCheckout(
+            buyer_email=f"{phone}@temp.com",  # Temporary email (ZenoPay requires it)
+            buyer_name=buyer_name,
+            buyer_phone=phone,
+            amount=amount,
+            currency=Currency.TZS,
+            redirect_url=redirect_url,
+        )
+
+        response = self.client.checkout.sync.create(checkout)
+
+        return {
+            "payment_link": response.results.payment_link,
+            "tx_ref": response.results.tx_ref,
+            "amount": amount,
+            "plan_type": plan_type,
+            "phone": phone,
+            "buyer_name": buyer_name,
+            "device_count": device_count,
+        }
 
     def create_user_after_payment(
         self, tx_ref: str, phone: str, buyer_name: str, plan_type: str
@@ -0,0 +1,276 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+from database import SessionLocal, User
+from event_log import event_log
+from mikrotik_api import mikrotik
+from sqlalchemy import delete, or_, update
+
+# Seconds between reconcile passes when nobody wakes the reconciler
+RECONCILE_INTERVAL = float(os.getenv("RECONCILE_INTERVAL", "5"))
+# Seconds to wait after a wake-up so bursts of changes share one pass
+RECONCILE_DEBOUNCE = float(os.getenv("RECONCILE_DEBOUNCE", "0.3"))
+# Seconds between full diffs of the database against every router
+RECONCILE_FULL_INTERVAL = float(os.getenv("RECONCILE_FULL_INTERVAL", "900"))
+# Max users handled per pass
+RECONCILE_BATCH = int(os.getenv("RECONCILE_BATCH", "500"))
+
+
+class RouterReconciler:
+    """
+    Converge the routers on the state recorded in the database.
+
+    Endpoints only write ``User.desired_state`` and call ``wake()``. Each
+    pass reads the users whose ``router_state`` differs from their desired
+    state and applies the difference with the bulk router operations:
+    unprovisioned users are created, the rest enabled, disabled or deleted.
+    Only the latest desired state is read, so a user toggled three times
+    between passes costs at most one router write. Failed users keep their
+    pending state (with ``reconcile_error``) and are retried next pass.
+
+    A periodic full diff reads every router's users and resets
+    ``router_state`` wherever a user's disabled flag no longer matches,
+    which feeds the difference back into the normal passes. Users missing
+    from a router are left to /sync-users, which either removes them from
+    the database or re-provisions them.
+    """
+
+    def __init__(
+        self,
+        router,
+        interval=RECONCILE_INTERVAL,
+        full_interval=RECONCILE_FULL_INTERVAL,
+        batch_size=RECONCILE_BATCH,
+    ):
+        self.router = router
+        self.interval = interval
+        self.full_interval = full_interval
+        self.batch_size = batch_size
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_full = 0.0
+
+        # Counters for the /reconciler endpoint
+        self.passes = 0
+        self.applied = 0
+        self.failed = 0
+        self.last_pass = None
+        self.last_full_diff = None
+        self.last_drift = {}
+
+    def wake(self):
+        """Ask for a pass as soon as possible (after a short debounce)"""
+        self._wake.set()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="router-reconciler", daemon=True)
+        self._thread.start()
+        print(f"✓ Router reconciler started (every {self.interval:.0f}s, full diff every {self.full_interval:.0f}s)")
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def reconcile_once(self):
+        """Apply one batch of pending changes; returns the number of users converged"""
+        db = SessionLocal()
+        try:
+            pending = (
+                db.query(User)
+                .filter(or_(User.router_state.is_(None), User.router_state != User.desired_state))
+                # Users that failed last time go last so they cannot starve the rest
+                .order_by(User.reconcile_error.isnot(None), User.id)
+                .limit(self.batch_size)
+                .all()
+            )
+            if not pending:
+                return 0
+
+            creates = [u for u in pending if u.router_state is None and u.desired_state != "deleted"]
+            deletes = [u for u in pending if u.desired_state == "deleted"]
+            enables = [u for u in pending if u.router_state is not None and u.desired_state == "enabled"]
+            disables = [u for u in pending if u.router_state is not None and u.desired_state == "disabled"]
+
+            results = {}
+            if creates:
+                results.update(
+                    self.router.create_users(
+                        [
+                            {
+                                "username": u.username,
+                                "password": u.password,
+                                "plan_type": u.plan_type,
+                                "router": u.router,
+                                "disabled": u.desired_state == "disabled",
+                            }
+                            for u in creates
+                        ],
+                        upsert=True,
+                    )
+                )
+            for users, apply in (
+                (enables, self.router.enable_users),
+                (disables, self.router.disable_users),
+                (deletes, self.router.delete_users),
+            ):
+                if users:
+                    results.update(
+                        apply([u.username for u in users], {u.username: u.router for u in users})
+                    )
+
+            done = [u for u in pending if results.get(u.username)]
+            failed = [u for u in pending if not results.get(u.username)]
+            self._record(db, done, failed)
+
+            self.applied += len(done)
+            self.failed += len(failed)
+            print(f"Reconciled {len(done)}/{len(pending)} users with the routers")
+            return len(done)
+        finally:
+            db.close()
+
+    def _record(self, db, done, failed):
+        """
+        Store the outcome in bulk. Each update is guarded by the desired state
+        that was applied, so a change made during the pass stays pending.
+        """
+        by_state = {}
+        for user in done:
+            by_state.setdefault(user.desired_state, []).append(user.id)
+
+        for state, ids in by_state.items():
+            if state == "deleted":
+                db.execute(
+                    delete(User).where(User.id.in_(ids), User.desired_state == "deleted")
+                )
+            else:
+                db.execute(
+                    update(User)
+                    .where(User.id.in_(ids), User.desired_state == state)
+                    .values(router_state=state, reconcile_error=None)
+                )
+        if failed:
+            db.execute(
+                update(User)
+                .where(User.id.in_([user.id for user in failed]))
+                .values(reconcile_error=f"Router update failed at {datetime.utcnow():%Y-%m-%d %H:%M:%S}")
+            )
+
+        now = datetime.utcnow()
+        # Read before the commit: deleted users cannot be loaded afterwards
+        events = [
+            (
+                f"Reconciled user {user.username} on router: {user.desired_state}",
+                user.id,
+                {"state": user.desired_state, "router": user.router},
+            )
+            for user in done
+        ]
+        db.commit()
+        for event, user_id, payload in events:
+            event_log.write("user.reconciled", event, user_id=user_id, payload=payload, timestamp=now)
+
+    def full_diff(self):
+        """
+        Compare every router's users with the database and queue fixes
+
+        Users whose disabled flag differs get the router's actual state (the
+        next pass sets it back). Missing users are only counted; routers
+        that cannot be read are skipped.
+        """
+        results = self.router.user_states_by_router()
+        default = self.router.default_router.name
+        db = SessionLocal()
+        try:
+            drift = {}
+            for name, states in results.items():
+                if isinstance(states, BaseException):
+                    print(f"Full diff skipped for router {name}: {states}")
+                    continue
+                assigned = User.router == name
+                if name == default:
+                    assigned = or_(assigned, User.router.is_(None))
+                rows = (
+                    db.query(User.id, User.username, User.router_state)
+                    .filter(
+                        assigned,
+                        User.router_state.isnot(None),
+                        User.desired_state != "deleted",
+                    )
+                    .all()
+                )
+                fixes = {}
+                missing = 0
+                for user_id, username, router_state in rows:
+                    actual = states.get(username)
+                    if actual is None:
+                        missing += 1
+                    elif actual != router_state:
+                        fixes.setdefault(actual, []).append(user_id)
+                for actual, ids in fixes.items():
+                    db.execute(update(User).where(User.id.in_(ids)).values(router_state=actual))
+                drift[name] = {
+                    "state": sum(len(ids) for ids in fixes.values()),
+                    "missing": missing,
+                }
+            db.commit()
+        finally:
+            db.close()
+
+        self.last_full_diff = datetime.utcnow()
+        self.last_drift = drift
+        if any(counts["state"] or counts["missing"] for counts in drift.values()):
+            print(f"Full diff found router drift: {drift}")
+        if any(counts["state"] for counts in drift.values()):
+            self.wake()
+        return drift
+
+    def stats(self):
+        db = SessionLocal()
+        try:
+            pending = (
+                db.query(User)
+                .filter(or_(User.router_state.is_(None), User.router_state != User.desired_state))
+                .count()
+            )
+        finally:
+            db.close()
+        return {
+            "pending": pending,
+            "passes": self.passes,
+            "applied": self.applied,
+            "failed": self.failed,
+            "last_pass": self.last_pass,
+            "last_full_diff": self.last_full_diff,
+            "last_drift": self.last_drift,
+        }
+
+    def _run(self):
+        while not self._stop.is_set():
+            woken = self._wake.wait(self.interval)
+            if self._stop.is_set():
+                break
+            if woken:
+                time.sleep(RECONCILE_DEBOUNCE)  # let a burst of changes land first
+            self._wake.clear()
+            try:
+                if time.time() - self._last_full >= self.full_interval:
+                    self._last_full = time.time()
+                    self.full_diff()
+                # Keep going while full batches come back, then wait again
+                while self.reconcile_once() >= self.batch_size and not self._stop.is_set():
+                    pass
+                self.passes += 1
+                self.last_pass = datetime.utcnow()
+            except Exception as e:
+                print(f"Reconcile pass failed: {e}")
+
+
+# Global instance
+reconciler = RouterReconciler(mikrotik)
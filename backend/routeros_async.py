@@ -0,0 +1,435 @@
+"""
+Native asyncio implementation of the RouterOS API protocol.
+
+Every command is sent with a ``.tag`` so many commands can be in flight on
+one connection at once (pipelining) and each caller waits only for its own
+reply. Calls take a timeout; a call that times out or is cancelled sends
+``/cancel`` for its tag so the connection stays usable.
+"""
+
+import asyncio
+import binascii
+import hashlib
+import itertools
+import os
+import time
+
+# Pool tuning (all values in seconds unless noted)
+POOL_SIZE = int(os.getenv("MIKROTIK_POOL_SIZE", "4"))  # max logged-in connections
+POOL_HEALTH_CHECK_AFTER = float(os.getenv("MIKROTIK_POOL_HEALTH_CHECK_AFTER", "30"))
+POOL_KEEPALIVE_INTERVAL = float(os.getenv("MIKROTIK_POOL_KEEPALIVE", "60"))
+POOL_MAX_LIFETIME = float(os.getenv("MIKROTIK_POOL_MAX_LIFETIME", "3600"))
+CONNECT_TIMEOUT = float(os.getenv("MIKROTIK_CONNECT_TIMEOUT", "5"))
+CALL_TIMEOUT = float(os.getenv("MIKROTIK_CALL_TIMEOUT", "10"))
+
+# Open another connection once the least busy one has this many calls queued
+POOL_MAX_IN_FLIGHT = int(os.getenv("MIKROTIK_POOL_MAX_IN_FLIGHT", "64"))
+
+
+class RouterOsError(Exception):
+    """Base class for RouterOS API errors"""
+
+
+class RouterOsConnectionError(RouterOsError):
+    """The connection is unusable (closed, fatal reply or failed login)"""
+
+
+class RouterOsTrapError(RouterOsError):
+    """The router rejected a command (``!trap``); the connection is still fine"""
+
+    def __init__(self, message, category=None):
+        super().__init__(message)
+        self.message = message
+        self.category = category
+
+
+# ==================== WIRE FORMAT ====================
+
+
+def encode_length(length):
+    """Encode a word length using the RouterOS variable-length scheme"""
+    if length < 0x80:
+        return length.to_bytes(1, "big")
+    if length < 0x4000:
+        return (length | 0x8000).to_bytes(2, "big")
+    if length < 0x200000:
+        return (length | 0xC00000).to_bytes(3, "big")
+    if length < 0x10000000:
+        return (length | 0xE0000000).to_bytes(4, "big")
+    return b"\xf0" + length.to_bytes(4, "big")
+
+
+def encode_sentence(words):
+    """Encode a list of str words as one API sentence"""
+    data = bytearray()
+    for word in words:
+        encoded = word.encode("utf-8")
+        data += encode_length(len(encoded))
+        data += encoded
+    data += b"\x00"
+    return bytes(data)
+
+
+async def read_length(reader):
+    first = (await reader.readexactly(1))[0]
+    if first < 0x80:
+        return first
+    if first < 0xC0:
+        rest = await reader.readexactly(1)
+        return ((first & 0x3F) << 8) | rest[0]
+    if first < 0xE0:
+        rest = await reader.readexactly(2)
+        return ((first & 0x1F) << 16) | int.from_bytes(rest, "big")
+    if first < 0xF0:
+        rest = await reader.readexactly(3)
+        return ((first & 0x0F) << 24) | int.from_bytes(rest, "big")
+    if first == 0xF0:
+        return int.from_bytes(await reader.readexactly(4), "big")
+    raise RouterOsConnectionError(f"Malformed length byte {first:#x}")
+
+
+async def read_sentence(reader):
+    """Read one sentence and return its words as str"""
+    words = []
+    while True:
+        length = await read_length(reader)
+        if length == 0:
+            return words
+        word = await reader.readexactly(length)
+        words.append(word.decode("utf-8", errors="replace"))
+
+
+def _api_key(key):
+    # Same convention as routeros_api: callers use id/proplist for .id/.proplist
+    return "." + key if key in ("id", "proplist") else key
+
+
+def _python_key(key):
+    return "id" if key == ".id" else key
+
+
+def build_command(command, arguments=None, queries=None):
+    """Build the words of a command sentence (without its tag)"""
+    words = [command]
+    for key, value in (arguments or {}).items():
+        words.append(f"={_api_key(key)}={value}")
+    for key, value in (queries or {}).items():
+        words.append(f"?{_api_key(key)}={value}")
+    return words
+
+
+def parse_reply(words):
+    """Split a reply sentence into (type, tag, attributes)"""
+    reply_type = words[0] if words else ""
+    tag = None
+    attributes = {}
+    for word in words[1:]:
+        if word.startswith(".tag="):
+            tag = word[5:]
+        elif word.startswith("="):
+            key, _, value = word[1:].partition("=")
+            attributes[_python_key(key)] = value
+    return reply_type, tag, attributes
+
+
+class Reply(list):
+    """Rows (``!re``) of a finished command; ``done`` holds the ``!done`` attributes"""
+
+    def __init__(self, rows=(), done=None):
+        super().__init__(rows)
+        self.done = done or {}
+
+
+class _Pending:
+    __slots__ = ("future", "rows", "error")
+
+    def __init__(self, future):
+        self.future = future
+        self.rows = []
+        self.error = None
+
+
+# ==================== CONNECTION ====================
+
+
+class AsyncRouterOsConnection:
+    """One logged-in API connection that multiplexes tagged commands"""
+
+    def __init__(self, host, port, username, password, connect_timeout=CONNECT_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.connect_timeout = connect_timeout
+
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._pending = {}
+        self._tags = itertools.count(1)
+        self.closed = True
+        self.created_at = None
+        self.last_used = None
+
+    @property
+    def in_flight(self):
+        return len(self._pending)
+
+    async def open(self):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.connect_timeout
+        )
+        self.closed = False
+        self.created_at = self.last_used = time.time()
+        self._reader_task = asyncio.create_task(self._read_loop())
+        try:
+            await self._login()
+        except RouterOsTrapError as e:
+            await self.close()
+            raise RouterOsConnectionError(f"Login failed: {e.message}") from e
+        except BaseException:
+            await self.close()
+            raise
+        return self
+
+    async def _login(self):
+        reply = await self.call(
+            "/login",
+            {"name": self.username, "password": self.password},
+            timeout=self.connect_timeout,
+        )
+        if "ret" in reply.done:
+            # Pre-6.43 challenge/response login
+            digest = hashlib.md5(
+                b"\x00" + self.password.encode() + binascii.unhexlify(reply.done["ret"])
+            ).hexdigest()
+            await self.call(
+                "/login",
+                {"name": self.username, "response": "00" + digest},
+                timeout=self.connect_timeout,
+            )
+
+    async def call(self, command, arguments=None, queries=None, timeout=CALL_TIMEOUT):
+        """Send one command and wait for its reply"""
+        if self.closed:
+            raise RouterOsConnectionError("Connection is closed")
+
+        tag = str(next(self._tags))
+        future = asyncio.get_running_loop().create_future()
+        self._pending[tag] = _Pending(future)
+        words = build_command(command, arguments, queries)
+        words.append(f".tag={tag}")
+        try:
+            self._writer.write(encode_sentence(words))
+            await asyncio.wait_for(self._writer.drain(), timeout)
+            reply = await asyncio.wait_for(future, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            # Stop the router working on a reply nobody is waiting for
+            if self._pending.pop(tag, None) is not None:
+                self._send_cancel(tag)
+            raise
+        except (ConnectionError, OSError) as e:
+            self._pending.pop(tag, None)
+            await self.close()
+            raise RouterOsConnectionError(str(e)) from e
+        self.last_used = time.time()
+        return reply
+
+    async def ping(self, timeout=CALL_TIMEOUT):
+        """Cheap round trip to confirm the session is still logged in"""
+        await self.call("/system/identity/print", timeout=timeout)
+
+    def _send_cancel(self, tag):
+        if self.closed:
+            return
+        try:
+            # The reply to /cancel carries an unknown tag and is ignored
+            self._writer.write(
+                encode_sentence(["/cancel", f"=tag={tag}", f".tag=c{tag}"])
+            )
+        except Exception:
+            pass
+
+    async def _read_loop(self):
+        error = RouterOsConnectionError("Connection closed by router")
+        try:
+            while True:
+                words = await read_sentence(self._reader)
+                reply_type, tag, attributes = parse_reply(words)
+                if reply_type == "!fatal":
+                    error = RouterOsConnectionError(
+                        f"Fatal: {' '.join(words[1:]) or 'connection closed'}"
+                    )
+                    break
+                pending = self._pending.get(tag)
+                if pending is None:
+                    continue  # Reply to a cancelled command
+                if reply_type == "!re":
+                    pending.rows.append(attributes)
+                elif reply_type == "!trap":
+                    pending.error = RouterOsTrapError(
+                        attributes.get("message", "trap"), attributes.get("category")
+                    )
+                elif reply_type == "!done":
+                    del self._pending[tag]
+                    if pending.future.done():
+                        continue
+                    if pending.error:
+                        pending.future.set_exception(pending.error)
+                    else:
+                        pending.future.set_result(Reply(pending.rows, attributes))
+        except (asyncio.IncompleteReadError, ConnectionError, OSError) as e:
+            error = RouterOsConnectionError(str(e) or "Connection closed by router")
+        except asyncio.CancelledError:
+            error = RouterOsConnectionError("Connection closed")
+        except RouterOsError as e:
+            error = e
+        self._fail_pending(error)
+        self.closed = True
+        if self._writer:
+            self._writer.close()
+
+    def _fail_pending(self, error):
+        pending, self._pending = self._pending, {}
+        for item in pending.values():
+            if not item.future.done():
+                item.future.set_exception(error)
+
+    async def close(self):
+        if self._writer is None:
+            return
+        self.closed = True
+        task = self._reader_task
+        if task and task is not asyncio.current_task() and not task.done():
+            task.cancel()
+            try:
+                await task
+            except BaseException:
+                pass
+        self._fail_pending(RouterOsConnectionError("Connection closed"))
+        try:
+            self._writer.close()
+        except Exception:
+            pass
+
+
+# ==================== POOL ====================
+
+
+class AsyncRouterOsPool:
+    """
+    Small set of multiplexed connections to one router.
+
+    Commands are spread over at most ``size`` connections; a connection is
+    shared by concurrent callers (tags keep replies apart) and a new one is
+    only opened when the least busy connection already has
+    ``max_in_flight`` calls queued. Connections idle for longer than
+    ``health_check_after`` are pinged before reuse, and a keepalive task
+    pings idle connections so the router does not drop them.
+    """
+
+    def __init__(
+        self,
+        open_connection,
+        size=POOL_SIZE,
+        health_check_after=POOL_HEALTH_CHECK_AFTER,
+        keepalive_interval=POOL_KEEPALIVE_INTERVAL,
+        max_lifetime=POOL_MAX_LIFETIME,
+        max_in_flight=POOL_MAX_IN_FLIGHT,
+    ):
+        self._open_connection = open_connection  # coroutine returning an open connection
+        self.size = max(1, size)
+        self.health_check_after = health_check_after
+        self.keepalive_interval = keepalive_interval
+        self.max_lifetime = max_lifetime
+        self.max_in_flight = max_in_flight
+
+        self._connections = []
+        self._opening = 0
+        self._lock = None  # created lazily on the router loop
+        self._keepalive_task = None
+
+        # Counters for /stats style reporting
+        self.logins = 0
+        self.checkouts = 0
+        self.discarded = 0
+
+    async def connection(self):
+        """Return a healthy connection to send commands on"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        self.checkouts += 1
+        while True:
+            async with self._lock:
+                self._connections = [c for c in self._connections if not c.closed]
+                candidate = min(self._connections, key=lambda c: c.in_flight, default=None)
+                full = candidate is None or candidate.in_flight >= self.max_in_flight
+                if full and len(self._connections) < self.size:
+                    connection = await self._open_connection()
+                    self.logins += 1
+                    self._connections.append(connection)
+                    self._start_keepalive()
+                    return connection
+            if await self._is_usable(candidate):
+                return candidate
+            await self.discard(candidate)
+
+    async def _is_usable(self, connection):
+        now = time.time()
+        if connection.closed:
+            return False
+        if now - connection.created_at > self.max_lifetime and connection.in_flight == 0:
+            return False
+        if connection.in_flight == 0 and now - connection.last_used > self.health_check_after:
+            try:
+                await connection.ping()
+            except Exception:
+                return False
+        return True
+
+    async def discard(self, connection):
+        if connection in self._connections:
+            self._connections.remove(connection)
+            self.discarded += 1
+        await connection.close()
+
+    async def warm_up(self):
+        """Open one connection now so the first real request does not pay for login"""
+        await self.connection()
+
+    async def close_all(self):
+        connections, self._connections = self._connections, []
+        for connection in connections:
+            await connection.close()
+
+    async def shutdown(self):
+        if self._keepalive_task:
+            self._keepalive_task.cancel()
+            self._keepalive_task = None
+        await self.close_all()
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "open": len([c for c in self._connections if not c.closed]),
+            "in_flight": sum(c.in_flight for c in self._connections),
+            "logins": self.logins,
+            "checkouts": self.checkouts,
+            "discarded": self.discarded,
+        }
+
+    def _start_keepalive(self):
+        if self._keepalive_task is None or self._keepalive_task.done():
+            self._keepalive_task = asyncio.create_task(self._keepalive_loop())
+
+    async def _keepalive_loop(self):
+        while True:
+            await asyncio.sleep(self.keepalive_interval)
+            cutoff = time.time() - self.keepalive_interval
+            for connection in list(self._connections):
+                if connection.in_flight or connection.last_used > cutoff:
+                    continue
+                try:
+                    await connection.ping()
+                except Exception:
+                    await self.discard(connection)
@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+from mikrotik_api import mikrotik
+
+# How often the router's /ip/hotspot/active table is polled (seconds)
+ACTIVE_POLL_INTERVAL = float(os.getenv("ACTIVE_POLL_INTERVAL", "10"))
+
+
+class ActiveSessionMonitor:
+    """
+    Keep one shared snapshot of /ip/hotspot/active in memory.
+
+    A background thread polls every router every ``interval`` seconds and
+    replaces the snapshot. Readers never touch the routers: every dashboard
+    gets the same snapshot, so N open dashboards cost one query per router
+    per interval. When a router cannot be polled its last good sessions are
+    kept and the snapshot is marked stale.
+    """
+
+    def __init__(self, router, interval=ACTIVE_POLL_INTERVAL):
+        self.router = router
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._listeners = []
+
+        self._by_router = {}  # router name -> (sessions, time they were read)
+        self._errors = {}  # router name -> error of its last failed poll
+        self._users = []
+        self._timestamp = None  # read time of the oldest router data served
+        self._generation = 0  # bumped on every successful poll
+        self._last_attempt = None
+
+    def add_listener(self, callback):
+        """Call ``callback(users, timestamp)`` with freshly polled sessions after each poll"""
+        self._listeners.append(callback)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="active-session-monitor", daemon=True
+        )
+        self._thread.start()
+        print(f"✓ Active session monitor started (every {self.interval:.0f}s)")
+
+    def stop(self):
+        self._stop.set()
+
+    def poll_once(self):
+        """Query every router once and publish the merged result as the new snapshot"""
+        started = time.time()
+        results = self.router.fetch_active_users_by_router()
+        now = datetime.utcnow()
+
+        fresh = []
+        with self._lock:
+            for name, result in results.items():
+                if isinstance(result, BaseException):
+                    # Keep serving this router's last good sessions
+                    self._errors[name] = str(result) or type(result).__name__
+                    print(f"Active session poll failed for {name}, serving last snapshot: {self._errors[name]}")
+                    continue
+                self._errors.pop(name, None)
+                self._by_router[name] = (result, now)
+                fresh.extend(result)
+            # Forget routers that were removed from the configuration
+            for name in list(self._by_router):
+                if name not in results:
+                    del self._by_router[name]
+            self._last_attempt = now
+            ok = len(self._errors) < len(results)
+            if ok:
+                self._users = [
+                    row for rows, _ in self._by_router.values() for row in rows
+                ]
+                self._timestamp = min(ts for _, ts in self._by_router.values())
+                self._generation += 1
+
+        if ok:
+            for callback in self._listeners:
+                try:
+                    callback(fresh, now)
+                except Exception as e:
+                    print(f"Active session listener failed: {e}")
+
+        elapsed = time.time() - started
+        if elapsed > self.interval:
+            print(f"Warning: active session poll took {elapsed:.1f}s (interval {self.interval}s)")
+        return ok
+
+    def snapshot(self):
+        """Return the latest snapshot without touching the routers"""
+        with self._lock:
+            age = (
+                (datetime.utcnow() - self._timestamp).total_seconds()
+                if self._timestamp
+                else None
+            )
+            return {
+                "count": len(self._users),
+                "users": self._users,
+                "timestamp": self._timestamp,
+                "generation": self._generation,
+                "age_seconds": age,
+                "stale": bool(self._errors) or self._timestamp is None,
+                "errors": dict(self._errors),
+                "last_attempt": self._last_attempt,
+            }
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.poll_once()
+            self._stop.wait(self.interval)
+
+
+# Global instance
+session_monitor = ActiveSessionMonitor(mikrotik)
@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# The modules read their settings at import: point them at a throwaway
+# SQLite database and an unreachable router before anything imports them
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/test.db"
+os.environ.setdefault("ZENOPAY_API_KEY", "test")
+os.environ["SENTRY_DSN"] = ""
+os.environ["MIKROTIK_HOST"] = "127.0.0.1"
+os.environ["MIKROTIK_PORT"] = "1"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+import expiry_sweep as sweep_module
+import pytest
+from database import SessionLocal, User, init_db
+from expiry_sweep import ExpirySweep
+
+
+class ReconcilerStandIn:
+    def __init__(self):
+        self.wakes = 0
+
+    def wake(self):
+        self.wakes += 1
+
+
+@pytest.fixture
+def expired_user():
+    init_db()
+    db = SessionLocal()
+    user = User(
+        username="sweep_user",
+        password="x",
+        plan_type="daily_1000",
+        expiry=datetime.utcnow() - timedelta(minutes=1),
+        is_active=True,
+        desired_state="enabled",
+        router_state="enabled",
+    )
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    db.close()
+    yield user_id
+    db = SessionLocal()
+    db.query(User).filter(User.id == user_id).delete()
+    db.commit()
+    db.close()
+
+
+def test_sweep_leaves_the_router_to_the_reconciler(expired_user, monkeypatch):
+    events = []
+    monkeypatch.setattr(
+        sweep_module.event_log, "write", lambda event_type, event, **fields: events.append((event_type, fields))
+    )
+    reconciler = ReconcilerStandIn()
+    sweep = ExpirySweep(reconciler)
+
+    assert sweep.run([expired_user]) == 1
+    assert reconciler.wakes == 1
+    assert [(event_type, fields["user_id"]) for event_type, fields in events] == [("user.expired", expired_user)]
+
+    db = SessionLocal()
+    try:
+        user = db.get(User, expired_user)
+        assert (user.is_active, user.desired_state) == (False, "disabled")
+        # Still pending: the reconciler disables it on the router and records that
+        assert user.router_state == "enabled"
+    finally:
+        db.close()
+
+    assert sweep.run([expired_user]) == 0
+    assert reconciler.wakes == 1
@@ -0,0 +1,28 @@
+import threading
+import time
+
+from neighbor_resolver import NeighborResolver
+
+
+def test_watch_leaves_the_refresh_to_the_background_thread(monkeypatch):
+    resolver = NeighborResolver(refresh_interval=3600)
+    release = threading.Event()
+    refreshed_on = []
+
+    def slow_refresh():
+        refreshed_on.append(threading.current_thread().name)
+        release.wait(5)  # e.g. `arp -a` on a busy host
+
+    monkeypatch.setattr(resolver, "refresh", slow_refresh)
+    monkeypatch.setattr(resolver, "_mndp_loop", lambda: None)
+    try:
+        resolver.watch("AA-BB-CC-DD-EE-FF")  # returns without waiting for the refresh
+        assert "aa:bb:cc:dd:ee:ff" in resolver._watched
+        release.set()
+        for _ in range(100):
+            if refreshed_on:
+                break
+            time.sleep(0.01)
+        assert refreshed_on == ["neighbor-refresh"]
+    finally:
+        resolver.stop()
@@ -0,0 +1,41 @@
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture(scope="module")
+def client():
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
+
+
+def wait_for_job(client, job_id, status, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        jobs = client.get("/payments/webhook/jobs", params={"fields": "id,status"}).json()["items"]
+        if any(job["id"] == job_id and job["status"] == status for job in jobs):
+            return
+        time.sleep(0.1)
+    pytest.fail(f"webhook job {job_id} never became {status}")
+
+
+def test_repeat_is_answered_from_dedup_cache(client):
+    body = {"reference": "dup-ref", "payment_status": "FAILED"}
+    first = client.post("/payments/webhook", json=body).json()
+    assert first["status"] == "accepted"
+    assert client.post("/payments/webhook", json=body).json() == {"status": "duplicate"}
+
+
+def test_resend_of_dead_lettered_webhook_is_enqueued(client):
+    # Unknown transaction: the job is dead-lettered at once
+    body = {"reference": "unknown-ref", "payment_status": "COMPLETED"}
+    first = client.post("/payments/webhook", json=body).json()
+    assert first["status"] == "accepted"
+    wait_for_job(client, first["job_id"], "dead")
+
+    resend = client.post("/payments/webhook", json=body).json()
+    assert resend["status"] == "accepted"
+    assert resend["job_id"] != first["job_id"]
@@ -0,0 +1,41 @@
+import os
+import tempfile
+from datetime import datetime
+
+import pytest
+from database import Base, Log, Payment, PaymentTransaction, User
+from explain_check import explain, hot_queries, seed
+from sqlalchemy import create_engine, select
+
+MODELS = (User, Payment, PaymentTransaction, Log)
+
+
+@pytest.fixture(scope="module")
+def seeded():
+    # A scratch database of its own: the planners only skip indexes on tiny tables
+    engine = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'plans.db')}")
+    Base.metadata.create_all(engine)
+    now = datetime.utcnow()
+    seed(engine, MODELS, 5000, now)
+    yield engine, now
+    engine.dispose()
+
+
+def test_hot_queries_use_an_index(seeded):
+    engine, now = seeded
+    failures = {}
+    with engine.connect() as connection:
+        for name, statement in hot_queries(MODELS, now):
+            lines, seq_scans = explain(connection, statement)
+            if seq_scans:
+                failures[name] = lines
+            connection.rollback()
+    assert not failures
+
+
+def test_explain_reports_a_filtered_page_walking_the_table(seeded):
+    engine, _ = seeded
+    statement = select(User).where(User.phone == "0781588379").order_by(User.id.desc()).limit(51)
+    with engine.connect() as connection:
+        _, seq_scans = explain(connection, statement)
+    assert seq_scans == ["users"]
@@ -0,0 +1,47 @@
+import json
+from collections import Counter
+
+import pytest
+from mikrotik_api import MikroTikAPI
+
+
+def api(monkeypatch, routers):
+    monkeypatch.setenv(
+        "MIKROTIK_ROUTERS",
+        json.dumps([{"name": name, "host": f"10.0.0.{i + 2}", "capacity": cap} for i, (name, cap) in enumerate(routers)]),
+    )
+    return MikroTikAPI()
+
+
+def assign(api, count, counts=None):
+    counts = Counter(counts or {})
+    for _ in range(count):
+        counts[api.pick_router(counts)] += 1
+    return counts
+
+
+def test_mixed_config_fills_capacity_routers_too(monkeypatch):
+    routers = api(monkeypatch, [("unlimited", None), ("hq", 200), ("branch", 100)])
+    counts = assign(routers, 300)
+    # Same free share on every router: the unlimited one counts as a 200-user router
+    assert counts["hq"] == pytest.approx(120, abs=2)
+    assert counts["unlimited"] == pytest.approx(120, abs=2)
+    assert counts["branch"] == pytest.approx(60, abs=2)
+
+
+def test_unlimited_router_takes_overflow(monkeypatch):
+    routers = api(monkeypatch, [("hq", 200), ("unlimited", None)])
+    counts = assign(routers, 50, {"hq": 200, "unlimited": 400})
+    assert counts["hq"] == 200
+    assert counts["unlimited"] == 450
+
+
+def test_users_without_router_count_against_default(monkeypatch):
+    routers = api(monkeypatch, [("hq", 100), ("branch", 100)])
+    assert routers.pick_router({None: 60, "hq": 0, "branch": 10}) == "branch"
+
+
+def test_without_capacities_users_spread_evenly(monkeypatch):
+    routers = api(monkeypatch, [("a", None), ("b", None)])
+    counts = assign(routers, 100)
+    assert counts == {"a": 50, "b": 50}
@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta
+
+import pytest
+import usage_accounting as usage_module
+from database import SessionLocal, UsageRollup, UsageSample, User, init_db
+from sqlalchemy import func
+from usage_accounting import UsageAccounting
+
+
+@pytest.fixture
+def user():
+    init_db()
+    db = SessionLocal()
+    user = User(
+        username="usage_user",
+        password="x",
+        plan_type="daily_1000",
+        expiry=datetime.utcnow() + timedelta(days=1),
+    )
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    db.close()
+    yield user_id
+    db = SessionLocal()
+    db.query(UsageRollup).filter(UsageRollup.user_id == user_id).delete()
+    db.query(UsageSample).filter(UsageSample.user_id == user_id).delete()
+    db.query(User).filter(User.id == user_id).delete()
+    db.commit()
+    db.close()
+
+
+def session(bytes_in, bytes_out, uptime):
+    return {
+        "router": "main",
+        "id": "*1",
+        "user": "usage_user",
+        "bytes-in": str(bytes_in),
+        "bytes-out": str(bytes_out),
+        "uptime": f"{uptime}s",
+    }
+
+
+def test_failed_flush_keeps_usage_for_next_flush(user, monkeypatch):
+    accounting = UsageAccounting(flush_interval=3600, poll_interval=30)
+    accounting.ingest([session(100, 10, 5)], datetime.utcnow())
+
+    class FailingCommit:
+        def __init__(self):
+            self.db = SessionLocal()
+
+        def __getattr__(self, name):
+            return getattr(self.db, name)
+
+        def commit(self):
+            raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(usage_module, "SessionLocal", FailingCommit)
+    with pytest.raises(RuntimeError):
+        accounting.flush()
+    assert accounting.failed_flushes == 1
+
+    # More usage arrives before the database is back
+    monkeypatch.setattr(usage_module, "SessionLocal", SessionLocal)
+    accounting.ingest([session(250, 40, 35)], datetime.utcnow())
+    assert accounting.flush() == 1
+
+    db = SessionLocal()
+    try:
+        written = db.query(
+            func.sum(UsageSample.bytes_in), func.sum(UsageSample.bytes_out), func.sum(UsageSample.uptime_seconds)
+        ).filter(UsageSample.user_id == user).one()
+        daily = db.query(UsageRollup).filter(UsageRollup.user_id == user, UsageRollup.period == "day").one()
+    finally:
+        db.close()
+    assert tuple(written) == (250, 40, 35)
+    assert (daily.bytes_in, daily.bytes_out, daily.uptime_seconds) == (250, 40, 35)
+
+
+def test_flushes_into_the_same_bucket_add_up(user):
+    # Two accountants (e.g. two workers) flush the same user into the same hour
+    first = UsageAccounting(flush_interval=3600, poll_interval=30)
+    second = UsageAccounting(flush_interval=3600, poll_interval=30)
+    timestamp = datetime.utcnow()
+    first.ingest([session(100, 10, 5)], timestamp)
+    second.ingest([session(300, 30, 15)], timestamp)
+    assert first.flush(timestamp) == 1
+    assert second.flush(timestamp) == 1
+
+    db = SessionLocal()
+    try:
+        rollups = db.query(UsageRollup).filter(UsageRollup.user_id == user).all()
+    finally:
+        db.close()
+    assert sorted(rollup.period for rollup in rollups) == ["day", "hour"]
+    for rollup in rollups:
+        assert (rollup.bytes_in, rollup.bytes_out, rollup.uptime_seconds) == (400, 40, 20)
@@ -0,0 +1,90 @@
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from database import SessionLocal, SyncState, User, init_db
+from expiry_scheduler import expiry_scheduler
+from user_sync import UserSync
+
+
+class RouterStandIn:
+    """One router whose user list the test controls"""
+
+    def __init__(self, names):
+        self.names = set(names)
+        self.deleted = []
+        self.routers = {"main": None}
+        self.default_router = SimpleNamespace(name="main")
+
+    def list_users_by_router(self):
+        return {"main": sorted(self.names)}
+
+    def delete_users(self, usernames, routers=None):
+        self.deleted.extend(usernames)
+        self.names -= set(usernames)
+        return {username: True for username in usernames}
+
+
+def setup_function():
+    init_db()
+    db = SessionLocal()
+    db.query(SyncState).delete()
+    db.commit()
+    db.close()
+
+
+def test_router_only_user_is_pruned_only_after_grace():
+    router = RouterStandIn(["stray_user"])
+    sync = UserSync(router, prune_grace=0.2)
+
+    first = sync.run(full=True, prune_router=True)
+    assert first["pruned_from_router"] == 0
+    assert first["prune_deferred"] == 1
+
+    time.sleep(0.3)
+    second = sync.run(full=True, prune_router=True)
+    assert second["pruned_from_router"] == 1
+    assert router.deleted == ["stray_user"]
+
+
+def test_user_missing_from_one_run_starts_over():
+    router = RouterStandIn(["fresh_user"])
+    sync = UserSync(router, prune_grace=0.2)
+    sync.run(full=True, prune_router=True)
+
+    # One run doesn't see it on the router at all, so the sighting streak
+    # breaks: when it is router-only again the grace starts from scratch
+    router.names.clear()
+    sync.run(full=True, prune_router=True)
+    router.names.add("fresh_user")
+    time.sleep(0.3)
+    report = sync.run(full=True, prune_router=True)
+    assert report["pruned_from_router"] == 0
+    assert router.deleted == []
+
+
+def test_user_removed_from_database_is_unscheduled():
+    db = SessionLocal()
+    user = User(
+        username="gone_from_router",
+        password="x",
+        plan_type="daily_1000",
+        expiry=datetime.utcnow() + timedelta(hours=1),
+        router="main",
+        router_state="enabled",
+    )
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    db.close()
+    expiry_scheduler.schedule(user_id, datetime.utcnow() + timedelta(hours=1))
+
+    report = UserSync(RouterStandIn([])).run(full=True)
+    assert report["stale_users"] == ["gone_from_router"]
+    assert user_id not in expiry_scheduler._deadlines
+
+    db = SessionLocal()
+    try:
+        assert db.get(User, user_id) is None
+    finally:
+        db.close()
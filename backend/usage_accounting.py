@@ -0,0 +1,254 @@
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+from database import SessionLocal, UsageRollup, UsageSample, User
+from session_monitor import ACTIVE_POLL_INTERVAL
+from sqlalchemy import delete, insert
+from sqlalchemy.dialects import postgresql, sqlite
+
+# Seconds of usage accumulated in memory before one sample per user is written
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "300"))
+# Days raw samples are kept; hourly rollups are kept USAGE_HOURLY_RETENTION_DAYS,
+# daily rollups forever
+USAGE_RAW_RETENTION_DAYS = int(os.getenv("USAGE_RAW_RETENTION_DAYS", "3"))
+USAGE_HOURLY_RETENTION_DAYS = int(os.getenv("USAGE_HOURLY_RETENTION_DAYS", "90"))
+
+# Usernames per ``IN (...)`` lookup
+LOOKUP_CHUNK = 500
+
+UPTIME_UNITS = {"w": 604800, "d": 86400, "h": 3600, "m": 60, "s": 1}
+
+
+def parse_uptime(text):
+    """RouterOS duration ('1w2d3h4m5s', or '1d02:03:04' on some versions) in seconds"""
+    if not text:
+        return 0
+    seconds = 0
+    clock = re.search(r"(\d+):(\d+):(\d+)$", text)
+    if clock:
+        hours, minutes, secs = (int(part) for part in clock.groups())
+        seconds += hours * 3600 + minutes * 60 + secs
+        text = text[: clock.start()]
+    for value, unit in re.findall(r"(\d+)([wdhms])", text):
+        seconds += int(value) * UPTIME_UNITS[unit]
+    return seconds
+
+
+def _counter(value):
+    try:
+        return int(value or 0)
+    except ValueError:
+        return 0
+
+
+class UsageAccounting:
+    """
+    Turn /ip/hotspot/active counters into per-user usage history.
+
+    Registered as a session monitor listener, so it reuses the poll the
+    dashboard already pays for. Sessions report running totals; the last
+    totals of each session (router, .id) are kept in memory and only the
+    difference is accumulated per user. A session whose counters go
+    backwards has restarted under the same id, so its totals count as new
+    usage. Sessions first seen after a restart of this process count from
+    zero only if they began within the last two polls; older ones become a
+    baseline so usage recorded before the restart is not counted twice.
+
+    Every ``flush_interval`` the accumulated deltas are written as one
+    ``usage_samples`` row per user and added to that user's hourly and
+    daily ``usage_rollups`` rows. ``prune()`` drops old samples and hourly
+    rollups, which keeps months of history small.
+    """
+
+    def __init__(self, flush_interval=USAGE_FLUSH_INTERVAL, poll_interval=ACTIVE_POLL_INTERVAL):
+        self.flush_interval = flush_interval
+        self.new_session_uptime = poll_interval * 2
+        self.forget_after = max(poll_interval * 3, 60)
+        self._lock = threading.Lock()
+        self._sessions = {}  # (router, session id) -> (bytes in, bytes out, uptime, last seen)
+        self._pending = {}  # username -> [bytes in, bytes out, uptime seconds]
+        self._last_flush = time.time()
+
+        # Counters for /usage/stats
+        self.resets = 0
+        self.samples_written = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.unknown_users = 0
+        self.last_flush_at = None
+
+    def ingest(self, sessions, timestamp):
+        """Session monitor listener: account the sessions of one poll"""
+        now = time.time()
+        with self._lock:
+            for row in sessions:
+                key = (row.get("router"), row.get("id"))
+                counters = (
+                    _counter(row.get("bytes-in")),
+                    _counter(row.get("bytes-out")),
+                    parse_uptime(row.get("uptime")),
+                )
+                previous = self._sessions.get(key)
+                if previous is None:
+                    fresh = counters[2] <= self.new_session_uptime
+                    delta = counters if fresh else (0, 0, 0)
+                elif any(current < last for current, last in zip(counters, previous)):
+                    # Counters went backwards: the session restarted under the same id
+                    self.resets += 1
+                    delta = counters
+                else:
+                    delta = tuple(current - last for current, last in zip(counters, previous))
+                self._sessions[key] = counters + (now,)
+
+                if any(delta) and row.get("user"):
+                    totals = self._pending.setdefault(row["user"], [0, 0, 0])
+                    for i, value in enumerate(delta):
+                        totals[i] += value
+
+            # Forget sessions that ended
+            cutoff = now - self.forget_after
+            for key in [k for k, v in self._sessions.items() if v[3] < cutoff]:
+                del self._sessions[key]
+
+            due = now - self._last_flush >= self.flush_interval
+
+        if due:
+            self.flush(timestamp)
+
+    def flush(self, timestamp=None):
+        """Write the accumulated usage as samples and add it to the rollups"""
+        timestamp = timestamp or datetime.utcnow()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.time()
+        if not pending:
+            return 0
+
+        db = SessionLocal()
+        try:
+            names = list(pending)
+            users = {}
+            for start in range(0, len(names), LOOKUP_CHUNK):
+                users.update(
+                    (username, (user_id, plan_type))
+                    for user_id, username, plan_type in db.query(
+                        User.id, User.username, User.plan_type
+                    ).filter(User.username.in_(names[start:start + LOOKUP_CHUNK]))
+                )
+            unknown = len(set(names) - set(users))
+
+            samples = [
+                {
+                    "user_id": users[name][0],
+                    "timestamp": timestamp,
+                    "bytes_in": usage[0],
+                    "bytes_out": usage[1],
+                    "uptime_seconds": usage[2],
+                }
+                for name, usage in pending.items()
+                if name in users
+            ]
+            if not samples:
+                self.unknown_users += unknown
+                return 0
+            db.execute(insert(UsageSample), samples)
+
+            plans = {user_id: plan_type for user_id, plan_type in users.values()}
+            hour = timestamp.replace(minute=0, second=0, microsecond=0)
+            day = hour.replace(hour=0)
+            for period, bucket in (("hour", hour), ("day", day)):
+                self._add_to_rollups(db, period, bucket, samples, plans)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            self._requeue(pending)
+            self.failed_flushes += 1
+            print(f"✗ Usage flush failed, kept {len(pending)} users' usage for the next one: {e}")
+            raise
+        finally:
+            db.close()
+
+        self.unknown_users += unknown
+        self.samples_written += len(samples)
+        self.flushes += 1
+        self.last_flush_at = timestamp
+        return len(samples)
+
+    def _requeue(self, pending):
+        """Put unwritten usage back, adding it to what accumulated meanwhile"""
+        with self._lock:
+            for name, usage in pending.items():
+                totals = self._pending.setdefault(name, [0, 0, 0])
+                for i, value in enumerate(usage):
+                    totals[i] += value
+
+    def _add_to_rollups(self, db, period, bucket, samples, plans):
+        """Add sample deltas to the (period, bucket) rollup rows, creating missing ones"""
+        dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+        statement = dialect.insert(UsageRollup)
+        # The addition happens in the database, so flushes that overlap (two
+        # workers, a retried flush) never lose each other's deltas
+        statement = statement.on_conflict_do_update(
+            index_elements=["period", "user_id", "bucket"],
+            set_={
+                column: getattr(UsageRollup, column) + getattr(statement.excluded, column)
+                for column in ("bytes_in", "bytes_out", "uptime_seconds")
+            },
+        )
+        db.execute(
+            statement,
+            [
+                {
+                    "period": period,
+                    "bucket": bucket,
+                    "user_id": sample["user_id"],
+                    "plan_type": plans[sample["user_id"]],
+                    "bytes_in": sample["bytes_in"],
+                    "bytes_out": sample["bytes_out"],
+                    "uptime_seconds": sample["uptime_seconds"],
+                }
+                for sample in samples
+            ],
+        )
+
+    def prune(self):
+        """Drop raw samples and hourly rollups past their retention"""
+        now = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            samples = db.execute(
+                delete(UsageSample).where(
+                    UsageSample.timestamp < now - timedelta(days=USAGE_RAW_RETENTION_DAYS)
+                )
+            ).rowcount
+            hourly = db.execute(
+                delete(UsageRollup).where(
+                    UsageRollup.period == "hour",
+                    UsageRollup.bucket < now - timedelta(days=USAGE_HOURLY_RETENTION_DAYS),
+                )
+            ).rowcount
+            db.commit()
+        finally:
+            db.close()
+        print(f"Usage pruning: removed {samples} samples and {hourly} hourly rollups")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tracked_sessions": len(self._sessions),
+                "pending_users": len(self._pending),
+                "flush_interval": self.flush_interval,
+                "flushes": self.flushes,
+                "failed_flushes": self.failed_flushes,
+                "samples_written": self.samples_written,
+                "counter_resets": self.resets,
+                "unknown_users": self.unknown_users,
+                "last_flush_at": self.last_flush_at,
+            }
+
+
+# Global instance
+usage_accounting = UsageAccounting()
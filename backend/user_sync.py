@@ -0,0 +1,253 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from dashboard_counters import dashboard_counters
+from event_log import event_log
+from expiry_scheduler import expiry_scheduler
+from database import SessionLocal, SyncState, User
+from mikrotik_api import mikrotik
+from sqlalchemy import and_, delete, update
+
+# Users checked per incremental run (the persisted cursor moves through the table)
+SYNC_CHUNK = int(os.getenv("SYNC_CHUNK", "5000"))
+# Run the sync from the scheduler every N minutes (0 = only via POST /sync-users)
+SYNC_INTERVAL_MINUTES = int(os.getenv("SYNC_INTERVAL_MINUTES", "0"))
+# Seconds a router user must stay router-only, in consecutive runs, before
+# prune_router deletes it (a paid customer is on the router a moment before
+# their users row is committed)
+SYNC_PRUNE_GRACE_SECONDS = float(os.getenv("SYNC_PRUNE_GRACE_SECONDS", "600"))
+# Router names per ``username IN (...)`` lookup
+LOOKUP_CHUNK = 500
+# Names listed per router in the report (counts are always complete)
+REPORT_LIMIT = 100
+
+
+class UserSync:
+    """
+    Two-way diff between the users table and the routers.
+
+    Each run lists the routers' user names (one cheap ``.id,name`` print
+    per router) and checks the next ``chunk_size`` provisioned users after
+    the cursor persisted in ``sync_state``, so repeated runs walk a large
+    table a slice at a time. Users the router no longer has (DB-only) are
+    removed - or re-provisioned with ``db_only="restore"`` - in one
+    statement; router users unknown to the database (router-only) are
+    reported and optionally deleted from the router, but only once they
+    were router-only in consecutive runs spanning ``prune_grace`` seconds.
+    A router that cannot be read is skipped rather than taken as empty.
+    """
+
+    def __init__(self, router, chunk_size=SYNC_CHUNK, prune_grace=SYNC_PRUNE_GRACE_SECONDS):
+        self.router = router
+        self.chunk_size = chunk_size
+        self.prune_grace = prune_grace
+        self._lock = threading.Lock()
+        # (router, username) -> first run in an unbroken series that found it router-only
+        self._router_only_since = {}
+
+    def run(self, full=False, db_only="remove", prune_router=False):
+        """Run one sync and return its diff report"""
+        if not self._lock.acquire(blocking=False):
+            return {"success": False, "message": "A sync is already running", "removed": 0}
+        try:
+            return self._run(full, db_only, prune_router)
+        except Exception as e:
+            print(f"User sync failed: {e}")
+            return {"success": False, "message": f"Sync failed: {str(e)}", "removed": 0}
+        finally:
+            self._lock.release()
+
+    def last_report(self):
+        db = SessionLocal()
+        try:
+            state = db.get(SyncState, "users")
+            return json.loads(state.last_report) if state and state.last_report else None
+        finally:
+            db.close()
+
+    def _window(self, db, cursor, full):
+        """
+        Provisioned users to check: (rows, next cursor, pass completed)
+
+        Unprovisioned users and users being deleted are skipped - the
+        reconciler is still working on them.
+        """
+        query = (
+            db.query(User.id, User.username, User.router)
+            .filter(User.router_state.isnot(None), User.desired_state != "deleted")
+            .order_by(User.id)
+        )
+        if full:
+            return query.all(), 0, True
+        rows = query.filter(User.id > cursor).limit(self.chunk_size).all()
+        if len(rows) < self.chunk_size:
+            return rows, 0, True
+        return rows, rows[-1].id, False
+
+    def _run(self, full, db_only, prune_router):
+        started = time.time()
+        now = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            state = db.get(SyncState, "users")
+            if state is None:
+                state = SyncState(name="users", cursor=0)
+                db.add(state)
+
+            # Read the database slice before listing the routers: a user the
+            # reconciler provisions after this read is already on its router
+            # by the time the router is listed, so it is never seen as missing
+            rows, next_cursor, completed = self._window(db, state.cursor or 0, full)
+
+            listed = self.router.list_users_by_router()
+            failed = {
+                name: str(result) or type(result).__name__
+                for name, result in listed.items()
+                if isinstance(result, BaseException)
+            }
+            if len(failed) == len(listed):
+                return {
+                    "success": False,
+                    "message": "Failed to get users from MikroTik",
+                    "removed": 0,
+                    "routers_failed": failed,
+                }
+            on_router = {
+                name: set(names) for name, names in listed.items() if name not in failed
+            }
+
+            events = []  # (event_type, event, user_id, payload), queued once committed
+
+            # DB-only: provisioned here, gone from a router that was read
+            default = self.router.default_router.name
+            missing = []
+            for user_id, username, router in rows:
+                router = router if router in self.router.routers else default
+                if router in on_router and username not in on_router[router]:
+                    missing.append((user_id, username, router))
+
+            if missing:
+                # Same guards as the window, in case the user changed meanwhile
+                condition = and_(
+                    User.id.in_([user_id for user_id, _, _ in missing]),
+                    User.router_state.isnot(None),
+                    User.desired_state != "deleted",
+                )
+                if db_only == "restore":
+                    statement = update(User).where(condition).values(router_state=None)
+                    event_type = "sync.restored"
+                    event = "Re-provisioning user {} missing from router {} during sync"
+                else:
+                    statement = delete(User).where(condition)
+                    event_type = "sync.removed"
+                    event = "Removed stale user {} (missing from router {}) during sync"
+                affected = set(
+                    db.execute(
+                        statement.returning(User.id).execution_options(synchronize_session=False)
+                    ).scalars()
+                )
+                missing = [entry for entry in missing if entry[0] in affected]
+                events += [
+                    (event_type, event.format(username, router), user_id, {"router": router})
+                    for user_id, username, router in missing
+                ]
+
+            # Router-only: on a router but not in the database at all
+            router_only = {}
+            for name, names in on_router.items():
+                names = list(names)
+                known = set()
+                for start in range(0, len(names), LOOKUP_CHUNK):
+                    chunk = names[start:start + LOOKUP_CHUNK]
+                    known.update(
+                        username
+                        for (username,) in db.query(User.username).filter(User.username.in_(chunk))
+                    )
+                extra = sorted(set(names) - known)
+                if extra:
+                    router_only[name] = extra
+
+            # Only users still router-only since an earlier run count as
+            # stray; one that was just provisioned has its row by then
+            since = {
+                (name, username): self._router_only_since.get((name, username), now)
+                for name, names in router_only.items()
+                for username in names
+            }
+            self._router_only_since = since
+            prunable = {
+                key for key, first in since.items() if (now - first).total_seconds() >= self.prune_grace
+            }
+
+            pruned = 0
+            if prune_router and prunable:
+                results = self.router.delete_users(
+                    [username for _, username in prunable],
+                    {username: name for name, username in prunable},
+                )
+                pruned = sum(results.values())
+                events.append(
+                    ("sync.pruned", f"Deleted {pruned} router-only users during sync", None, {"count": pruned})
+                )
+
+            state.cursor = next_cursor
+            state.last_run_at = now
+            if completed:
+                state.last_pass_completed_at = now
+
+            stale_users = [username for _, username, _ in missing]
+            report = {
+                "success": True,
+                "message": (
+                    f"Sync completed. "
+                    f"{'Re-provisioning' if db_only == 'restore' else 'Removed'} "
+                    f"{len(missing)} stale users."
+                ),
+                "removed": len(missing) if db_only != "restore" else 0,
+                "restored": len(missing) if db_only == "restore" else 0,
+                "stale_users": stale_users,
+                "db_only": [
+                    {"username": username, "router": router} for _, username, router in missing
+                ],
+                "router_only": {
+                    name: {"count": len(names), "users": names[:REPORT_LIMIT]}
+                    for name, names in router_only.items()
+                },
+                "pruned_from_router": pruned,
+                "prune_deferred": len(since) - len(prunable) if prune_router else 0,
+                "routers_failed": failed,
+                "checked": len(rows),
+                "cursor": next_cursor,
+                "pass_completed": completed,
+                "mikrotik_total": sum(len(names) for names in on_router.values()),
+                "database_total": db.query(User)
+                .filter(User.desired_state != "deleted")
+                .count(),
+                "started_at": now.isoformat(),
+                "duration_ms": round((time.time() - started) * 1000, 1),
+            }
+            state.last_report = json.dumps(report)
+            db.commit()
+            for event_type, event, user_id, payload in events:
+                event_log.write(event_type, event, user_id=user_id, payload=payload, timestamp=now)
+            if db_only != "restore":
+                for user_id, _, _ in missing:
+                    expiry_scheduler.cancel(user_id)
+            if missing and db_only != "restore":
+                dashboard_counters.refresh()  # rows removed in bulk
+
+            print(
+                f"User sync: checked {len(rows)}, DB-only {len(missing)}, "
+                f"router-only {sum(len(n) for n in router_only.values())} "
+                f"in {report['duration_ms']}ms"
+            )
+            return report
+        finally:
+            db.close()
+
+
+# Global instance
+user_sync = UserSync(mikrotik)
@@ -0,0 +1,314 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+from database import AsyncSessionLocal, SessionLocal, WebhookJob
+from event_log import event_log
+from sqlalchemy import delete, func, select, update
+
+# Jobs processed concurrently (asyncio tasks on the API's event loop)
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+# Attempts before a job is moved to the dead letters
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+# Seconds before the first retry, doubled after every failure up to WEBHOOK_RETRY_MAX
+WEBHOOK_RETRY_BASE = float(os.getenv("WEBHOOK_RETRY_BASE", "5"))
+WEBHOOK_RETRY_MAX = float(os.getenv("WEBHOOK_RETRY_MAX", "3600"))
+# Seconds an idle worker waits before looking for due jobs (new jobs wake it at once)
+WEBHOOK_POLL_INTERVAL = float(os.getenv("WEBHOOK_POLL_INTERVAL", "1"))
+# A job still 'processing' after this many seconds (its worker died) is run again
+WEBHOOK_LOCK_TIMEOUT = float(os.getenv("WEBHOOK_LOCK_TIMEOUT", "300"))
+# Days finished jobs are kept; dead jobs are kept until retried
+WEBHOOK_JOB_RETENTION_DAYS = int(os.getenv("WEBHOOK_JOB_RETENTION_DAYS", "30"))
+
+# Seconds of finished jobs behind the throughput and latency figures
+METRICS_WINDOW = 300
+
+
+class PermanentJobError(Exception):
+    """The job can never succeed (e.g. unknown transaction); it is dead-lettered at once"""
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(int(len(values) * fraction), len(values) - 1)] * 1000, 1)
+
+
+class WebhookQueue:
+    """
+    Durable queue for payment webhooks, stored in ``webhook_jobs``.
+
+    The webhook endpoint only stores the raw payload (``enqueue()``) and
+    answers, so a slow router or WhatsApp call never delays ZenoPay's
+    acknowledgement. ``workers`` tasks claim due jobs oldest first with
+    ``SELECT ... FOR UPDATE SKIP LOCKED`` (on PostgreSQL; elsewhere a
+    guarded UPDATE decides which worker wins), so any number of workers,
+    in any number of processes, never run the same job twice.
+
+    A job whose handler raises is retried with exponential backoff;
+    after ``max_attempts`` failures, or at once on ``PermanentJobError``,
+    it becomes 'dead' and waits for ``retry()``. A job left 'processing'
+    by a worker that died is picked up again after ``lock_timeout``.
+    """
+
+    def __init__(
+        self,
+        workers=WEBHOOK_WORKERS,
+        max_attempts=WEBHOOK_MAX_ATTEMPTS,
+        poll_interval=WEBHOOK_POLL_INTERVAL,
+        lock_timeout=WEBHOOK_LOCK_TIMEOUT,
+    ):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.lock_timeout = lock_timeout
+        self._handler = None
+        self._on_failure = None
+        self._tasks = []
+        self._wake = None
+        self._stop = False
+        self._last_recover = 0.0
+        self._recent = deque()  # (finished at, seconds due before started, seconds running)
+
+        # Counters for /payments/webhook/jobs/stats
+        self.received = 0
+        self.done = 0
+        self.retried = 0
+        self.dead = 0
+        self.in_flight = 0
+        self.last_error = None
+
+    async def enqueue(self, db, payload, tx_ref=None, source="zenopay"):
+        """Store a received webhook; returns the job"""
+        job = WebhookJob(source=source, payload=payload, tx_ref=tx_ref, status="pending")
+        db.add(job)
+        await db.commit()
+        self.received += 1
+        self.wake()
+        return job
+
+    def wake(self):
+        if self._wake:
+            self._wake.set()
+
+    def start(self, handler, on_failure=None):
+        """
+        Run ``await handler(db, payload)`` for every job on the running event loop;
+        ``on_failure(job)`` is called whenever a job fails (retried or dead)
+        """
+        if self._tasks:
+            return
+        self._handler = handler
+        self._on_failure = on_failure
+        self._stop = False
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        print(f"✓ Webhook queue started ({self.workers} workers)")
+
+    async def stop(self, timeout=10):
+        """Let running jobs finish (up to ``timeout`` seconds) and stop the workers"""
+        self._stop = True
+        self.wake()
+        if self._tasks:
+            _, running = await asyncio.wait(self._tasks, timeout=timeout)
+            for task in running:
+                task.cancel()  # recovered after lock_timeout
+        self._tasks = []
+
+    async def _worker(self):
+        while not self._stop:
+            self._wake.clear()
+            try:
+                if time.time() - self._last_recover >= 60:
+                    self._last_recover = time.time()
+                    await self._recover()
+                job = await self._claim()
+            except Exception as e:
+                print(f"✗ Webhook queue: claiming a job failed: {e}")
+                job = None
+            if job is False:
+                continue  # another worker won this one; look again
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _claim(self):
+        """The next due job, now 'processing'; None if none is due, False if lost to another worker"""
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            job = await db.scalar(
+                select(WebhookJob)
+                .where(WebhookJob.status == "pending", WebhookJob.run_at <= now)
+                .order_by(WebhookJob.run_at)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )
+            if job is None:
+                return None
+            # Unchanged since it was read: without row locks (SQLite) another
+            # worker may have run and re-queued it in between
+            claimed = await db.execute(
+                update(WebhookJob)
+                .where(
+                    WebhookJob.id == job.id,
+                    WebhookJob.status == "pending",
+                    WebhookJob.attempts == job.attempts,
+                    WebhookJob.run_at == job.run_at,
+                )
+                .values(status="processing", locked_at=now, attempts=WebhookJob.attempts + 1)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+            if claimed.rowcount != 1:
+                return False
+            job.status, job.locked_at, job.attempts = "processing", now, job.attempts + 1
+            return job
+
+    async def _recover(self):
+        """Hand jobs whose worker died back to the queue"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.lock_timeout)
+        async with AsyncSessionLocal() as db:
+            recovered = await db.execute(
+                update(WebhookJob)
+                .where(WebhookJob.status == "processing", WebhookJob.locked_at < cutoff)
+                .values(status="pending", locked_at=None)
+            )
+            await db.commit()
+        if recovered.rowcount:
+            print(f"Webhook queue: recovered {recovered.rowcount} stalled jobs")
+
+    async def _run(self, job):
+        started = time.time()
+        self.in_flight += 1
+        error, permanent, result = None, False, None
+        try:
+            async with AsyncSessionLocal() as db:
+                result = await self._handler(db, job.payload)
+        except PermanentJobError as e:
+            error, permanent = str(e), True
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        finally:
+            self.in_flight -= 1
+
+        now = datetime.utcnow()
+        values = {"locked_at": None}
+        if error is None:
+            values.update(status="done", completed_at=now, last_error=None, result=json.dumps(result, default=str))
+            self.done += 1
+            self._recent.append((time.time(), (job.locked_at - job.run_at).total_seconds(), time.time() - started))
+        elif permanent or job.attempts >= self.max_attempts:
+            values.update(status="dead", completed_at=now, last_error=error)
+            self.dead += 1
+            self.last_error = error
+            print(f"✗ Webhook job {job.id} ({job.tx_ref}) dead after {job.attempts} attempts: {error}")
+            event_log.write(
+                "webhook.dead",
+                f"Webhook job {job.id} dead after {job.attempts} attempts: {error}",
+                tx_ref=job.tx_ref,
+                payload={"job_id": job.id, "attempts": job.attempts, "error": error},
+            )
+        else:
+            delay = min(WEBHOOK_RETRY_BASE * 2 ** (job.attempts - 1), WEBHOOK_RETRY_MAX)
+            values.update(status="pending", run_at=now + timedelta(seconds=delay), last_error=error)
+            self.retried += 1
+            self.last_error = error
+            print(f"Webhook job {job.id} ({job.tx_ref}) failed, retry in {delay:.0f}s: {error}")
+            event_log.write(
+                "webhook.failed",
+                f"Webhook job {job.id} failed (attempt {job.attempts}), retrying in {delay:.0f}s: {error}",
+                tx_ref=job.tx_ref,
+                payload={"job_id": job.id, "attempts": job.attempts, "error": error},
+            )
+
+        if error is not None and self._on_failure:
+            try:
+                self._on_failure(job)
+            except Exception as e:
+                print(f"✗ Webhook job {job.id} failure hook failed: {e}")
+
+        async with AsyncSessionLocal() as db:
+            # Skip the write if the job was recovered and claimed again meanwhile
+            await db.execute(
+                update(WebhookJob)
+                .where(WebhookJob.id == job.id, WebhookJob.locked_at == job.locked_at)
+                .values(**values)
+            )
+            await db.commit()
+
+    async def retry(self, db, job_id):
+        """Queue a dead job again with a fresh set of attempts; False if it is not dead"""
+        requeued = await db.execute(
+            update(WebhookJob)
+            .where(WebhookJob.id == job_id, WebhookJob.status == "dead")
+            .values(status="pending", attempts=0, run_at=datetime.utcnow(), completed_at=None)
+        )
+        await db.commit()
+        if requeued.rowcount:
+            self.wake()
+        return bool(requeued.rowcount)
+
+    def prune(self):
+        """Drop finished jobs past their retention"""
+        cutoff = datetime.utcnow() - timedelta(days=WEBHOOK_JOB_RETENTION_DAYS)
+        db = SessionLocal()
+        try:
+            removed = db.execute(
+                delete(WebhookJob).where(WebhookJob.status == "done", WebhookJob.created_at < cutoff)
+            ).rowcount
+            db.commit()
+        finally:
+            db.close()
+        print(f"Webhook queue pruning: removed {removed} finished jobs")
+
+    async def stats(self, db):
+        """Queue depth by status plus throughput and latency of recently finished jobs"""
+        now = datetime.utcnow()
+        rows = await db.execute(
+            select(WebhookJob.status, func.count(), func.min(WebhookJob.run_at))
+            .where(WebhookJob.status.in_(["pending", "processing", "dead"]))
+            .group_by(WebhookJob.status)
+        )
+        depth = {"pending": 0, "processing": 0, "dead": 0}
+        oldest_due = None
+        for status, count, first_run_at in rows:
+            depth[status] = count
+            if status == "pending" and first_run_at and first_run_at <= now:
+                oldest_due = round((now - first_run_at).total_seconds(), 1)
+
+        cutoff = time.time() - METRICS_WINDOW
+        while self._recent and self._recent[0][0] < cutoff:
+            self._recent.popleft()
+        lags = [lag for _, lag, _ in self._recent]
+        runs = [run for _, _, run in self._recent]
+        return {
+            "workers": len(self._tasks),
+            "in_flight": self.in_flight,
+            "depth": depth,
+            "oldest_due_seconds": oldest_due,
+            "received": self.received,
+            "done": self.done,
+            "retried": self.retried,
+            "dead": self.dead,
+            "last_error": self.last_error,
+            "recent": {
+                "window_seconds": METRICS_WINDOW,
+                "jobs_per_minute": round(len(self._recent) * 60 / METRICS_WINDOW, 1),
+                "wait_p50_ms": _percentile(lags, 0.5),
+                "wait_p95_ms": _percentile(lags, 0.95),
+                "run_p50_ms": _percentile(runs, 0.5),
+                "run_p95_ms": _percentile(runs, 0.95),
+            },
+        }
+
+
+# Global instance
+webhook_queue = WebhookQueue()
@@ -9,6 +9,7 @@ WHATSAPP_ACCESS_TOKEN = os.getenv("WHATSAPP_ACCESS_TOKEN")
 WHATSAPP_PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID")
 WHATSAPP_BUSINESS_ID = os.getenv("WHATSAPP_BUSINESS_ID")
 WHATSAPP_API_VERSION = os.getenv("WHATSAPP_API_VERSION", "v21.0")
+WHATSAPP_API_BASE_URL = os.getenv("WHATSAPP_API_BASE_URL", "https://graph.facebook.com")
 
 
 class WhatsAppService:
@@ -17,7 +18,7 @@ class WhatsAppService:
         self.phone_number_id = WHATSAPP_PHONE_NUMBER_ID
         self.business_id = WHATSAPP_BUSINESS_ID
         self.api_version = WHATSAPP_API_VERSION
-        self.base_url = f"https://graph.facebook.com/{self.api_version}/{self.phone_number_id}/messages"
+        self.base_url = f"{WHATSAPP_API_BASE_URL}/{self.api_version}/{self.phone_number_id}/messages"
 
     def format_phone_number(self, phone: str) -> str:
         """
@@ -16,7 +16,11 @@ function ActiveUsers() {
             const response = await axios.get(`${API_BASE_URL}/active-connections`);
             setActiveUsers(response.data.users || []);
             setCount(response.data.count || 0);
-            setLastUpdate(new Date().toLocaleTimeString());
+            // Snapshot time comes from the backend poller (UTC, no zone suffix)
+            const snapshotTime = response.data.timestamp
+                ? new Date(response.data.timestamp + 'Z')
+                : new Date();
+            setLastUpdate(snapshotTime.toLocaleTimeString() + (response.data.stale ? ' (router unreachable)' : ''));
             setLoading(false);
         } catch (error) {
             console.error('Error fetching active users:', error);
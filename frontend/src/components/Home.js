@@ -56,6 +56,16 @@ function Home() {
             <h3>Total Payments</h3>
             <div className="number">{stats.total_payments}</div>
           </div>
+
+          <div className="stat-card green">
+            <h3>Revenue Today</h3>
+            <div className="number">{stats.revenue_today.toLocaleString()} TZS</div>
+          </div>
+
+          <div className="stat-card blue">
+            <h3>Revenue This Month</h3>
+            <div className="number">{stats.revenue_month.toLocaleString()} TZS</div>
+          </div>
         </div>
       )}
     </div>
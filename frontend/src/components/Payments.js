@@ -2,9 +2,13 @@ import React, { useState, useEffect } from 'react';
 import axios from 'axios';
 import API_BASE_URL from '../config';
 
+const PAGE_SIZE = 50;
+
 function Payments() {
   const [users, setUsers] = useState([]);
+  const [userSearch, setUserSearch] = useState('');
   const [payments, setPayments] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [formData, setFormData] = useState({
     user_id: '',
     amount: ''
@@ -13,23 +17,38 @@ function Payments() {
   const [loading, setLoading] = useState(false);
 
   useEffect(() => {
-    fetchUsers();
     fetchPayments();
   }, []);
 
-  const fetchUsers = async () => {
+  useEffect(() => {
+    // Matching users for the picker, fetched as the admin types
+    const timeout = setTimeout(() => fetchUsers(userSearch), 300);
+    return () => clearTimeout(timeout);
+  }, [userSearch]);
+
+  const fetchUsers = async (search) => {
     try {
-      const response = await axios.get(`${API_BASE_URL}/users`);
-      setUsers(response.data);
+      const response = await axios.get(`${API_BASE_URL}/users`, {
+        params: { fields: 'id,username,plan_type', q: search || undefined, limit: 20 }
+      });
+      setUsers(response.data.items);
     } catch (error) {
       console.error('Error fetching users:', error);
     }
   };
 
-  const fetchPayments = async () => {
+  const fetchPayments = async (cursor = null) => {
     try {
-      const response = await axios.get(`${API_BASE_URL}/payments`);
-      setPayments(response.data);
+      const response = await axios.get(`${API_BASE_URL}/payments`, {
+        params: {
+          fields: 'id,date,user_id,username,amount,verified',
+          limit: PAGE_SIZE,
+          cursor: cursor || undefined
+        }
+      });
+      const { items, next_cursor } = response.data;
+      setPayments((previous) => (cursor ? [...previous, ...items] : items));
+      setNextCursor(next_cursor);
     } catch (error) {
       console.error('Error fetching payments:', error);
     }
@@ -79,9 +98,8 @@ function Payments() {
     return date.toLocaleString();
   };
 
-  const getUserName = (userId) => {
-    const user = users.find(u => u.id === userId);
-    return user ? user.username : `User #${userId}`;
+  const getUserName = (payment) => {
+    return payment.username || `User #${payment.user_id}`;
   };
 
   return (
@@ -96,6 +114,17 @@ function Payments() {
         )}
 
         <form onSubmit={handleSubmit}>
+          <div className="form-group">
+            <label htmlFor="user_search">Find User</label>
+            <input
+              type="text"
+              id="user_search"
+              value={userSearch}
+              onChange={(e) => setUserSearch(e.target.value)}
+              placeholder="Start typing a username"
+            />
+          </div>
+
           <div className="form-group">
             <label htmlFor="user_id">Select User</label>
             <select
@@ -151,7 +180,7 @@ function Payments() {
             {payments.map((payment) => (
               <tr key={payment.id}>
                 <td>{formatDate(payment.date)}</td>
-                <td>{getUserName(payment.user_id)}</td>
+                <td>{getUserName(payment)}</td>
                 <td>${payment.amount.toFixed(2)}</td>
                 <td>
                   <span className="status-active">
@@ -163,6 +192,14 @@ function Payments() {
           </tbody>
         </table>
 
+        {nextCursor && (
+          <div className="load-more">
+            <button className="btn btn-primary" onClick={() => fetchPayments(nextCursor)}>
+              Load more
+            </button>
+          </div>
+        )}
+
         {payments.length === 0 && (
           <p style={{ textAlign: 'center', marginTop: '2rem', color: '#666' }}>
             No payments recorded yet.
@@ -1,28 +1,58 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useCallback, useRef } from 'react';
 import axios from 'axios';
 import API_BASE_URL from '../config';
 
+const PAGE_SIZE = 50;
+// Only the columns this page shows
+const USER_FIELDS = 'id,username,plan_type,expiry,is_active,created_at,desired_state,router_state';
+
 function UserList() {
   const [users, setUsers] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [filters, setFilters] = useState({ q: '', plan_type: '', is_active: '' });
   const [loading, setLoading] = useState(true);
   const [message, setMessage] = useState(null);
+  const loadedCount = useRef(PAGE_SIZE);
+
+  const fetchUsers = useCallback(async (cursor = null) => {
+    const params = { fields: USER_FIELDS };
+    Object.entries(filters).forEach(([key, value]) => {
+      if (value !== '') params[key] = value;
+    });
+    if (cursor) {
+      params.cursor = cursor;
+      params.limit = PAGE_SIZE;
+    } else {
+      // Refreshing reloads as many rows as are on screen (max 500)
+      params.limit = Math.min(Math.max(loadedCount.current, PAGE_SIZE), 500);
+    }
 
-  useEffect(() => {
-    fetchUsers();
-    // Auto-refresh every 30 seconds
-    const interval = setInterval(fetchUsers, 30000);
-    return () => clearInterval(interval);
-  }, []);
-
-  const fetchUsers = async () => {
     try {
-      const response = await axios.get(`${API_BASE_URL}/users`);
-      setUsers(response.data);
+      const response = await axios.get(`${API_BASE_URL}/users`, { params });
+      const { items, next_cursor } = response.data;
+      setUsers((previous) => {
+        const rows = cursor ? [...previous, ...items] : items;
+        loadedCount.current = rows.length;
+        return rows;
+      });
+      setNextCursor(next_cursor);
       setLoading(false);
     } catch (error) {
       console.error('Error fetching users:', error);
       setLoading(false);
     }
+  }, [filters]);
+
+  useEffect(() => {
+    fetchUsers();
+    // Auto-refresh every 30 seconds
+    const interval = setInterval(() => fetchUsers(), 30000);
+    return () => clearInterval(interval);
+  }, [fetchUsers]);
+
+  const handleFilterChange = (e) => {
+    loadedCount.current = PAGE_SIZE;
+    setFilters({ ...filters, [e.target.name]: e.target.value });
   };
 
   const toggleUser = async (userId) => {
@@ -57,17 +87,8 @@ function UserList() {
     try {
       const response = await axios.delete(`${API_BASE_URL}/users/${userId}`);
 
-      // Check if there's a warning (partial success)
-      if (response.data.warning) {
-        setMessage({
-          type: 'warning',
-          text: `User "${username}" deleted from database. Warning: ${response.data.warning}`
-        });
-        setTimeout(() => setMessage(null), 8000);
-      } else {
-        setMessage({ type: 'success', text: `User "${username}" deleted successfully from both systems` });
-        setTimeout(() => setMessage(null), 3000);
-      }
+      setMessage({ type: 'success', text: response.data.message });
+      setTimeout(() => setMessage(null), 3000);
 
       fetchUsers();
     } catch (error) {
@@ -99,6 +120,26 @@ function UserList() {
         </div>
       )}
 
+      <div className="filters">
+        <input
+          type="text"
+          name="q"
+          value={filters.q}
+          onChange={handleFilterChange}
+          placeholder="Search username"
+        />
+        <select name="plan_type" value={filters.plan_type} onChange={handleFilterChange}>
+          <option value="">All plans</option>
+          <option value="daily_1000">Daily</option>
+          <option value="monthly_1000">Monthly</option>
+        </select>
+        <select name="is_active" value={filters.is_active} onChange={handleFilterChange}>
+          <option value="">All statuses</option>
+          <option value="true">Active</option>
+          <option value="false">Inactive</option>
+        </select>
+      </div>
+
       <table>
         <thead>
           <tr>
@@ -124,6 +165,9 @@ function UserList() {
                 <span className={user.is_active ? 'status-active' : 'status-expired'}>
                   {user.is_active ? 'Active' : 'Inactive'}
                 </span>
+                {user.router_state !== user.desired_state && (
+                  <span title="Waiting for the router to be updated"> (syncing)</span>
+                )}
               </td>
               <td>{formatDate(user.created_at)}</td>
               <td>
@@ -153,6 +197,14 @@ function UserList() {
         </tbody>
       </table>
 
+      {nextCursor && (
+        <div className="load-more">
+          <button className="btn btn-primary" onClick={() => fetchUsers(nextCursor)}>
+            Load more
+          </button>
+        </div>
+      )}
+
       {users.length === 0 && (
         <p style={{ textAlign: 'center', marginTop: '2rem', color: '#666' }}>
           No users found. Add your first user to get started.